@@ -0,0 +1,154 @@
+'''Synthetic data for the benchmarks: binaries, tag files and corpora.
+
+Everything is generated from a seed, so the same arguments always give the
+same bytes and the same tags, and results from different runs compare like
+with like.'''
+
+from array import array
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from hanalyse.tags import (  # noqa: E402
+    TagRoles, TagStore, TagTypes, write_tags)
+
+__all__ = ['parse_size', 'synthetic_binary', 'synthetic_tags',
+           'synthetic_sample', 'CORPUS_HEADER', 'CORPUS_PLANTED']
+
+# Binaries are written this much at a time, cycling through the kinds of
+# region below every REGION_SIZE bytes.
+CHUNK_SIZE = 1 << 20
+REGION_SIZE = 1 << 16
+
+_TEXT = (
+    b'The quick brown fox jumps over the lazy dog. '
+    b'name=value; path=/usr/share/data; version=1.2.3\n')
+
+# Types given to synthetic tags, and their widths
+TAG_TYPES = (
+    (TagTypes.Uint8, 1),
+    (TagTypes.Uint16, 2),
+    (TagTypes.Uint32, 4),
+    (TagTypes.Uint64, 8),
+    (TagTypes.Int32, 4),
+    (TagTypes.Char, 1),
+    (TagTypes.String, 16),
+)
+# Every so many tags is a larger Data tag holding those that follow it, so
+# that tags overlap as real structures do.
+STRUCTURE_EVERY = 32
+
+_SUFFIXES = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_size(text):
+    '''Reads a size such as 4096, 64K, 1M or 4G.'''
+    text = text.strip().upper()
+    if text and text[-1] in _SUFFIXES:
+        return int(text[:-1]) * _SUFFIXES[text[-1]]
+    return int(text)
+
+
+def _pointer_block(rng, size):
+    '''Twice a region of aligned little-endian pointers into the file.
+    Pointer regions are slices of this, as drawing every pointer afresh
+    would make the largest binaries slow to generate.'''
+    pointers = array('I', (
+        rng.randrange(min(size, 1 << 32)) & ~3
+        for _ in range(REGION_SIZE // 2)))
+    if sys.byteorder != 'little':
+        pointers.byteswap()
+    return pointers.tobytes()
+
+
+def _region(rng, kind, length, pointers):
+    '''The bytes of one region: zeros, text, random bytes, or pointers.'''
+    if kind == 0:
+        return bytes(length)
+    if kind == 1:
+        repeats = -(-length // len(_TEXT))
+        return (_TEXT * repeats)[:length]
+    if kind == 2:
+        return rng.randbytes(length)
+    start = 4 * rng.randrange(REGION_SIZE // 4)
+    return pointers[start:start + length]
+
+
+def synthetic_binary(filename, size, seed=1):
+    '''Writes a binary of the given size made of zero, text, random and
+    pointer regions in turn.'''
+    rng = random.Random(seed)
+    pointers = _pointer_block(rng, size)
+    with open(filename, 'wb') as binary:
+        written = 0
+        while written < size:
+            chunk = bytearray()
+            end = min(written + CHUNK_SIZE, size)
+            position = written
+            while position < end:
+                length = min(REGION_SIZE - position % REGION_SIZE,
+                             end - position)
+                kind = (position // REGION_SIZE) % 4
+                chunk += _region(rng, kind, length, pointers)
+                position += length
+            binary.write(chunk)
+            written = end
+
+
+def synthetic_tags(filename, count, span, seed=1):
+    '''Writes a YAML tag file of count tags spread over the first span
+    bytes of a file, sorted by start, with a Data tag over each run of
+    STRUCTURE_EVERY tags, which is their parent. Returns the TagStore
+    written.'''
+    rng = random.Random(seed)
+    stride = max(span // max(count, 1), 1)
+    tags = TagStore()
+    for index in range(count):
+        start = index * stride
+        if index % STRUCTURE_EVERY == 0:
+            end = min(start + STRUCTURE_EVERY * stride, span) - 1
+            row = tags.append(
+                name='struct_{}'.format(index), start=start, end=end,
+                type=TagTypes.Unknown, role=TagRoles.Data,
+                comment='Structure {}'.format(index // STRUCTURE_EVERY))
+            structure = tags[row].identifier
+            continue
+        tag_type, width = rng.choice(TAG_TYPES)
+        start += rng.randrange(max(stride - width, 1))
+        tags.append(
+            name='field_{}'.format(index), start=start,
+            end=start + min(width, stride) - 1, type=tag_type,
+            role=TagRoles.Unknown, parent=structure)
+    write_tags(filename, tags)
+    return tags
+
+
+# A corpus sample has a header holding its length, a count and element
+# size, and the offset of a table of count elements, each of which starts
+# with the same marker.
+CORPUS_HEADER = 256
+CORPUS_ELEMENT_SIZE = 0x20
+CORPUS_PLANTED = {
+    0x10: 'Size',
+    0x14: 'Count',
+    0x18: 'Offset',
+}
+
+
+def synthetic_sample(rng):
+    '''One sample of a synthetic format, with the fields in
+    CORPUS_PLANTED.'''
+    count = rng.randrange(10, 400)
+    table = CORPUS_HEADER + 16 * rng.randrange(0, 32)
+    length = table + count * CORPUS_ELEMENT_SIZE
+    sample = bytearray(rng.randbytes(length))
+    sample[0:4] = b'SYNT'
+    struct.pack_into(
+        '<IHHI', sample, 0x10, length, count, CORPUS_ELEMENT_SIZE, table)
+    for element in range(count):
+        start = table + element * CORPUS_ELEMENT_SIZE
+        sample[start:start + 8] = b'ELEM\x00\x00\x00\x00'
+    return bytes(sample)
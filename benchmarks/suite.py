@@ -0,0 +1,595 @@
+'''The hanalyse benchmark suite.
+
+Times the hot paths on synthetic binaries and tag files of several sizes
+and writes the results as JSON, so that a run can be compared with an
+earlier one. Qt is run on its offscreen platform, so no display is needed.
+Run from the top of the repository:
+
+    python benchmarks/suite.py -o results.json
+    python benchmarks/suite.py --compare results.json --only tagmodel
+
+Generated data is kept in benchmarks/data and reused by later runs.'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from generators import (  # noqa: E402
+    CORPUS_HEADER, CORPUS_PLANTED, parse_size, synthetic_binary,
+    synthetic_sample, synthetic_tags)
+from hanalyse.decoding import (  # noqa: E402
+    TYPEFORMATS, TagDecoder, mapped_file)
+from hanalyse.inference import fields, infer  # noqa: E402
+from hanalyse.pointers import PointerIndex  # noqa: E402
+from hanalyse.search import search_file  # noqa: E402
+from hanalyse.tags import Tag, TagRoles, TagStore, TagTypes  # noqa: E402
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), 'data')
+
+DEFAULT_SIZES = '1M,64M'
+DEFAULT_TAGS = '100,10000,100000'
+FULL_SIZES = '1M,64M,1G,4G'
+FULL_TAGS = '100,10000,100000,1000000'
+
+# Tag files cover this much of a binary, whatever their number of tags
+TAG_SPAN = 16 << 20
+# Bumped when synthetic_tags changes, so that older tag files are not used
+TAGS_VERSION = 3
+# Cursor positions looked up per run of the lookup benchmark
+LOOKUPS = 10000
+# Pages of the tag table painted per run of the scroll benchmark
+SCROLL_PAGES = 500
+# Slower than this ratio to the compared run is reported as a regression
+REGRESSION = 1.10
+
+BENCHMARKS = []
+
+
+def benchmark(function):
+    '''Adds a function taking a Suite to the benchmarks, by its name.'''
+    BENCHMARKS.append(function)
+    return function
+
+
+class Suite(object):
+    '''Times benchmark cases and collects their results, generating the
+    data they need on first use.'''
+
+    def __init__(self, sizes, tag_counts, repeat, data_directory):
+        self.sizes = sizes
+        self.tag_counts = tag_counts
+        self.repeat = repeat
+        self._data_directory = data_directory
+        self.results = []
+        os.makedirs(data_directory, exist_ok=True)
+
+    def binary(self, size):
+        '''The name of a synthetic binary of a size.'''
+        filename = os.path.join(
+            self._data_directory, 'binary-{}.bin'.format(size))
+        if not os.path.exists(filename):
+            synthetic_binary(filename + '.tmp', size)
+            os.replace(filename + '.tmp', filename)
+        return filename
+
+    def tag_file(self, count):
+        '''The name of a synthetic tag file of count tags over TAG_SPAN.'''
+        filename = os.path.join(
+            self._data_directory,
+            'tags-{}-v{}.yaml'.format(count, TAGS_VERSION))
+        if not os.path.exists(filename):
+            synthetic_tags(filename + '.tmp', count, TAG_SPAN)
+            os.replace(filename + '.tmp', filename)
+        return filename
+
+    def time(self, name, function, setup=None, **params):
+        '''Times function, after setup if given, repeat times. function may
+        return a dict of extra figures to keep with the result.'''
+        runs = []
+        extra = None
+        for run in range(self.repeat):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            extra = function()
+            runs.append(time.perf_counter() - started)
+        result = {
+            'name': name,
+            'params': params,
+            'best': min(runs),
+            'median': statistics.median(runs),
+            'runs': runs,
+        }
+        if extra:
+            result['extra'] = extra
+        self.results.append(result)
+        print('{:<28} {:<36} {:10.4f}s'.format(
+            name, _describe(params), result['best']))
+        return result
+
+
+def _describe(params):
+    return ' '.join(
+        '{}={}'.format(key, value) for key, value in sorted(params.items()))
+
+
+_application = None
+
+
+def _qt_application():
+    '''Starts the offscreen QApplication, kept for the whole run.'''
+    global _application
+    if _application is None:
+        from PyQt5 import QtWidgets
+        _application = QtWidgets.QApplication([])
+    return _application
+
+
+def _tag_model():
+    # The columns of MainWindow's tag table, which cannot be imported
+    # without QHexEdit and the generated UI modules
+    from PyQt5 import QtCore
+    from hanalyse.tagmodel import TagModel
+    label_order = {
+        0: ('Name', 'name'),
+        1: ('Start', 'start'),
+        2: ('End', 'end'),
+        3: ('Type', 'type'),
+        4: ('Role', 'role'),
+        5: ('Comment', 'comment'),
+        6: ('ID', 'identifier'),
+        7: ('Parent', 'parent'),
+        8: ('Value', 'value'),
+    }
+    return TagModel(None, QtCore.Qt.Horizontal, label_order)
+
+
+def _tag_table(model):
+    '''A table view of a tag model, set up as MainWindow's tagTableView.'''
+    from PyQt5 import QtWidgets
+    view = QtWidgets.QTableView()
+    view.setModel(model)
+    view.setWordWrap(False)
+    view.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+    view.resize(800, 600)
+    view.show()
+    return view
+
+
+@benchmark
+def tag_construction(suite):
+    for count in suite.tag_counts:
+        def construct(count=count):
+            for index in range(count):
+                Tag(name='field', start=index * 4, end=index * 4 + 3,
+                    type=TagTypes.Uint32, role=TagRoles.Unknown,
+                    comment='')
+        suite.time('tag_construction', construct, tags=count)
+
+
+@benchmark
+def tagmodel_read(suite):
+    _qt_application()
+    for count in suite.tag_counts:
+        filename = suite.tag_file(count)
+        model = _tag_model()
+        suite.time(
+            'tagmodel_read', lambda: model.read_from_file(
+                filename, use_cache=False),
+            tags=count, cache=False)
+        # The first read writes the cache
+        model.read_from_file(filename)
+        suite.time(
+            'tagmodel_read', lambda: model.read_from_file(filename),
+            tags=count, cache=True)
+
+
+@benchmark
+def tagmodel_write(suite):
+    _qt_application()
+    for count in suite.tag_counts:
+        model = _tag_model()
+        model.read_from_file(suite.tag_file(count))
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'tags.yaml')
+            suite.time(
+                'tagmodel_write', lambda: model.write_to_file(filename),
+                tags=count)
+
+
+@benchmark
+def tagmodel_view(suite):
+    '''Loading a tag file into a model shown by a table view, and painting
+    the first page, as MainWindow.load_tags does.'''
+    _qt_application()
+    for count in suite.tag_counts:
+        filename = suite.tag_file(count)
+        model = _tag_model()
+        view = _tag_table(model)
+
+        def load():
+            model.read_from_file(filename)
+            view.viewport().grab()
+        suite.time('tagmodel_view', load, tags=count)
+
+
+@benchmark
+def tagmodel_scroll(suite):
+    '''Scrolling a tag table a page at a time through all its rows,
+    painting each page, as tagTableView is set up in MainWindow.'''
+    _qt_application()
+    for count in suite.tag_counts:
+        model = _tag_model()
+        model.read_from_file(suite.tag_file(count))
+        view = _tag_table(model)
+        scroll_bar = view.verticalScrollBar()
+        pages = min(SCROLL_PAGES, max(count // 20, 1))
+        positions = [
+            scroll_bar.maximum() * page // pages for page in range(pages)]
+        viewport = view.viewport()
+
+        def scroll():
+            started = time.perf_counter()
+            for position in positions:
+                scroll_bar.setValue(position)
+                viewport.grab()
+            return {'pages_per_second': round(
+                pages / (time.perf_counter() - started), 1)}
+        suite.time('tagmodel_scroll', scroll, tags=count, pages=pages)
+
+
+@benchmark
+def tagproxy(suite):
+    '''Sorting and filtering the tag table through TagProxyModel: the
+    first search, which builds the index, typing a name a key at a time,
+    filtering by role, type and offset range, and sorting by each key.'''
+    _qt_application()
+    from hanalyse.tagproxy import TagProxyModel
+    for count in suite.tag_counts:
+        model = _tag_model()
+        model.read_from_file(suite.tag_file(count))
+        name = 'field_{}'.format(count - 1)
+        proxy = None
+        view = None
+
+        def new_proxy():
+            nonlocal proxy, view
+            proxy = TagProxyModel(model)
+            view = _tag_table(proxy)
+
+        def search():
+            proxy.set_filter(text=name)
+            return {'shown': proxy.rowCount()}
+        suite.time('tagproxy_first_search', search, new_proxy, tags=count)
+
+        def typing():
+            for length in range(1, len(name) + 1):
+                proxy.set_filter(text=name[:length])
+            return {'keys': len(name), 'shown': proxy.rowCount()}
+        suite.time('tagproxy_typing', typing, tags=count)
+
+        def filters():
+            shown = []
+            for filter_ in (
+                    {'roles': (TagRoles.Data,)},
+                    {'types': (TagTypes.Uint32,)},
+                    {'start': TAG_SPAN // 4, 'end': TAG_SPAN // 4 + 0xffff},
+                    {'text': 'struct', 'types': (TagTypes.Unknown,)}):
+                proxy.set_filter(**filter_)
+                shown.append(proxy.rowCount())
+            proxy.set_filter()
+            return {'shown': shown}
+        suite.time('tagproxy_filters', filters, tags=count)
+
+        def sort():
+            from hanalyse.tagindex import SORT_KEYS
+            for key in SORT_KEYS:
+                proxy.sort_by(key)
+            proxy.sort_by(None)
+        suite.time('tagproxy_sort', sort, new_proxy, tags=count)
+
+
+@benchmark
+def tagtree_expand(suite):
+    '''Showing the tag tree and expanding a tag with as many children as
+    there are tags, as the Tree tab of MainWindow does.'''
+    app = _qt_application()
+    from PyQt5 import QtWidgets
+    from hanalyse.tagtree import TagTreeModel
+    for count in suite.tag_counts:
+        tags = TagStore()
+        table = tags[tags.append(name='table', end=count - 1)].identifier
+        for index in range(count):
+            tags.append(
+                name='record_{}'.format(index), start=index, end=index,
+                parent=table)
+        model = _tag_model()
+        model.set_tags(tags)
+        view = QtWidgets.QTreeView()
+        view.setUniformRowHeights(True)
+        view.resize(800, 600)
+        view.show()
+        tree = None
+
+        def setup():
+            nonlocal tree
+            tree = TagTreeModel(model)
+
+        def expand():
+            view.setModel(tree)
+            view.expand(tree.index(0, 0))
+            app.processEvents()
+            return {'shown': tree.rowCount(tree.index(0, 0))}
+        suite.time('tagtree_expand', expand, setup, tags=count)
+
+
+@benchmark
+def cursor_lookup(suite):
+    '''The tags under the cursor, as in hex_1_position_changed, for
+    LOOKUPS random cursor positions.'''
+    _qt_application()
+    for count in suite.tag_counts:
+        model = _tag_model()
+        model.read_from_file(suite.tag_file(count))
+        rng = random.Random(1)
+        offsets = [rng.randrange(TAG_SPAN) for _ in range(LOOKUPS)]
+        tag_rows_at = model.tag_rows_at
+
+        def lookup():
+            found = 0
+            for offset in offsets:
+                found += len(tag_rows_at(offset))
+            return {'found': found}
+        suite.time('cursor_lookup', lookup, tags=count, lookups=LOOKUPS)
+
+
+@benchmark
+def find_offset(suite):
+    '''Searching every position for the 4-byte value of an offset, as
+    find_offset_cb does until the PointerIndex is ready.'''
+    for size in suite.sizes:
+        filename = suite.binary(size)
+        pattern = (size // 2 & ~3).to_bytes(4, sys.byteorder)
+
+        def search():
+            hits = 0
+            for searched, total, found in search_file(filename, pattern):
+                hits += len(found)
+            return {'hits': hits}
+        suite.time('find_offset', search, size=size)
+
+
+@benchmark
+def pointer_index(suite):
+    '''Building the PointerIndex that answers find_offset_cb.'''
+    for size in suite.sizes:
+        filename = suite.binary(size)
+
+        def build():
+            index = PointerIndex.build(filename)
+            found = [
+                index.sources(target) for target in range(0, size, 4096)]
+            index.close()
+            return {'pointers': sum(
+                len(sources) for sources in found if sources is not None)}
+        suite.time('pointer_index', build, size=size)
+
+
+@benchmark
+def decode_values(suite):
+    '''Decoding every tag's value, as MainWindow.update_values does, with
+    the time to compile the TagDecoder and that of the per-tag
+    int.from_bytes calls it replaces.'''
+    from hanalyse.tags import read_tags
+    filename = suite.binary(max(TAG_SPAN, min(suite.sizes)))
+    for count in suite.tag_counts:
+        tags = read_tags(suite.tag_file(count))
+        decoder = TagDecoder(tags)
+
+        def decode():
+            with mapped_file(filename) as data:
+                decoder.decode(data)
+        suite.time('decode_values', decode, tags=count)
+
+        def compile_decoder():
+            TagDecoder(tags)
+        suite.time('decode_values_compile', compile_decoder, tags=count)
+
+        # The per-tag int.from_bytes calls that TagDecoder replaces
+        numeric = [
+            (tag.start, struct.calcsize(TYPEFORMATS[tag.type]),
+             TYPEFORMATS[tag.type].islower())
+            for tag in tags if tag.type in TYPEFORMATS]
+
+        def from_bytes():
+            with mapped_file(filename) as data:
+                for start, size, signed in numeric:
+                    int.from_bytes(
+                        data[start:start + size], sys.byteorder,
+                        signed=signed)
+        suite.time('decode_values_from_bytes', from_bytes, tags=count)
+
+
+@benchmark
+def inference(suite, sample_count=50):
+    '''Count, Size and Offset inference on a synthetic corpus, against
+    pairing every field with every other.'''
+    rng = random.Random(1)
+    samples = [synthetic_sample(rng) for _ in range(sample_count)]
+    lengths = [len(sample) for sample in samples]
+
+    def run_infer():
+        candidates = infer(samples, CORPUS_HEADER)
+        found = {}
+        for candidate in candidates:
+            if candidate.field.byteorder == 'little':
+                found.setdefault(candidate.field.start, set()).add(
+                    candidate.role.name)
+        missed = [
+            '{} at 0x{:x}'.format(role, start)
+            for start, role in CORPUS_PLANTED.items()
+            if role not in found.get(start, ())]
+        return {'candidates': len(candidates), 'missed': missed}
+    suite.time('infer', run_infer, samples=sample_count)
+
+    columns = fields(samples, CORPUS_HEADER)
+
+    def brute_force_pairs():
+        '''The products of every pair of fields that equal a sample
+        length less a constant.'''
+        found = 0
+        for count in columns:
+            for size in columns:
+                headers = {
+                    length - a * b
+                    for length, a, b in zip(
+                        lengths, count.values, size.values)}
+                if len(headers) == 1 and min(headers) >= 0:
+                    found += 1
+        return {'fields': len(columns), 'pairs': found}
+    suite.time('infer_brute_force_pairs', brute_force_pairs,
+               samples=sample_count)
+
+
+def _key(result):
+    return result['name'], _describe(result['params'])
+
+
+def compare(results, previous):
+    '''Prints each result's ratio to the same case in an earlier run.
+    Returns the number of regressions.'''
+    earlier = {_key(result): result for result in previous['results']}
+    regressions = 0
+    for result in results:
+        before = earlier.get(_key(result))
+        if before is None or not before['best']:
+            continue
+        ratio = result['best'] / before['best']
+        flag = ''
+        if ratio > REGRESSION:
+            flag = '  slower'
+            regressions += 1
+        print('{:<28} {:<36} {:6.2f}x{}'.format(
+            result['name'], _describe(result['params']), ratio, flag))
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    '''Command line options.'''
+    parser = argparse.ArgumentParser(
+        description='Time the hanalyse hot paths on synthetic data')
+
+    parser.add_argument(
+        '-o',
+        '--out',
+        dest='outfile',
+        default=None,
+        metavar='FILE',
+        help='the JSON file to write the results to')
+
+    parser.add_argument(
+        '--compare',
+        dest='compare',
+        default=None,
+        metavar='FILE',
+        help='an earlier results file to compare with')
+
+    parser.add_argument(
+        '--sizes',
+        dest='sizes',
+        default=None,
+        help='binary sizes, such as 1M,64M,4G (default: {})'.format(
+            DEFAULT_SIZES))
+
+    parser.add_argument(
+        '--tags',
+        dest='tags',
+        default=None,
+        help='tag file sizes (default: {})'.format(DEFAULT_TAGS))
+
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='use binaries up to 4G and tag files up to 1M tags')
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='how many times to run each case, the best being kept '
+             '(default: 3)')
+
+    parser.add_argument(
+        '--only',
+        dest='only',
+        action='append',
+        default=[],
+        metavar='NAME',
+        help='run only the benchmarks whose names contain NAME')
+
+    parser.add_argument(
+        '--data',
+        dest='data',
+        default=DATA_DIRECTORY,
+        metavar='DIRECTORY',
+        help='where generated data is kept')
+
+    args = parser.parse_args(argv)
+    sizes = args.sizes or (FULL_SIZES if args.full else DEFAULT_SIZES)
+    tags = args.tags or (FULL_TAGS if args.full else DEFAULT_TAGS)
+    suite = Suite(
+        [parse_size(size) for size in sizes.split(',')],
+        [parse_size(count) for count in tags.split(',')],
+        args.repeat, args.data)
+
+    for function in BENCHMARKS:
+        if args.only and not any(
+                name in function.__name__ for name in args.only):
+            continue
+        function(suite)
+
+    report = {
+        'created': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+        'commit': _commit(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': suite.results,
+    }
+    if args.outfile is not None:
+        with open(args.outfile, 'w') as outfile:
+            json.dump(report, outfile, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as previous:
+            if compare(suite.results, json.load(previous)):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,8 +20,6 @@ It defines:
 import argparse
 import os
 import sys
-from PyQt5 import QtWidgets
-from hanalyse.mainwindow import MainWindow
 
 __version__ = 0.1
 __date__ = '2015-11-13'
@@ -31,13 +29,29 @@ __updated__ = '2015-11-13'
 def main():
     '''Command line options.'''
 
+    # Headless commands, which do not import Qt
+    if sys.argv[1:2] == ['decode']:
+        from hanalyse.batch import main as decode_main
+        return decode_main(sys.argv[2:])
+    if sys.argv[1:2] == ['scan']:
+        from hanalyse.signatures import main as scan_main
+        return scan_main(sys.argv[2:])
+    if sys.argv[1:2] == ['corpus']:
+        from hanalyse.corpus import main as corpus_main
+        return corpus_main(sys.argv[2:])
+    if sys.argv[1:2] == ['infer']:
+        from hanalyse.inference import main as infer_main
+        return infer_main(sys.argv[2:])
+
     program_name = os.path.basename(sys.argv[0])
     program_version = "v0.1"
     program_build_date = "%s" % __updated__
 
     program_version_string = '%%prog %s (%s)' % (
         program_version, program_build_date)
-    program_longdesc = ''''''
+    program_longdesc = '''Run "%(prog)s decode --help", "%(prog)s scan --help",
+"%(prog)s corpus --help" or "%(prog)s infer --help" for the commands that
+work without the GUI.'''
     program_license = '''Copyright 2014 Chris Willoughby.
 Licensed under GPL v3.0.\nhttp://www.gnu.org/licenses/'''
 
@@ -61,7 +75,22 @@ Licensed under GPL v3.0.\nhttp://www.gnu.org/licenses/'''
             dest="tagfile",
             default=None,
             metavar='FILE',
-            help='the tag file')
+            help='the tag file, or a tag database ending in .tagdb')
+
+        parser.add_argument(
+            '--profile',
+            dest='profile',
+            default=None,
+            metavar='FILE',
+            help='time the hot paths and write a Chrome trace to FILE on '
+                 'exit (or set HANALYSE_PROFILE=FILE)')
+
+        parser.add_argument(
+            '--profile-summary',
+            dest='profile_summary',
+            action='store_true',
+            help='print a table of the calls timed on exit (or set '
+                 'HANALYSE_PROFILE_SUMMARY=1)')
 
         # process options
         args = parser.parse_args()
@@ -72,6 +101,14 @@ Licensed under GPL v3.0.\nhttp://www.gnu.org/licenses/'''
         sys.stderr.write(indent + "  for help use --help")
         return 2
 
+    # Before the traced modules are imported
+    if args.profile is not None or args.profile_summary:
+        from hanalyse import profiling
+        profiling.enable(args.profile, args.profile_summary)
+
+    from PyQt5 import QtWidgets
+    from hanalyse.mainwindow import MainWindow
+
     app = QtWidgets.QApplication(sys.argv)
     main_window = MainWindow(filename=args.infile, tagfile=args.tagfile)
     main_window.show()
@@ -0,0 +1,7 @@
+'''The hanalyse package.
+
+The GUI is mainwindow and the modules it alone uses, which import Qt:
+hexes, journaltask, overview, searchtask, tagmodel, tagproxy, tagtree and
+utilities. The rest import neither Qt nor PyYAML, which tagyaml loads only
+when a tag file is read or written, so the headless commands start
+quickly.'''
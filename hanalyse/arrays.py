@@ -0,0 +1,139 @@
+'''Lazy evaluation of Array tags.
+
+An Array tag names the Count tag holding its number of elements and,
+optionally, the Size tag holding the size of each element. Resolving an
+array reads those two values and gives back an ArrayView, which decodes
+elements only as they are asked for.'''
+
+import sys
+
+from .decoding import TYPEFORMATS, type_struct, decode_value
+from .tags import TagTypes
+
+__all__ = ['ArrayView', 'resolve_array', 'resolve_arrays']
+
+
+class ArrayView(object):
+    '''A sequence of fixed-size elements in a buffer, decoded on demand.
+
+    Numeric elements decode to numbers read from the start of each
+    element, Char and String elements to text, and anything else to the
+    element's bytes. Slicing with a step of one gives another ArrayView.'''
+
+    def __init__(self, data, start, count, element_size,
+                 element_type=TagTypes.Unknown, byteorder=sys.byteorder):
+        self._data = data
+        self._start = start
+        self._count = count
+        self._element_size = element_size
+        self._element_type = element_type
+        self._byteorder = byteorder
+
+        self._unpacker = None
+        if element_type in TYPEFORMATS:
+            unpacker = type_struct(element_type, byteorder)
+            if unpacker.size <= element_size:
+                self._unpacker = unpacker
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def element_size(self):
+        return self._element_size
+
+    @property
+    def element_type(self):
+        return self._element_type
+
+    def __len__(self):
+        return self._count
+
+    def offset(self, index):
+        '''The offset in the buffer of the given element.'''
+        return self._start + index * self._element_size
+
+    def _element(self, index):
+        offset = self._start + index * self._element_size
+        if self._unpacker is not None:
+            return self._unpacker.unpack_from(self._data, offset)[0]
+        raw = bytes(self._data[offset:offset + self._element_size])
+        if self._element_type in (TagTypes.Char, TagTypes.String):
+            return raw.decode('latin-1')
+        return raw
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            first, stop, step = index.indices(self._count)
+            if step != 1:
+                return [self._element(i) for i in range(first, stop, step)]
+            return ArrayView(
+                self._data,
+                self.offset(first),
+                max(stop - first, 0),
+                self._element_size,
+                self._element_type,
+                self._byteorder)
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('array index out of range')
+        return self._element(index)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self._element(index)
+
+    def __str__(self):
+        return '{} x {} ({} bytes each)'.format(
+            self._count, self._element_type.name, self._element_size)
+
+
+def _tag_value(tag, data, byteorder):
+    if tag is None:
+        return None
+    return decode_value(data, tag.start, tag.end, tag.type, byteorder)
+
+
+def resolve_array(tag, tags_by_name, data, byteorder=sys.byteorder):
+    '''Returns an ArrayView over the elements of an Array tag, looking up
+    its Count and Size tags by name, or None if the count is unknown.
+
+    Without a Size tag the element size is that of the element type or,
+    for types without a fixed size, the tag's extent divided by the count.
+    The count is cut short if the elements would run past the data.'''
+    count = _tag_value(tags_by_name.get(tag.count), data, byteorder)
+    if not isinstance(count, int) or count < 0:
+        return None
+
+    size = _tag_value(tags_by_name.get(tag.size), data, byteorder)
+    if not isinstance(size, int) or size <= 0:
+        if tag.of in TYPEFORMATS:
+            size = type_struct(tag.of, byteorder).size
+        elif count:
+            size = max((tag.end - tag.start + 1) // count, 1)
+        else:
+            size = 1
+
+    available = max(len(data) - tag.start, 0) // size
+    return ArrayView(
+        data, tag.start, min(count, available), size, tag.of, byteorder)
+
+
+def resolve_arrays(tags, data, byteorder=sys.byteorder):
+    '''Resolves every Array tag in a sequence of tags, returning a dict of
+    ArrayViews keyed by position in the sequence.'''
+    tags_by_name = {}
+    arrays = []
+    for row, tag in enumerate(tags):
+        tags_by_name.setdefault(tag.name, tag)
+        if tag.type == TagTypes.Array:
+            arrays.append((row, tag))
+
+    views = {}
+    for row, tag in arrays:
+        view = resolve_array(tag, tags_by_name, data, byteorder)
+        if view is not None:
+            views[row] = view
+    return views
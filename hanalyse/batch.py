@@ -0,0 +1,210 @@
+'''hanalyse decode -- apply a tag file to many binaries without the GUI.
+
+Every tag's value is decoded from each file and written out as JSON Lines
+or CSV, one record per file and tag. Files are decoded in a pool of worker
+processes, with only a few files per worker in flight at a time so memory
+stays bounded however many files are given.'''
+
+import argparse
+import collections
+import csv
+import json
+import os
+import sys
+import time
+
+from .decoding import TagDecoder, mapped_file
+from .tags import read_tags
+
+__all__ = ['main']
+
+FIELDS = ('file', 'name', 'start', 'end', 'type', 'role', 'value')
+
+# Tag fields and their decoder for the worker processes, set by
+# _init_worker.
+_worker_tags = None
+_worker_decoder = None
+
+
+def _init_worker(tags, byteorder):
+    global _worker_tags, _worker_decoder
+    _worker_tags = tags
+    _worker_decoder = TagDecoder(
+        [(start, end, tag_type) for name, start, end, tag_type, role in tags],
+        byteorder)
+
+
+def decode_file(filename, tags, decoder):
+    '''Decodes the value of every tag, given as (name, start, end, type,
+    role) tuples, from a file using a TagDecoder for those tags. Returns the
+    file size and a list of records with the keys in FIELDS.'''
+    with mapped_file(filename) as data:
+        size = len(data)
+        values = decoder.decode(data)
+
+    records = [
+        {
+            'file': filename,
+            'name': name,
+            'start': start,
+            'end': end,
+            'type': tag_type.name,
+            'role': role.name,
+            'value': value,
+        }
+        for (name, start, end, tag_type, role), value in zip(tags, values)]
+    return size, records
+
+
+def _decode_in_worker(filename):
+    try:
+        return decode_file(filename, _worker_tags, _worker_decoder)
+    except OSError as err:
+        sys.stderr.write('{}: {}\n'.format(filename, err))
+        return 0, []
+
+
+class JsonLinesWriter(object):
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, record):
+        self._stream.write(json.dumps(record))
+        self._stream.write('\n')
+
+
+class CsvWriter(object):
+
+    def __init__(self, stream):
+        self._writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        self._writer.writeheader()
+
+    def write(self, record):
+        self._writer.writerow(record)
+
+
+WRITERS = {
+    'jsonl': JsonLinesWriter,
+    'csv': CsvWriter,
+}
+
+
+def decode_files(filenames, tags, writer, jobs=None,
+                 byteorder=sys.byteorder):
+    '''Decodes tags from many files in a process pool, handing records to
+    writer in the order the files were given. Returns the number of files
+    and bytes decoded.'''
+    # Only imported here, as it is slow to import and --help and the
+    # argument errors do not need it
+    import concurrent.futures
+
+    jobs = jobs or os.cpu_count() or 1
+    window = 2 * jobs
+    file_count = 0
+    byte_count = 0
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(tags, byteorder)) as executor:
+        pending = collections.deque()
+        filenames = iter(filenames)
+        while True:
+            while len(pending) < window:
+                filename = next(filenames, None)
+                if filename is None:
+                    break
+                pending.append(executor.submit(_decode_in_worker, filename))
+            if not pending:
+                break
+            size, records = pending.popleft().result()
+            file_count += 1
+            byte_count += size
+            for record in records:
+                writer.write(record)
+
+    return file_count, byte_count
+
+
+def main(argv=None):
+    '''Command line options.'''
+    parser = argparse.ArgumentParser(
+        prog='hanalyse decode',
+        description='Decode the tags in a tag file from many files')
+
+    parser.add_argument(
+        '-t',
+        '--tag',
+        dest='tagfile',
+        required=True,
+        metavar='FILE',
+        help='the tag file')
+
+    parser.add_argument(
+        '-f',
+        '--format',
+        dest='format',
+        choices=sorted(WRITERS),
+        default='jsonl',
+        help='the output format (default: jsonl)')
+
+    parser.add_argument(
+        '-o',
+        '--out',
+        dest='outfile',
+        default=None,
+        metavar='FILE',
+        help='the output file (default: standard output)')
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        dest='jobs',
+        type=int,
+        default=None,
+        help='the number of worker processes (default: one per CPU)')
+
+    parser.add_argument(
+        '--byteorder',
+        dest='byteorder',
+        choices=('little', 'big'),
+        default=sys.byteorder,
+        help='the byte order of numbers (default: {})'.format(sys.byteorder))
+
+    parser.add_argument(
+        'files',
+        nargs='+',
+        metavar='FILE',
+        help='the files to decode')
+
+    args = parser.parse_args(argv)
+
+    tags = [
+        (tag.name, tag.start, tag.end, tag.type, tag.role)
+        for tag in read_tags(args.tagfile)]
+
+    if args.outfile is None:
+        out = sys.stdout
+    else:
+        out = open(args.outfile, 'w', newline='')
+
+    started = time.perf_counter()
+    try:
+        file_count, byte_count = decode_files(
+            args.files,
+            tags,
+            WRITERS[args.format](out),
+            jobs=args.jobs,
+            byteorder=args.byteorder)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+
+    sys.stderr.write(
+        'Decoded {} files ({:.1f} MB) in {:.2f}s: '
+        '{:.1f} files/s, {:.1f} MB/s\n'.format(
+            file_count, byte_count / 1e6, elapsed,
+            file_count / elapsed, byte_count / 1e6 / elapsed))
+    return 0
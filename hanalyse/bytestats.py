@@ -0,0 +1,226 @@
+'''Per-block byte statistics for an overview of a file.
+
+A file is split into fixed-size blocks and, for each block, the Shannon
+entropy in bits per byte and the fractions of zero and printable bytes are
+recorded, along with a histogram of the whole file. The file is read a
+chunk at a time from a memory map, so memory use is bounded by the chunk
+size and the three small per-block columns, however large the file.
+
+The results are saved next to the file they were computed from and are
+reused while its size and modification time match or, failing that, its
+SHA-1 does.'''
+
+from array import array
+import collections
+import hashlib
+import math
+import os
+import string
+import struct
+import sys
+import threading
+
+from .decoding import mapped_file
+
+__all__ = ['ByteStatistics', 'compute_statistics', 'histogram']
+
+BLOCK_SIZE = 4096
+CHUNK_SIZE = 16 << 20
+
+MAGIC = b'HSTA'
+VERSION = 1
+
+# magic, version, byte order, block size, block count, source size,
+# source mtime in ns, source SHA-1
+HEADER = struct.Struct('<4sHBxIQQq20s')
+
+_PRINTABLE = string.printable.encode('ascii')
+
+
+def statistics_filename(filename):
+    return filename + '.stats'
+
+
+def _file_hash(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.digest()
+
+
+def histogram(data, start=0, end=None):
+    '''The number of each byte value in data[start:end], as a list of 256
+    counts.'''
+    counts = [0] * 256
+    for value, count in collections.Counter(data[start:end]).items():
+        counts[value] = count
+    return counts
+
+
+class ByteStatistics(object):
+    '''Entropy, zero and printable fractions for each block of a file, and
+    the file's byte histogram. Blocks may be added a chunk at a time.'''
+
+    def __init__(self, size, block_size=BLOCK_SIZE):
+        self._size = size
+        self._block_size = block_size
+        self._entropy = array('f')
+        self._zeros = array('f')
+        self._printable = array('f')
+        self._histogram = array('Q', bytes(8 * 256))
+        # n log2 n for every count a block can hold
+        self._n_log_n = None
+
+    @property
+    def size(self):
+        '''The size of the file the statistics are for.'''
+        return self._size
+
+    @property
+    def block_size(self):
+        return self._block_size
+
+    @property
+    def block_count(self):
+        '''The number of blocks in the file.'''
+        return -(-self._size // self._block_size)
+
+    @property
+    def complete(self):
+        return len(self._entropy) == self.block_count
+
+    @property
+    def entropy(self):
+        '''Shannon entropy in bits per byte of each block done so far.'''
+        return self._entropy
+
+    @property
+    def zeros(self):
+        '''The fraction of each block that is zero bytes.'''
+        return self._zeros
+
+    @property
+    def printable(self):
+        '''The fraction of each block that is printable ASCII.'''
+        return self._printable
+
+    @property
+    def histogram(self):
+        '''The count of each byte value over the blocks done so far.'''
+        return self._histogram
+
+    def add_blocks(self, data):
+        '''Adds the statistics for the blocks in data, which must start at
+        the first block not yet done and hold whole blocks, except at the
+        end of the file.'''
+        block_size = self._block_size
+        if self._n_log_n is None:
+            self._n_log_n = [0.0] + [
+                count * math.log2(count)
+                for count in range(1, block_size + 1)]
+        n_log_n = self._n_log_n
+        totals = collections.Counter()
+
+        for start in range(0, len(data), block_size):
+            block = data[start:start + block_size]
+            length = len(block)
+            counts = collections.Counter(block)
+            totals.update(counts)
+            self._entropy.append(
+                math.log2(length) -
+                sum(map(n_log_n.__getitem__, counts.values())) / length)
+            self._zeros.append(counts[0] / length)
+            self._printable.append(
+                (length - len(block.translate(None, _PRINTABLE))) / length)
+
+        histogram = self._histogram
+        for value, count in totals.items():
+            histogram[value] += count
+
+    def blocks_in(self, start, end):
+        '''The range of blocks overlapping [start, end).'''
+        return range(
+            start // self._block_size,
+            min(-(-end // self._block_size), len(self._entropy)))
+
+    def save(self, filename):
+        '''Saves the statistics next to the file they were computed from.'''
+        stat = os.stat(filename)
+        with open(statistics_filename(filename), 'wb') as stats_file:
+            stats_file.write(HEADER.pack(
+                MAGIC, VERSION, sys.byteorder == 'little',
+                self._block_size, len(self._entropy),
+                stat.st_size, stat.st_mtime_ns, _file_hash(filename)))
+            stats_file.write(self._histogram)
+            stats_file.write(self._entropy)
+            stats_file.write(self._zeros)
+            stats_file.write(self._printable)
+
+    @classmethod
+    def load(cls, filename, block_size=BLOCK_SIZE):
+        '''Loads the statistics saved next to a file, or returns None if
+        there are none for this block size or the file has changed.'''
+        try:
+            stats_file = open(statistics_filename(filename), 'rb')
+        except OSError:
+            return None
+
+        with stats_file:
+            header = stats_file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            (magic, version, little, saved_block_size, count,
+             size, mtime, sha1) = HEADER.unpack(header)
+            stat = os.stat(filename)
+            if (magic != MAGIC or version != VERSION or
+                    little != (sys.byteorder == 'little') or
+                    saved_block_size != block_size or
+                    size != stat.st_size or
+                    count != -(-size // block_size)):
+                return None
+            if mtime != stat.st_mtime_ns and sha1 != _file_hash(filename):
+                return None
+
+            statistics = cls(size, block_size)
+            try:
+                statistics._histogram = array('Q')
+                statistics._histogram.fromfile(stats_file, 256)
+                for column in (statistics._entropy, statistics._zeros,
+                               statistics._printable):
+                    column.fromfile(stats_file, count)
+            except EOFError:
+                return None
+        return statistics
+
+
+def compute_statistics(filename, block_size=BLOCK_SIZE,
+                       chunk_size=CHUNK_SIZE, cancelled=None):
+    '''Yields the ByteStatistics for a file after each chunk is added, and
+    saves them once complete. If current statistics were saved before,
+    they are yielded at once.
+
+    cancelled is an optional threading.Event; the computation stops at the
+    end of the chunk during which it is set.'''
+    statistics = ByteStatistics.load(filename, block_size)
+    if statistics is not None:
+        yield statistics
+        return
+
+    if cancelled is None:
+        cancelled = threading.Event()
+    chunk_size = max(chunk_size - chunk_size % block_size, block_size)
+    with mapped_file(filename) as data:
+        statistics = ByteStatistics(len(data), block_size)
+        if not len(data):
+            yield statistics
+        for chunk in range(0, len(data), chunk_size):
+            if cancelled.is_set():
+                return
+            statistics.add_blocks(data[chunk:chunk + chunk_size])
+            yield statistics
+
+    try:
+        statistics.save(filename)
+    except OSError as err:
+        print('Could not save byte statistics: {}'.format(err))
@@ -0,0 +1,267 @@
+'''hanalyse corpus -- find what never changes across samples of a format.
+
+The samples are aligned by offset and read together a block of offsets at
+a time, so each block is a column of bytes from every sample and only one
+block of each is in memory however many samples there are or however big.
+For every offset the corpus records whether it is invariant, the range of
+values seen and how the value correlates with the sample length. Runs of
+invariant offsets are proposed as Constant tags, or as a Signature if they
+start the file, with comments in the "Always 0100" style.'''
+
+import argparse
+import contextlib
+import math
+import operator
+import re
+import sys
+
+from .decoding import mapped_file
+from .tags import TagRoles, TagStore, TagTypes, write_tags
+
+__all__ = ['ColumnBlock', 'column_blocks', 'invariant_spans',
+           'propose_tags', 'main']
+
+BLOCK_SIZE = 1 << 20
+# Roughly the most sample bytes held at once; blocks shrink to fit
+MEMORY_BUDGET = 256 << 20
+MIN_BLOCK_SIZE = 4 << 10
+
+# Runs of offsets that vary, or that do not, in a block's difference mask
+_VARIANT_RUN = re.compile(b'[^\x00]+')
+_INVARIANT_RUN = re.compile(b'\x00+')
+
+_PRINTABLE = frozenset(range(0x20, 0x7f))
+
+# Types proposed for invariant spans, by length
+_TYPES_BY_LENGTH = {
+    1: TagTypes.Uint8,
+    2: TagTypes.Uint16,
+    4: TagTypes.Uint32,
+    8: TagTypes.Uint64,
+}
+
+# The most bytes of a span's value quoted in its comment
+COMMENT_BYTES = 16
+
+
+class ColumnBlock(object):
+    '''The statistics of the offsets [start, start + length) over every
+    sample long enough to hold them.
+
+    difference has a zero byte for each invariant offset. With statistics,
+    minimum and maximum hold the range of values at each offset, and
+    correlation the Pearson correlation of the value with the sample
+    length, or None where the value or the length does not vary. Working
+    these out for every varying offset is most of the cost of a block.'''
+
+    def __init__(self, start, rows, lengths, statistics=True):
+        self.start = start
+        self.length = len(rows[0])
+        first = rows[0]
+        self._first = first
+
+        # OR together every sample's difference from the first, as big ints
+        # so that the work is done in C.
+        reference = int.from_bytes(first, 'big')
+        difference = 0
+        for row in rows[1:]:
+            difference |= int.from_bytes(row, 'big') ^ reference
+        self.difference = difference.to_bytes(self.length, 'big')
+
+        self.minimum = None
+        self.maximum = None
+        self.correlation = None
+        if statistics:
+            self._statistics(rows, lengths)
+
+    def _statistics(self, rows, lengths):
+        self.minimum = bytearray(self._first)
+        self.maximum = bytearray(self._first)
+        self.correlation = [None] * self.length
+
+        count = len(rows)
+        mean_length = sum(lengths) / count
+        centred = [length - mean_length for length in lengths]
+        length_deviation = math.sqrt(sum(map(operator.mul, centred, centred)))
+
+        for run in _VARIANT_RUN.finditer(self.difference):
+            start, end = run.span()
+            columns = list(zip(*(row[start:end] for row in rows)))
+            self.minimum[start:end] = bytes(map(min, columns))
+            self.maximum[start:end] = bytes(map(max, columns))
+            if not length_deviation:
+                continue
+            for offset, column in enumerate(columns, start):
+                mean = sum(column) / count
+                deviation = math.sqrt(max(
+                    sum(map(operator.mul, column, column)) -
+                    count * mean * mean, 0))
+                if deviation:
+                    self.correlation[offset] = (
+                        sum(map(operator.mul, column, centred)) /
+                        (deviation * length_deviation))
+
+    def invariant(self, offset):
+        '''True if the byte at offset, relative to start, never varies.'''
+        return not self.difference[offset]
+
+    def invariant_runs(self):
+        '''Yields (start, end, value) for each run of invariant offsets,
+        with end exclusive and relative to the file.'''
+        for run in _INVARIANT_RUN.finditer(self.difference):
+            start, end = run.span()
+            yield (
+                self.start + start, self.start + end,
+                bytes(self._first[start:end]))
+
+
+@contextlib.contextmanager
+def _mapped_files(filenames):
+    with contextlib.ExitStack() as stack:
+        yield [
+            stack.enter_context(mapped_file(filename))
+            for filename in filenames]
+
+
+def column_blocks(filenames, block_size=None, statistics=False):
+    '''Yields a ColumnBlock for each block of offsets held by every sample,
+    up to the length of the shortest. By default blocks are as large as
+    the memory budget allows for the number of samples.'''
+    if block_size is None:
+        block_size = max(min(
+            BLOCK_SIZE, MEMORY_BUDGET // max(len(filenames), 1)),
+            MIN_BLOCK_SIZE)
+    with _mapped_files(filenames) as samples:
+        lengths = [len(sample) for sample in samples]
+        common = min(lengths, default=0)
+        for start in range(0, common, block_size):
+            end = min(start + block_size, common)
+            yield ColumnBlock(
+                start, [sample[start:end] for sample in samples], lengths,
+                statistics)
+
+
+def invariant_spans(blocks, min_length=2):
+    '''Yields (start, end, value) for each run of at least min_length
+    invariant offsets in a sequence of ColumnBlocks, joining runs that
+    carry on from one block into the next. end is exclusive.'''
+    pending = None
+    for block in blocks:
+        for start, end, value in block.invariant_runs():
+            if pending is not None and pending[1] == start:
+                pending = (pending[0], end, pending[2] + value)
+                continue
+            if pending is not None and pending[1] - pending[0] >= min_length:
+                yield pending
+            pending = (start, end, value)
+    if pending is not None and pending[1] - pending[0] >= min_length:
+        yield pending
+
+
+def _span_type(value):
+    if len(value) in _TYPES_BY_LENGTH:
+        return _TYPES_BY_LENGTH[len(value)]
+    if all(byte in _PRINTABLE for byte in value):
+        return TagTypes.String
+    return TagTypes.Unknown
+
+
+def propose_tags(spans):
+    '''Returns a TagStore proposing a tag for each invariant span: a
+    Signature for one at the start of the file, otherwise a Constant.'''
+    tags = TagStore()
+    for start, end, value in spans:
+        if start == 0:
+            name = 'Signature'
+            role = TagRoles.Signature
+        else:
+            name = 'Constant at 0x{:08x}'.format(start)
+            role = TagRoles.Constant
+        if not any(value):
+            comment = 'Always zero'
+        elif len(value) > COMMENT_BYTES:
+            comment = 'Always {}...'.format(value[:COMMENT_BYTES].hex())
+        else:
+            comment = 'Always {}'.format(value.hex())
+        tags.append(
+            name=name,
+            start=start,
+            end=end - 1,
+            type=_span_type(value),
+            role=role,
+            comment=comment)
+    return tags
+
+
+def main(argv=None):
+    '''Command line options.'''
+    parser = argparse.ArgumentParser(
+        prog='hanalyse corpus',
+        description='Propose Constant and Signature tags for the bytes that '
+                    'are the same in every sample of a format')
+
+    parser.add_argument(
+        '-o',
+        '--out',
+        dest='outfile',
+        required=True,
+        metavar='FILE',
+        help='the tag file to write the proposed tags to')
+
+    parser.add_argument(
+        '-c',
+        '--columns',
+        dest='columns',
+        default=None,
+        metavar='FILE',
+        help='also write the range of values and the correlation with '
+             'sample length of every varying offset, as CSV')
+
+    parser.add_argument(
+        '-m',
+        '--min-length',
+        dest='min_length',
+        type=int,
+        default=2,
+        help='the shortest invariant run to propose (default: 2)')
+
+    parser.add_argument(
+        'files',
+        nargs='+',
+        metavar='FILE',
+        help='the samples, at least two')
+
+    args = parser.parse_args(argv)
+    if len(args.files) < 2:
+        parser.error('at least two samples are needed')
+
+    columns = None
+    if args.columns is not None:
+        columns = open(args.columns, 'w')
+        columns.write('offset,minimum,maximum,correlation\n')
+
+    def blocks():
+        for block in column_blocks(
+                args.files, statistics=columns is not None):
+            if columns is not None:
+                for run in _VARIANT_RUN.finditer(block.difference):
+                    for offset in range(*run.span()):
+                        correlation = block.correlation[offset]
+                        columns.write('{},{},{},{}\n'.format(
+                            block.start + offset,
+                            block.minimum[offset],
+                            block.maximum[offset],
+                            '' if correlation is None else
+                            '{:.3f}'.format(correlation)))
+            yield block
+
+    try:
+        tags = propose_tags(invariant_spans(blocks(), args.min_length))
+    finally:
+        if columns is not None:
+            columns.close()
+    write_tags(args.outfile, tags)
+
+    sys.stderr.write('Proposed {} tags from {} samples\n'.format(
+        len(tags), len(args.files)))
+    return 0
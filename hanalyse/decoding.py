@@ -0,0 +1,169 @@
+'''Reading the values of tags from file data.'''
+
+import contextlib
+import mmap
+import struct
+import sys
+
+from .tags import TagTypes
+
+__all__ = [
+    'TYPEFORMATS', 'type_struct', 'decode_value', 'map_file', 'mapped_file',
+    'TagDecoder']
+
+# struct format characters for the fixed-size numeric types.
+TYPEFORMATS = {
+    TagTypes.Uint8: 'B',
+    TagTypes.Uint16: 'H',
+    TagTypes.Uint32: 'I',
+    TagTypes.Uint64: 'Q',
+    TagTypes.Int8: 'b',
+    TagTypes.Int16: 'h',
+    TagTypes.Int32: 'i',
+    TagTypes.Int64: 'q',
+}
+
+BYTEORDERS = {
+    'little': '<',
+    'big': '>',
+}
+
+
+_structs = {}
+
+
+def _struct(format):
+    try:
+        return _structs[format]
+    except KeyError:
+        unpacker = _structs[format] = struct.Struct(format)
+        return unpacker
+
+
+def map_file(filename):
+    '''Maps a file read-only, giving an empty bytes object for an empty
+    file. The map stays valid once the file is closed; close it when done
+    with it.'''
+    with open(filename, 'rb') as data_file:
+        try:
+            return mmap.mmap(
+                data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return b''
+
+
+@contextlib.contextmanager
+def mapped_file(filename):
+    '''Maps a file read-only for the duration of a with block, giving an
+    empty bytes object for an empty file.'''
+    data = map_file(filename)
+    try:
+        yield data
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def type_struct(tag_type, byteorder=sys.byteorder):
+    '''Returns the precompiled struct.Struct for a numeric type.'''
+    return _struct(BYTEORDERS[byteorder] + TYPEFORMATS[tag_type])
+
+
+def decode_value(data, start, end, tag_type, byteorder=sys.byteorder):
+    '''Decodes the value of a tag of the given type from the bytes-like
+    data. Numbers are read from start, Chars and Strings cover start to end
+    inclusive and come back as text, and anything else but an Array comes
+    back as a hex string. Returns None if the data is too short, and for
+    Arrays, which are evaluated lazily (see arrays.resolve_array).'''
+    if tag_type in TYPEFORMATS:
+        unpacker = _struct(BYTEORDERS[byteorder] + TYPEFORMATS[tag_type])
+        if start + unpacker.size > len(data):
+            return None
+        return unpacker.unpack_from(data, start)[0]
+
+    if tag_type == TagTypes.Array:
+        return None
+    if end >= len(data) or end < start:
+        return None
+    raw = bytes(data[start:end + 1])
+    if tag_type == TagTypes.Char or tag_type == TagTypes.String:
+        return raw.decode('latin-1')
+    return raw.hex()
+
+
+class TagDecoder(object):
+    '''Decodes the values of a fixed set of tags from any number of
+    buffers.
+
+    The numeric tags are grouped by type and, for each group, runs of
+    non-overlapping tags are compiled into a single struct.Struct with pad
+    bytes between the fields, so each run is decoded by one unpack_from
+    call. Other types are sliced out one at a time.'''
+
+    def __init__(self, tags, byteorder=sys.byteorder):
+        '''tags is an iterable of (start, end, type) tuples, or of objects
+        with those attributes.'''
+        self._byteorder = byteorder
+        self._tags = [
+            tag if isinstance(tag, tuple) else (tag.start, tag.end, tag.type)
+            for tag in tags]
+
+        groups = {}
+        self._others = []
+        for row, (start, end, tag_type) in enumerate(self._tags):
+            if tag_type in TYPEFORMATS:
+                groups.setdefault(tag_type, []).append((start, row))
+            else:
+                self._others.append(row)
+
+        # Each run is (Struct, first start, rows in field order).
+        self._runs = []
+        prefix = BYTEORDERS[byteorder]
+        for tag_type, members in groups.items():
+            code = TYPEFORMATS[tag_type]
+            size = struct.calcsize(prefix + code)
+            members.sort()
+            run_start = None
+            for start, row in members:
+                if run_start is not None and start >= position:
+                    gap = start - position
+                    fields.append('{}x{}'.format(gap, code) if gap else code)
+                    rows.append(row)
+                else:
+                    if run_start is not None:
+                        self._add_run(prefix, fields, run_start, rows)
+                    run_start = start
+                    fields = [code]
+                    rows = [row]
+                position = start + size
+            if run_start is not None:
+                self._add_run(prefix, fields, run_start, rows)
+
+    def _add_run(self, prefix, fields, start, rows):
+        self._runs.append(
+            (struct.Struct(prefix + ''.join(fields)), start, rows))
+
+    def __len__(self):
+        return len(self._tags)
+
+    def decode(self, data):
+        '''Returns the list of values of all tags, in the order the tags
+        were given, with None for tags that lie beyond the data.'''
+        values = [None] * len(self._tags)
+        length = len(data)
+        for unpacker, start, rows in self._runs:
+            if start + unpacker.size <= length:
+                for row, value in zip(rows, unpacker.unpack_from(data, start)):
+                    values[row] = value
+            else:
+                # Partly beyond the data, so decode what is there.
+                for row in rows:
+                    start, end, tag_type = self._tags[row]
+                    values[row] = decode_value(
+                        data, start, end, tag_type, self._byteorder)
+        for row in self._others:
+            start, end, tag_type = self._tags[row]
+            values[row] = decode_value(
+                data, start, end, tag_type, self._byteorder)
+        return values
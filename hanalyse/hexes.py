@@ -115,18 +115,20 @@ class MainHexEdit(QHexEdit):
 
     @QtCore.pyqtSlot()
     def _on_rel_offset(self):
-        '''Emit the relativeOffset signal, containing the start and length of selection.'''
+        '''Emit the relativeOffset signal, containing the start and length of selection.
+
+        Relative offsets may point backwards, so are read as signed. The
+        receiver chooses the base they are relative to.'''
         start = self.selectionStart()
         length = self.selectionLength()
         offset = 0
         if self._data_reader is not None:
             data = self._data_reader.read(start, length + 1)
             if self.sender() == self._relLittle:
-                offset = int.from_bytes(data, 'little', signed=False)
+                offset = int.from_bytes(data, 'little', signed=True)
             else:
-                offset = int.from_bytes(data, 'big', signed=False)
+                offset = int.from_bytes(data, 'big', signed=True)
 
-        # TODO: Add current position to signal
         self.relativeOffset.emit(
             start,
             length,
@@ -172,7 +174,9 @@ class SlaveHexEdit(QHexEdit):
             self,
             parent=None,
             on_find=None,
-            on_find_again=None):
+            on_find_again=None,
+            on_find_pattern=None,
+            on_cancel_search=None):
 
         super(SlaveHexEdit, self).__init__(parent)
         self.setReadOnly(True)
@@ -194,9 +198,30 @@ class SlaveHexEdit(QHexEdit):
         if on_find_again is not None:
             self._findOffsetAgain.triggered.connect(on_find_again)
 
+        self._findPattern = create_action(
+            parent=self,
+            name='contextFindPattern',
+            text='Find bytes ...')
+        if on_find_pattern is not None:
+            self._findPattern.triggered.connect(on_find_pattern)
+
+        self._cancelSearch = create_action(
+            parent=self,
+            name='contextCancelSearch',
+            text='Cancel search')
+        self._cancelSearch.setEnabled(False)
+        if on_cancel_search is not None:
+            self._cancelSearch.triggered.connect(on_cancel_search)
+
         self.addAction(self._findOffset)
         self.addAction(self._findOffsetAgain)
+        self.addAction(self._findPattern)
+        self.addAction(self._cancelSearch)
         self.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
 
     def set_data_reader(self, reader):
         self._data_reader = reader
+
+    def set_searching(self, searching):
+        '''Enables the Cancel search action while a search runs.'''
+        self._cancelSearch.setEnabled(searching)
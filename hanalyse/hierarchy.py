@@ -0,0 +1,220 @@
+'''The hierarchy of a set of tags, as given by their parent fields.
+
+A tag's parent is the identifier of another tag, so that each of many
+records with the same name has fields of its own. Tags without a parent,
+or whose parent is no tag's identifier, are at the top level, as are
+those that would otherwise be their own ancestors. Should two tags share
+an identifier, the first is the parent.
+
+Children are kept in row order under each parent, and every row records
+its parent and its position among its parent's children, so a tree view
+can go from a row to its place in the tree and back in constant time.'''
+
+from array import array
+import bisect
+
+from .tags import TagStore
+
+__all__ = ['TagHierarchy', 'TOP']
+
+# The parent of a top-level row
+TOP = -1
+
+
+def _identifiers_and_parents(tags):
+    '''The identifier and parent of each row of a sequence of tags.'''
+    if isinstance(tags, TagStore):
+        return tags.identifiers[:], tags.parents
+    identifiers = []
+    parents = []
+    for row in range(len(tags)):
+        tag = tags[row]
+        identifiers.append(tag.identifier)
+        parents.append(tag.parent)
+    return identifiers, parents
+
+
+class TagHierarchy(object):
+    '''The tree of the rows of a TagStore, or anything indexed like one.
+
+    Built in one pass over the tags. Rows appended to the tags, changes to
+    the parent of a tag, which takes its children with it, and to the
+    identifier of a tag with no children, can then be taken in with append
+    and update; any other change needs a new TagHierarchy.'''
+
+    def __init__(self, tags):
+        self._identifiers, parents = _identifiers_and_parents(tags)
+        count = len(self._identifiers)
+        # The row of each identifier, the first of any repeated, the last
+        # of each in reverse order; 0 is no tag
+        self._rows_by_id = dict(zip(
+            reversed(self._identifiers), range(count - 1, -1, -1)))
+        self._rows_by_id.pop(0, None)
+        # Parents that are no tag's identifier, and so might be of a tag
+        # appended later
+        self._unresolved = set(parents)
+        self._unresolved.difference_update(self._rows_by_id, (0,))
+        get = self._rows_by_id.get
+        self._parents = array('q', [get(parent, TOP) for parent in parents])
+        # Whether a loop was broken, leaving a link that update cannot see
+        self._broken = self._break_cycles()
+
+        # As _attach, inlined, the rows coming in order
+        self._children = children = {TOP: array('L')}
+        self._positions = positions = array('L', [0]) * count
+        for row, parent in enumerate(self._parents):
+            try:
+                siblings = children[parent]
+            except KeyError:
+                siblings = children[parent] = array('L')
+            positions[row] = len(siblings)
+            siblings.append(row)
+
+    def _resolve(self, parent):
+        if not parent:
+            return TOP
+        try:
+            return self._rows_by_id[parent]
+        except KeyError:
+            self._unresolved.add(parent)
+            return TOP
+
+    def _break_cycles(self):
+        '''Moves to the top level each tag whose parent is, through its
+        parents, itself. Returns True if there were any.'''
+        parents = self._parents
+        broken = False
+        # 0 not yet seen, 1 on the path being followed, 2 done
+        state = bytearray(len(parents))
+        for first in range(len(parents)):
+            if state[first]:
+                continue
+            parent = parents[first]
+            if parent == TOP or state[parent] == 2:
+                state[first] = 2
+                continue
+            path = []
+            row = first
+            while row != TOP and not state[row]:
+                state[row] = 1
+                path.append(row)
+                row = parents[row]
+            if row != TOP and state[row] == 1:
+                # The last tag on the path closes a loop
+                parents[path[-1]] = TOP
+                broken = True
+            for row in path:
+                state[row] = 2
+        return broken
+
+    def _attach(self, row, parent):
+        '''Adds a row to its parent's children, in row order.'''
+        try:
+            children = self._children[parent]
+        except KeyError:
+            children = self._children[parent] = array('L')
+        if not children or children[-1] < row:
+            self._positions[row] = len(children)
+            children.append(row)
+            return
+        position = bisect.bisect_left(children, row)
+        children.insert(position, row)
+        for later in range(position, len(children)):
+            self._positions[children[later]] = later
+
+    def _detach(self, row):
+        children = self._children[self._parents[row]]
+        position = self._positions[row]
+        del children[position]
+        for later in range(position, len(children)):
+            self._positions[children[later]] = later
+
+    def __len__(self):
+        return len(self._parents)
+
+    def children(self, row=TOP):
+        '''The rows of the children of a row, or of the top-level rows.'''
+        return self._children.get(row, ())
+
+    def child_count(self, row=TOP):
+        return len(self._children.get(row, ()))
+
+    def parent(self, row):
+        '''The row of a row's parent, or TOP.'''
+        return self._parents[row]
+
+    def position(self, row):
+        '''The place of a row among its parent's children.'''
+        return self._positions[row]
+
+    def insertion_position(self, row, parent):
+        '''The place a row would take among the children of parent.'''
+        return bisect.bisect_left(self.children(parent), row)
+
+    def path(self, row):
+        '''The rows from the top level down to a row.'''
+        path = [row]
+        parent = self._parents[row]
+        while parent != TOP:
+            path.append(parent)
+            parent = self._parents[parent]
+        path.reverse()
+        return path
+
+    def append(self, identifier, parent):
+        '''Adds a row appended to the tags, with the given identifier and
+        parent, returning its parent. Returns None if the new tag is the
+        parent of earlier rows: the hierarchy must be built again.'''
+        if identifier in self._unresolved:
+            return None
+        row = len(self._parents)
+        parent_row = self._resolve(parent)
+        self._identifiers.append(identifier)
+        if identifier:
+            self._rows_by_id.setdefault(identifier, row)
+        self._parents.append(parent_row)
+        self._positions.append(0)
+        self._attach(row, parent_row)
+        return parent_row
+
+    def new_parent(self, row, identifier, parent):
+        '''The parent a row will have once its identifier and parent are
+        changed, or None if the change reaches beyond the row and its
+        children, so that the hierarchy must be built again: if it would
+        make the row its own ancestor, if a loop was broken when the
+        hierarchy was built, or if a row with children, or that other rows
+        name, gets a new identifier.'''
+        if self._broken:
+            return None
+        old_identifier = self._identifiers[row]
+        if identifier != old_identifier:
+            if self._children.get(row) or identifier in self._unresolved:
+                return None
+            if self._rows_by_id.get(identifier, row) != row:
+                # Another row has the identifier
+                return None
+        if not parent:
+            return TOP
+        parent_row = self._rows_by_id.get(parent)
+        if parent_row is None:
+            return TOP
+        if parent_row == row or row in self.path(parent_row):
+            return None
+        return parent_row
+
+    def update(self, row, identifier, parent, parent_row):
+        '''Changes the identifier and parent of a row, which new_parent
+        placed under parent_row.'''
+        old_identifier = self._identifiers[row]
+        if identifier != old_identifier:
+            self._identifiers[row] = identifier
+            if self._rows_by_id.get(old_identifier) == row:
+                del self._rows_by_id[old_identifier]
+            if identifier:
+                self._rows_by_id[identifier] = row
+        if parent and parent not in self._rows_by_id:
+            self._unresolved.add(parent)
+        if parent_row != self._parents[row]:
+            self._detach(row)
+            self._parents[row] = parent_row
+            self._attach(row, parent_row)
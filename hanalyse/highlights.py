@@ -0,0 +1,167 @@
+from .intervals import IntervalIndex
+
+__all__ = ['HighlightManager']
+
+# Bytes either side of the visible area that are kept highlighted, so that
+# small scrolls need no work.
+VIEWPORT_MARGIN = 0x1000
+# Bytes either side of the visible area that tags are queried for, so that
+# a query is needed only once the view has moved this far.
+QUERY_MARGIN = 0x10000
+
+
+class HighlightManager(object):
+    '''The HighlightManager decides which tag highlights and comments are
+    pushed to a MainHexEdit.
+
+    Adjacent or overlapping tags with the same colour are merged into
+    single spans, and only the spans and comments that intersect the
+    visible area (plus a margin) are given to the widget. Calling sync
+    after the view scrolls pushes what has come into view and clears what
+    has left it.
+
+    The tags are either all given at once with set_tags or, for a tag
+    database, asked for around the view with set_query.'''
+
+    def __init__(self, hex_edit, colours, margin=VIEWPORT_MARGIN,
+                 query_margin=QUERY_MARGIN):
+        self._hex_edit = hex_edit
+        self._colours = colours
+        self._margin = margin
+        self._query_margin = query_margin
+        self._query = None
+        # The range the spans and comments were queried for
+        self._queried = None
+
+        self._spans = []
+        self._span_index = IntervalIndex()
+        self._comments = []
+        self._comment_index = IntervalIndex()
+
+        self._shown_spans = set()
+        self._shown_comments = set()
+
+    def set_tags(self, tags):
+        '''Replaces all highlights with those for an iterable of tags.'''
+        self.clear()
+        self._query = None
+        self._load(tags)
+        self.sync()
+
+    def set_query(self, query):
+        '''Replaces all highlights with those for the tags returned by
+        query(start, end), which gives the tags overlapping a range, such as
+        TagDatabase.overlapping_tags. Tags are asked for a query margin
+        either side of the view, and again once the view leaves that.'''
+        self.clear()
+        self._query = query
+        self.sync()
+
+    def _load(self, tags):
+        comments = [(tag.start, tag.end, tag.role, tag.name) for tag in tags]
+        comments.sort()
+
+        # Merge runs of touching or overlapping tags with the same colour.
+        spans = []
+        for start, end, role, name in comments:
+            colour = self._colours[role]
+            if spans:
+                last_start, last_end, last_colour = spans[-1]
+                if last_colour == colour and start <= last_end + 1:
+                    if end > last_end:
+                        spans[-1] = (last_start, end, colour)
+                    continue
+            spans.append((start, end, colour))
+
+        self._spans = spans
+        self._span_index.reset(
+            (span[0] for span in spans), (span[1] for span in spans))
+        self._comments = comments
+        self._comment_index.reset(
+            (comment[0] for comment in comments),
+            (comment[1] for comment in comments))
+
+    def add_tag(self, tag):
+        '''Adds the highlight and comment for one new tag.'''
+        self._spans.append((tag.start, tag.end, self._colours[tag.role]))
+        self._span_index.insert(len(self._span_index), tag.start, tag.end)
+        self._comments.append((tag.start, tag.end, tag.role, tag.name))
+        self._comment_index.insert(
+            len(self._comment_index), tag.start, tag.end)
+        self.sync()
+
+    def clear(self):
+        '''Removes everything this manager has pushed to the widget.'''
+        self._unpush()
+        self._spans = []
+        self._span_index.clear()
+        self._comments = []
+        self._comment_index.clear()
+        self._queried = None
+
+    def _unpush(self):
+        for row in self._shown_spans:
+            start, end, colour = self._spans[row]
+            self._hex_edit.clearHighlight(start, end)
+        for row in self._shown_comments:
+            start, end, role, name = self._comments[row]
+            self._hex_edit.uncommentRange(start, end)
+        self._shown_spans = set()
+        self._shown_comments = set()
+
+    def refresh(self):
+        '''Pushes everything in view again, for when the widget has been
+        given new data and has dropped its highlights.'''
+        self._shown_spans = set()
+        self._shown_comments = set()
+        self.sync()
+
+    def _window(self):
+        start = self._hex_edit.visibleStartOffset() - self._margin
+        end = self._hex_edit.visibleEndOffset() + self._margin
+        return max(start, 0), end
+
+    def sync(self, *args):
+        '''Brings the widget up to date with the visible area. Takes and
+        ignores any signal arguments so it can be connected directly.'''
+        start, end = self._window()
+        hex_edit = self._hex_edit
+
+        if self._query is not None and (
+                self._queried is None or
+                start < self._queried[0] or end > self._queried[1]):
+            self._unpush()
+            queried = (
+                max(start - self._query_margin, 0), end + self._query_margin)
+            self._load(self._query(*queried))
+            self._queried = queried
+
+        wanted = set(self._span_index.overlapping(start, end))
+        gone = self._shown_spans - wanted
+        for row in gone:
+            span_start, span_end, colour = self._spans[row]
+            hex_edit.clearHighlight(span_start, span_end)
+
+        # Clearing a span may have uncovered parts of the spans that stay.
+        repaint = wanted - self._shown_spans
+        if gone:
+            for row in wanted & self._shown_spans:
+                span_start, span_end, colour = self._spans[row]
+                for gone_row in gone:
+                    gone_start, gone_end, gone_colour = self._spans[gone_row]
+                    if span_start <= gone_end and gone_start <= span_end:
+                        repaint.add(row)
+                        break
+        for row in sorted(repaint):
+            span_start, span_end, colour = self._spans[row]
+            hex_edit.highlightBackground(span_start, span_end, colour)
+        self._shown_spans = wanted
+
+        wanted = set(self._comment_index.overlapping(start, end))
+        for row in self._shown_comments - wanted:
+            comment_start, comment_end, role, name = self._comments[row]
+            hex_edit.uncommentRange(comment_start, comment_end)
+        for row in sorted(wanted - self._shown_comments):
+            comment_start, comment_end, role, name = self._comments[row]
+            hex_edit.commentRange(comment_start, comment_end, name)
+        self._shown_comments = wanted
@@ -0,0 +1,355 @@
+'''hanalyse infer -- guess Count, Size and Offset fields from a corpus.
+
+Every aligned 2, 4 and 8 byte integer in either byte order in the headers
+of the samples is a field, and each field is a column of values, one per
+sample. Columns are read a whole header at a time with array, so finding
+the fields costs a few C loops per sample, and each kind of field is then
+looked for among the columns:
+
+* a Size is a field whose values follow the sample lengths, exactly or
+  with a constant difference, or at least with a strong correlation;
+* an Offset is a field whose values are aligned and in bounds in every
+  sample, and whose targets look alike across the samples;
+* a Count is a field that, multiplied by a Size-like field, covers a
+  region: from an Offset to the end of the file or to another Offset, or
+  from a fixed header to the end.
+
+Pairing every field with every other is far too slow, so Count and Size
+pairs are found by a join: for each count column and each region, the
+element size the pair would need is worked out per sample and looked up
+in a dict of the columns by their values.'''
+
+import argparse
+from array import array
+import contextlib
+import math
+import operator
+import sys
+
+from .decoding import mapped_file
+from .tags import TagRoles, TagStore, TagTypes, write_tags
+
+__all__ = ['Field', 'Candidate', 'fields', 'infer', 'main']
+
+HEADER_SIZE = 4096
+
+WIDTHS = (2, 4, 8)
+BYTEORDERS = ('little', 'big')
+TYPECODES = {2: 'H', 4: 'I', 8: 'Q'}
+TYPES = {2: TagTypes.Uint16, 4: TagTypes.Uint32, 8: TagTypes.Uint64}
+
+# How many bytes at each Offset target are compared across samples
+TARGET_BYTES = 16
+# The least similarity for a target to be taken as an Offset
+MIN_SIMILARITY = 0.5
+# The least correlation with the sample length for a Size
+MIN_CORRELATION = 0.98
+# The most Offset candidates used as region boundaries for Counts
+MAX_BOUNDARIES = 64
+# The largest element size considered for a Count
+MAX_ELEMENT_SIZE = 1 << 16
+
+
+class Field(object):
+    '''An integer at a fixed offset, with its value in each sample.'''
+
+    __slots__ = ('start', 'width', 'byteorder', 'values')
+
+    def __init__(self, start, width, byteorder, values):
+        self.start = start
+        self.width = width
+        self.byteorder = byteorder
+        self.values = values
+
+    @property
+    def end(self):
+        return self.start + self.width - 1
+
+    @property
+    def constant(self):
+        return min(self.values) == max(self.values)
+
+    def __str__(self):
+        return '0x{:08x} {}-byte {}'.format(
+            self.start, self.width, self.byteorder)
+
+
+class Candidate(object):
+    '''A guess that a field has a role, with a score from 0 to 1 and the
+    reason for it.'''
+
+    __slots__ = ('field', 'role', 'score', 'reason')
+
+    def __init__(self, field, role, score, reason):
+        self.field = field
+        self.role = role
+        self.score = score
+        self.reason = reason
+
+    def tag(self):
+        '''The proposed tag, as keyword arguments for TagStore.append.'''
+        return {
+            'name': '{} at 0x{:08x}'.format(self.role.name, self.field.start),
+            'start': self.field.start,
+            'end': self.field.end,
+            'type': TYPES[self.field.width],
+            'role': self.role,
+            'comment': '{} ({}, score {:.2f})'.format(
+                self.reason, self.field.byteorder, self.score),
+        }
+
+
+def fields(samples, header_size=HEADER_SIZE):
+    '''Returns a Field for every aligned integer of each width and byte
+    order in the part of the header that every sample has.'''
+    common = min(min(len(sample) for sample in samples), header_size)
+    found = []
+    for width in WIDTHS:
+        count = common // width
+        if not count:
+            continue
+        for byteorder in BYTEORDERS:
+            rows = []
+            for sample in samples:
+                values = array(TYPECODES[width])
+                values.frombytes(sample[:count * width])
+                if byteorder != sys.byteorder:
+                    values.byteswap()
+                rows.append(values)
+            for position, values in enumerate(zip(*rows)):
+                found.append(
+                    Field(position * width, width, byteorder, values))
+    return found
+
+
+def _correlation(values, centred, centred_deviation):
+    count = len(values)
+    mean = sum(values) / count
+    deviation = math.sqrt(max(
+        sum(map(operator.mul, values, values)) - count * mean * mean, 0))
+    if not deviation:
+        return 0.0
+    return (
+        sum(map(operator.mul, values, centred)) /
+        (deviation * centred_deviation))
+
+
+def size_candidates(columns, lengths):
+    '''Fields whose values follow the sample lengths.'''
+    if min(lengths) == max(lengths):
+        return []
+    mean = sum(lengths) / len(lengths)
+    centred = [length - mean for length in lengths]
+    centred_deviation = math.sqrt(sum(map(operator.mul, centred, centred)))
+
+    candidates = []
+    for field in columns:
+        values = field.values
+        if field.constant or max(map(operator.sub, values, lengths)) > 0:
+            continue
+        differences = set(map(operator.sub, lengths, values))
+        if len(differences) == 1:
+            difference = differences.pop()
+            if difference:
+                reason = 'file length - {}'.format(difference)
+            else:
+                reason = 'file length'
+            candidates.append(Candidate(field, TagRoles.Size, 1.0, reason))
+            continue
+        correlation = _correlation(values, centred, centred_deviation)
+        if correlation >= MIN_CORRELATION:
+            candidates.append(Candidate(
+                field, TagRoles.Size, 0.9 * correlation,
+                'follows file length (r={:.3f})'.format(correlation)))
+    return candidates
+
+
+def _similarity(samples, targets):
+    '''How alike the bytes at each sample's target are: the mean of the
+    fraction of positions with the same byte in every sample and the
+    fraction with the same kind of byte (zero, text or other).'''
+    length = min(
+        min(len(sample) - target for sample, target in zip(samples, targets)),
+        TARGET_BYTES)
+    if length <= 0:
+        return 0.0
+    windows = [
+        sample[target:target + length]
+        for sample, target in zip(samples, targets)]
+    same = 0
+    alike = 0
+    for column in zip(*windows):
+        if min(column) == max(column):
+            same += 1
+            alike += 1
+            continue
+        kinds = {
+            0 if byte == 0 else 1 if 0x20 <= byte < 0x7f else 2
+            for byte in column}
+        if len(kinds) == 1:
+            alike += 1
+    return (same + alike) / (2 * length)
+
+
+def offset_candidates(columns, samples, lengths):
+    '''Fields whose values are aligned, in bounds and point at bytes that
+    look alike across the samples.'''
+    candidates = []
+    for field in columns:
+        values = field.values
+        alignment = min(field.width, 4)
+        if max(values) < TARGET_BYTES:
+            continue
+        if any(value % alignment for value in values):
+            continue
+        if any(map(operator.ge, values, lengths)):
+            continue
+        similarity = _similarity(samples, values)
+        if similarity < MIN_SIMILARITY:
+            continue
+        score = similarity if not field.constant else 0.8 * similarity
+        candidates.append(Candidate(
+            field, TagRoles.Offset, score,
+            'targets alike ({:.0%})'.format(similarity)))
+    return candidates
+
+
+def count_candidates(columns, lengths, offsets):
+    '''Pairs of fields whose product covers a region. Returns Candidates
+    for the counts, whose reasons name the size field.'''
+    count = len(lengths)
+
+    # Columns that could be element sizes, by their values
+    sizes = {}
+    for field in columns:
+        values = field.values
+        if min(values) > 0 and max(values) <= MAX_ELEMENT_SIZE:
+            sizes.setdefault(tuple(values), []).append(field)
+    constant_sizes = {
+        values[0]: found for values, found in sizes.items()
+        if min(values) == max(values)}
+
+    # Regions whose lengths vary, from Offsets to the end or to each other
+    boundaries = sorted(
+        offsets, key=lambda candidate: -candidate.score)[:MAX_BOUNDARIES]
+    regions = []
+    for first in boundaries:
+        regions.append((
+            'from {} to the end'.format(first.field),
+            list(map(operator.sub, lengths, first.field.values))))
+        for second in boundaries:
+            spans = list(map(
+                operator.sub, second.field.values, first.field.values))
+            if min(spans) > 0:
+                regions.append((
+                    'from {} to {}'.format(first.field, second.field),
+                    spans))
+
+    candidates = []
+    for field in columns:
+        values = field.values
+        if field.constant or min(values) <= 0 or \
+                any(map(operator.gt, values, lengths)):
+            continue
+
+        for region, spans in regions:
+            if any(map(operator.mod, spans, values)):
+                continue
+            for size in sizes.get(
+                    tuple(map(operator.floordiv, spans, values)), ()):
+                if size is not field:
+                    candidates.append(Candidate(
+                        field, TagRoles.Count, 1.0,
+                        'x {} covers {}'.format(size, region)))
+
+        # A fixed header and then count elements of a constant size
+        changes = [
+            (lengths[i] - lengths[0], values[i] - values[0])
+            for i in range(1, count) if values[i] != values[0]]
+        length_change, value_change = changes[0]
+        if length_change % value_change:
+            continue
+        element_size = length_change // value_change
+        header = lengths[0] - values[0] * element_size
+        if header < 0 or any(
+                length - value * element_size != header
+                for length, value in zip(lengths, values)):
+            continue
+        for size in constant_sizes.get(element_size, ()):
+            candidates.append(Candidate(
+                field, TagRoles.Count, 0.9,
+                'x {} covers the file after {} bytes'.format(size, header)))
+    return candidates
+
+
+def infer(samples, header_size=HEADER_SIZE):
+    '''Returns the Count, Size and Offset Candidates for a corpus of
+    samples given as buffers, best first.'''
+    lengths = [len(sample) for sample in samples]
+    columns = fields(samples, header_size)
+    offsets = offset_candidates(columns, samples, lengths)
+    candidates = (
+        size_candidates(columns, lengths) + offsets +
+        count_candidates(columns, lengths, offsets))
+    candidates.sort(
+        key=lambda candidate: (-candidate.score, candidate.field.start))
+
+    # Keep the best reason for each role of each field
+    best = []
+    seen = set()
+    for candidate in candidates:
+        field = candidate.field
+        key = (candidate.role, field.start, field.width, field.byteorder)
+        if key not in seen:
+            seen.add(key)
+            best.append(candidate)
+    return best
+
+
+def main(argv=None):
+    '''Command line options.'''
+    parser = argparse.ArgumentParser(
+        prog='hanalyse infer',
+        description='Propose Count, Size and Offset tags from samples of a '
+                    'format')
+
+    parser.add_argument(
+        '-o',
+        '--out',
+        dest='outfile',
+        required=True,
+        metavar='FILE',
+        help='the tag file to write the proposed tags to')
+
+    parser.add_argument(
+        '--header',
+        dest='header_size',
+        type=int,
+        default=HEADER_SIZE,
+        help='how many bytes at the start of each sample to look for '
+             'fields in (default: {})'.format(HEADER_SIZE))
+
+    parser.add_argument(
+        'files',
+        nargs='+',
+        metavar='FILE',
+        help='the samples, at least two')
+
+    args = parser.parse_args(argv)
+    if len(args.files) < 2:
+        parser.error('at least two samples are needed')
+
+    with contextlib.ExitStack() as stack:
+        samples = [
+            stack.enter_context(mapped_file(filename))
+            for filename in args.files]
+        candidates = infer(samples, args.header_size)
+
+    tags = TagStore()
+    for candidate in candidates:
+        tags.append(**candidate.tag())
+    write_tags(args.outfile, tags)
+
+    sys.stderr.write('Proposed {} tags from {} samples\n'.format(
+        len(tags), len(args.files)))
+    return 0
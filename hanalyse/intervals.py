@@ -0,0 +1,198 @@
+from array import array
+import heapq
+
+__all__ = ['IntervalIndex']
+
+# Rows changed since the tree was built that are searched one by one, and
+# runs of rows inserted or removed before others, before it is built again
+MAX_PENDING = 512
+MAX_SHIFTS = 16
+
+
+class IntervalIndex(object):
+    '''An index of closed intervals [start, end], each associated with a
+    row number, answering "which intervals overlap this range?".
+
+    The intervals are held in arrays sorted by start offset, which are
+    treated as an implicit balanced binary tree (the middle element of each
+    sub-array is the node, the halves either side are its subtrees). Each
+    node is augmented with the maximum end offset in its subtree so that
+    whole subtrees can be skipped, giving O(log n + k) queries that also
+    report nested intervals.
+
+    Changes are taken in without building the tree again: rows inserted or
+    changed are kept aside and checked one by one, the rows of the tree
+    are renumbered past those inserted or removed before them as they are
+    found, and the tree is only built again once MAX_PENDING rows or
+    MAX_SHIFTS such runs have built up. Rows appended move no others, so
+    need no run.
+    '''
+
+    def __init__(self):
+        self._all_starts = array('q')
+        self._all_ends = array('q')
+        self._starts = array('q')
+        self._ends = array('q')
+        self._rows = array('q')
+        self._max_ends = array('q')
+        self._stale = False
+        # Rows, as they are now, not in the tree or changed since it was
+        # built
+        self._pending = set()
+        # (row, count) for each run of rows inserted since the tree was
+        # built, or (row, -count) for each removed, in order
+        self._shifts = []
+
+    def __len__(self):
+        return len(self._all_starts)
+
+    def clear(self):
+        self.reset((), ())
+
+    def reset(self, starts, ends):
+        '''Replace the contents with the intervals given as parallel
+        sequences of start and end offsets, indexed by row number.'''
+        self._all_starts = array('q', starts)
+        self._all_ends = array('q', ends)
+        self._stale = True
+
+    def insert(self, row, start, end):
+        if row < len(self._all_starts):
+            self._shifts.append((row, 1))
+            self._pending = {
+                pending + 1 if pending >= row else pending
+                for pending in self._pending}
+        self._all_starts.insert(row, start)
+        self._all_ends.insert(row, end)
+        self._pending.add(row)
+
+    def remove(self, row, count=1):
+        del self._all_starts[row:row + count]
+        del self._all_ends[row:row + count]
+        self._shifts.append((row, -count))
+        self._pending = {
+            pending - count if pending >= row + count else pending
+            for pending in self._pending
+            if not row <= pending < row + count}
+
+    def update(self, row, start, end):
+        self._all_starts[row] = start
+        self._all_ends[row] = end
+        self._pending.add(row)
+
+    def _current_row(self, row):
+        '''The row now of a row in the tree, or None if it was removed.'''
+        for position, count in self._shifts:
+            if row >= position:
+                if count > 0:
+                    row += count
+                elif row < position - count:
+                    return None
+                else:
+                    row += count
+        return row
+
+    def _check(self):
+        '''Builds the tree again if it is out of date.'''
+        if (self._stale or len(self._pending) > MAX_PENDING or
+                len(self._shifts) > MAX_SHIFTS):
+            self._rebuild()
+
+    def _rebuild(self):
+        all_starts = self._all_starts
+        all_ends = self._all_ends
+        order = sorted(range(len(all_starts)), key=all_starts.__getitem__)
+        self._rows = array('q', order)
+        self._starts = array('q', [all_starts[row] for row in order])
+        self._ends = array('q', [all_ends[row] for row in order])
+        self._max_ends = array('q', self._ends)
+
+        # Post-order pass over the implicit tree to fill in the maximum
+        # end of each subtree.
+        max_ends = self._max_ends
+        stack = [(0, len(order), False)]
+        while stack:
+            lo, hi, visited = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if visited:
+                if lo < mid:
+                    left = max_ends[(lo + mid) // 2]
+                    if left > max_ends[mid]:
+                        max_ends[mid] = left
+                if mid + 1 < hi:
+                    right = max_ends[(mid + 1 + hi) // 2]
+                    if right > max_ends[mid]:
+                        max_ends[mid] = right
+            else:
+                stack.append((lo, hi, True))
+                stack.append((lo, mid, False))
+                stack.append((mid + 1, hi, False))
+        self._stale = False
+        self._pending = set()
+        self._shifts = []
+
+    def overlapping(self, start, end=None):
+        '''Return the sorted rows of all intervals overlapping [start, end].
+        If end is not given, the query is for the single offset start.'''
+        if end is None:
+            end = start
+        self._check()
+
+        starts = self._starts
+        ends = self._ends
+        max_ends = self._max_ends
+        rows = self._rows
+        found = []
+        stack = [(0, len(rows))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if max_ends[mid] < start:
+                # Nothing in this subtree reaches the query.
+                continue
+            stack.append((lo, mid))
+            if starts[mid] <= end:
+                if ends[mid] >= start:
+                    found.append(rows[mid])
+                stack.append((mid + 1, hi))
+        if self._shifts or self._pending:
+            current_row = self._current_row
+            pending = self._pending
+            found = [
+                row for row in map(current_row, found)
+                if row is not None and row not in pending]
+            all_starts = self._all_starts
+            all_ends = self._all_ends
+            found.extend(
+                row for row in pending
+                if all_starts[row] <= end and all_ends[row] >= start)
+        found.sort()
+        return found
+
+    def overlapping_points(self, points):
+        '''Return a dict mapping each of many offsets to the sorted rows of
+        the intervals containing it, in one sweep over the intervals. As
+        the sweep passes most intervals anyway, any changes are folded into
+        the tree first.'''
+        if self._stale or self._pending or self._shifts:
+            self._rebuild()
+
+        starts = self._starts
+        ends = self._ends
+        rows = self._rows
+        count = len(rows)
+        found = {}
+        active = []
+        position = 0
+        for point in sorted(set(points)):
+            while position < count and starts[position] <= point:
+                heapq.heappush(active, (ends[position], rows[position]))
+                position += 1
+            while active and active[0][0] < point:
+                heapq.heappop(active)
+            found[point] = sorted(row for end, row in active)
+        return found
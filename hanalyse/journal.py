@@ -0,0 +1,357 @@
+'''An append-only journal of the changes made to a YAML tag file.
+
+Saving a tag file writes every tag, so instead each change is appended to
+a journal next to the file (kwdb.yaml.journal for kwdb.yaml) as one line
+of JSON, which costs the same however many tags there are. Reopening the
+file replays the journal over it.
+
+Records name the rows they change and carry what they replace, so each has
+an inverse for undo:
+
+    {"op": "create", "row": 3, "tags": [{...}]}
+    {"op": "set", "row": 3, "key": "name", "value": "a", "old": "b"}
+    {"op": "delete", "row": 3, "tags": [{...}]}
+
+The first line of a journal names the snapshot it applies to, by the size
+and modification time of the tag file, so a journal left over from an
+older version of the file is not replayed over a newer one.
+
+Once a journal holds enough records it is compacted: it is moved aside
+and a new one started, and the tags as they were at that point are
+written over the tag file, after which the old journal is removed. Until
+then both journals are replayed, so nothing is lost if the program stops
+part way through.'''
+
+import enum
+import json
+import os
+import threading
+
+from .tags import Tag, write_tags
+
+__all__ = ['TagJournal', 'apply_record', 'inverse', 'journal_filename']
+
+# How many records a journal holds before it is compacted
+COMPACT_RECORDS = 1000
+
+# The base of a journal started while the previous one was compacted
+_AFTER_COMPACTING = 'compacting'
+
+FIELDS = (
+    'name', 'start', 'end', 'type', 'role', 'comment', 'of', 'count', 'size',
+    'parent', 'identifier')
+
+
+def journal_filename(filename):
+    return filename + '.journal'
+
+
+def _compacting_filename(filename):
+    return filename + '.journal.compacting'
+
+
+def _identity(filename):
+    '''The size and modification time of a snapshot, or None if there is
+    none yet.'''
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _json_value(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    return value
+
+
+def _line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def _tag_fields(tag):
+    '''The fields of a tag as a dict that can be written as JSON.'''
+    return {key: _json_value(getattr(tag, key)) for key in FIELDS}
+
+
+def apply_record(store, record):
+    '''Applies a journal record to a TagStore.'''
+    op = record['op']
+    row = record['row']
+    if op == 'create':
+        # With the identifiers they had, so that their children find them
+        created = [Tag(**fields) for fields in record['tags']]
+        store.insert(row, len(created))
+        for offset, tag in enumerate(created):
+            store[row + offset] = tag
+    elif op == 'set':
+        store.set_field(row, record['key'], record['value'])
+    elif op == 'delete':
+        store.remove(row, len(record['tags']))
+    else:
+        raise ValueError('Unknown journal record {!r}'.format(op))
+
+
+def _apply_records(store, records):
+    '''Applies journal records to a TagStore, skipping any that cannot be
+    applied. Returns how many were applied.'''
+    applied = 0
+    for record in records:
+        try:
+            apply_record(store, record)
+        except (ValueError, TypeError, KeyError, IndexError,
+                OverflowError) as err:
+            print('Skipping journal record {}: {}'.format(
+                _line(record).rstrip(), err))
+            continue
+        applied += 1
+    return applied
+
+
+def inverse(record):
+    '''The record that undoes a record.'''
+    op = record['op']
+    if op == 'create':
+        return dict(record, op='delete')
+    if op == 'delete':
+        return dict(record, op='create')
+    if op == 'set':
+        return dict(record, value=record['old'], old=record['value'])
+    raise ValueError('Unknown journal record {!r}'.format(op))
+
+
+def _read_journal(filename):
+    '''Returns the base and the records of a journal, or (None, None) if
+    there is no journal. A record cut short by a crash is skipped: it was
+    never replayed, so the records after it do not depend on it.'''
+    try:
+        journal_file = open(filename, 'r')
+    except FileNotFoundError:
+        return None, None
+    records = []
+    with journal_file:
+        try:
+            base = json.loads(journal_file.readline())['base']
+        except (ValueError, KeyError, TypeError):
+            return None, None
+        for line in journal_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return base, records
+
+
+class TagJournal(object):
+    '''The journal of a tag file, which need not exist yet.
+
+    replay is called once, on the tags read from the file, and then each
+    change is recorded with created, changed or deleted. When
+    needs_compaction becomes true, start_compaction is called, compact is
+    run with a copy of the tags, perhaps on another thread, and then
+    compaction_finished. save writes the whole file.'''
+
+    def __init__(self, filename, compact_records=COMPACT_RECORDS):
+        self._filename = filename
+        self._compact_records = compact_records
+        self._journal_file = None
+        self._records = 0
+        self._compacting = False
+        self._compacted_records = 0
+        # Bumped by save, so that an older compaction is not written over
+        # a newer save
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def filename(self):
+        '''The tag file the journal is for.'''
+        return self._filename
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def needs_compaction(self):
+        return (
+            not self._compacting and
+            self._records >= self._compact_records)
+
+    def replay(self, store):
+        '''Applies the journalled changes to the tags read from the tag
+        file, returning how many records were applied.'''
+        snapshot = _identity(self._filename)
+        replayed = 0
+
+        compacting = _compacting_filename(self._filename)
+        base, records = _read_journal(compacting)
+        interrupted = False
+        if records is not None:
+            if base == snapshot:
+                replayed += _apply_records(store, records)
+                interrupted = True
+            else:
+                # Compacted into the snapshot before it was removed
+                os.remove(compacting)
+
+        filename = journal_filename(self._filename)
+        base, records = _read_journal(filename)
+        if records is not None:
+            if base == snapshot or base == _AFTER_COMPACTING:
+                replayed += _apply_records(store, records)
+                if base == _AFTER_COMPACTING and not interrupted:
+                    self._rebase()
+            else:
+                stale = filename + '.stale'
+                print('Tag journal does not match {}, moved to {}'.format(
+                    self._filename, stale))
+                os.replace(filename, stale)
+
+        if interrupted:
+            # Carry on from one journal again
+            self._join()
+        self._records = replayed
+        return replayed
+
+    def _open(self, base=None):
+        filename = journal_filename(self._filename)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as journal_file:
+                journal_file.seek(0, os.SEEK_END)
+                torn = journal_file.tell() > 0
+                if torn:
+                    journal_file.seek(-1, os.SEEK_END)
+                    torn = journal_file.read(1) != b'\n'
+            self._journal_file = open(filename, 'a')
+            if torn:
+                # End a record cut short by a crash, so it stands alone
+                self._journal_file.write('\n')
+        else:
+            self._journal_file = open(filename, 'w')
+            if base is None:
+                base = _identity(self._filename)
+            self._write({'base': base})
+
+    def _write(self, record):
+        self._journal_file.write(_line(record))
+        # Flushed so that the record survives the program crashing
+        self._journal_file.flush()
+
+    def record(self, record):
+        '''Appends a record.'''
+        if self._journal_file is None:
+            self._open()
+        self._write(record)
+        self._records += 1
+
+    def created(self, row, tags):
+        '''Records tags inserted from a row on.'''
+        self.record({
+            'op': 'create', 'row': row,
+            'tags': [_tag_fields(tag) for tag in tags]})
+
+    def changed(self, row, key, value, old):
+        '''Records one field of a tag being set.'''
+        self.record({
+            'op': 'set', 'row': row, 'key': key,
+            'value': _json_value(value), 'old': _json_value(old)})
+
+    def deleted(self, row, tags):
+        '''Records tags removed from a row on, before they are removed.'''
+        self.record({
+            'op': 'delete', 'row': row,
+            'tags': [_tag_fields(tag) for tag in tags]})
+
+    def close(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    def start_compaction(self):
+        '''Moves the journal aside to be compacted and starts a new one.
+        Returns the generation to pass to compact.'''
+        self.close()
+        with self._lock:
+            os.replace(
+                journal_filename(self._filename),
+                _compacting_filename(self._filename))
+        self._compacting = True
+        self._compacted_records = self._records
+        self._records = 0
+        self._open(base=_AFTER_COMPACTING)
+        return self._generation
+
+    def compact(self, store, generation):
+        '''Writes the tags as they were when compaction started over the
+        tag file and removes the journal moved aside. Returns False if the
+        file has been saved since. Safe to call from another thread.'''
+        with self._lock:
+            if generation != self._generation:
+                return False
+            temporary = self._filename + '.tmp'
+            # In row order, which is the order the records refer to, and
+            # with the identifiers as they are, which they name as parents
+            write_tags(temporary, store, sort=False, exact=True)
+            os.replace(temporary, self._filename)
+            os.remove(_compacting_filename(self._filename))
+        return True
+
+    def compaction_finished(self, compacted):
+        '''Called back on the journal's own thread once compact returns.
+        If the compaction failed the two journals are joined again.'''
+        self._compacting = False
+        if compacted:
+            self._rebase()
+            return
+        if not os.path.exists(_compacting_filename(self._filename)):
+            return
+        self._join()
+        self._records += self._compacted_records
+
+    def _rebase(self):
+        '''Rewrites the journal started while the last one was compacted
+        to apply to the compacted tag file, so that it is still replayed
+        once it is moved aside to be compacted in turn. It only holds the
+        records made while compacting.'''
+        filename = journal_filename(self._filename)
+        base, records = _read_journal(filename)
+        self.close()
+        temporary = filename + '.tmp'
+        with open(temporary, 'w') as journal_file:
+            journal_file.write(_line({'base': _identity(self._filename)}))
+            for record in records or ():
+                journal_file.write(_line(record))
+        os.replace(temporary, filename)
+
+    def _join(self):
+        '''Appends the records of the journal to the one moved aside for
+        compaction, and makes that the journal again.'''
+        compacting = _compacting_filename(self._filename)
+        base, records = _read_journal(journal_filename(self._filename))
+        self.close()
+        with open(compacting, 'a') as journal_file:
+            for record in records or ():
+                journal_file.write(_line(record))
+        os.replace(compacting, journal_filename(self._filename))
+
+    def save(self, store):
+        '''Writes the tags over the tag file, in row order, and forgets
+        every record. A compaction that is running finishes first, and one
+        yet to write finds the file saved since and leaves it be.'''
+        self.close()
+        with self._lock:
+            self._generation += 1
+            temporary = self._filename + '.tmp'
+            # As for compact, so that the records that follow apply
+            write_tags(temporary, store, sort=False, exact=True)
+            os.replace(temporary, self._filename)
+            for filename in (journal_filename(self._filename),
+                             _compacting_filename(self._filename)):
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+        self._records = 0
+        self._compacting = False
@@ -0,0 +1,36 @@
+from PyQt5 import QtCore
+
+__all__ = ['CompactionTask']
+
+
+class CompactionSignals(QtCore.QObject):
+    '''The signals of a CompactionTask.'''
+
+    # True if the tag file was rewritten
+    finished = QtCore.pyqtSignal(bool)
+
+
+class CompactionTask(QtCore.QRunnable):
+    '''Writes a copy of the tags over their tag file on a QThreadPool
+    thread, folding in a TagJournal that has been moved aside with
+    start_compaction.
+
+    Like SearchTask, the task is not deleted by the pool; keep a reference
+    until finished is emitted, and then pass the result to the journal's
+    compaction_finished.'''
+
+    def __init__(self, journal, tags, generation):
+        super(CompactionTask, self).__init__()
+        self.setAutoDelete(False)
+        self.signals = CompactionSignals()
+        self.journal = journal
+        self._tags = tags
+        self._generation = generation
+
+    def run(self):
+        compacted = False
+        try:
+            compacted = self.journal.compact(self._tags, self._generation)
+        except OSError as err:
+            print('Tag journal compaction failed: {}'.format(err))
+        self.signals.finished.emit(compacted)
@@ -1,3 +1,5 @@
+import mmap
+import os
 import sys
 
 from PyQt5 import QtWidgets, QtGui, QtCore
@@ -8,10 +10,28 @@ from .ui_mainwindow import Ui_MainWindow
 from .ui_tagdialog import Ui_Tag
 
 from .hexes import MainHexEdit, SlaveHexEdit
-from .tags import TagTypes, TagRoles, Tag, TagModel
+from .utilities import create_action
+from .arrays import resolve_arrays
+from .decoding import TagDecoder, decode_value, map_file
+from .highlights import HighlightManager
+from .journaltask import CompactionTask
+from .offsets import OffsetGraph
+from .overview import OverviewStrip, StatisticsTask
+from .profiling import traced
+from .relative import rank_bases, relative_bases
+from .search import SearchResults, parse_pattern
+from .searchtask import PointerIndexTask, SearchTask
+from .tags import TagTypes, TagRoles, Tag
+from .tagmodel import TagModel
+from .tagproxy import TagProxyModel
+from .tagtree import TagTreeModel
 
 # TODO: Indicate on hex_2 when offset selected on hex_1
 
+# Appended to a file's name for the tag file it is journalled to when no
+# other tag file is loaded
+AUTOSAVE_SUFFIX = '.tags.yaml'
+
 TAG_LABEL_ORDER = {
     0: ('Name', 'name'),
     1: ('Start', 'start'),
@@ -19,6 +39,9 @@ TAG_LABEL_ORDER = {
     3: ('Type', 'type'),
     4: ('Role', 'role'),
     5: ('Comment', 'comment'),
+    6: ('ID', 'identifier'),
+    7: ('Parent', 'parent'),
+    8: ('Value', 'value'),
 }
 
 TYPECOLOURS = {
@@ -62,6 +85,15 @@ ROLECOLOURS = {
 __all__ = ['MainWindow']
 
 
+def _filter_offset(text):
+    '''An offset typed into a tag filter, decimal or hexadecimal, or None
+    if there is none yet.'''
+    try:
+        return int(text, 0)
+    except ValueError:
+        return None
+
+
 class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
     def __init__(self, parent=None, filename=None, tagfile=None):
@@ -74,6 +106,8 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.frame_1.setLayout(layout_1)
         self.hex_1 = MainHexEdit(parent=self.frame_1)
         layout_1.addWidget(self.hex_1)
+        self.overview = OverviewStrip(parent=self.frame_1)
+        layout_1.addWidget(self.overview)
 
         # Create a layout and hexedit widget
         layout_2 = QtWidgets.QHBoxLayout()
@@ -81,7 +115,9 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.hex_2 = SlaveHexEdit(
             parent=self.frame_2,
             on_find=self.find_offset_cb,
-            on_find_again=self.find_offset_again_cb)
+            on_find_again=self.find_offset_again_cb,
+            on_find_pattern=self.find_pattern_cb,
+            on_cancel_search=self.cancel_search)
         layout_2.addWidget(self.hex_2)
 
         # Connect signals to slots
@@ -89,6 +125,15 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.hex_1.absoluteOffset.connect(self.on_absolute_offset)
         self.hex_1.relativeOffset.connect(self.on_relative_offset)
 
+        self._highlights = HighlightManager(self.hex_1, ROLECOLOURS)
+        self.hex_1.verticalScrollBarValueChanged.connect(
+            self._highlights.sync)
+        self.hex_1.positionChanged.connect(self._highlights.sync)
+
+        self.hex_1.verticalScrollBarValueChanged.connect(self.update_overview)
+        self.hex_1.positionChanged.connect(self.update_overview)
+        self.overview.offsetClicked.connect(self.hex_1.setCursorPos)
+
         self.hex_1.show_offset.connect(self.hex_2.setCursorPos)
         self.hex_1.positionChanged.connect(self.hex_1_position_changed)
         self.hex_1.selectionChanged.connect(self.hex_1_selection_changed)
@@ -124,14 +169,72 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             label_order=TAG_LABEL_ORDER)
         # self._tag_model.entrySelected.connect(self.tag_selected)
         self._tag_model.dataChanged.connect(self.tag_edited)
-
-        self.tagTableView.setModel(self._tag_model)
+        self._tag_model.compactionDue.connect(self.start_compaction)
+
+        # Sorted and filtered through an index of the tags, only built once
+        # a header is clicked or a filter typed
+        self._tag_proxy = TagProxyModel(self._tag_model, parent=self)
+        self.tagTableView.setModel(self._tag_proxy)
+        self.tagTableView.horizontalHeader().setSortIndicator(
+            -1, QtCore.Qt.AscendingOrder)
+        self.tagTableView.setSortingEnabled(True)
+        # Rows all the same height and columns sized once, up front, so
+        # that neither loading nor scrolling a large table measures rows
+        self.tagTableView.setWordWrap(False)
+        self.tagTableView.verticalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.Fixed)
         self.tagTableView.resizeColumnsToContents()
+        offset_width = self.tagTableView.fontMetrics().horizontalAdvance(
+            ' 0x00000000 ')
+        for section, (label, key) in TAG_LABEL_ORDER.items():
+            if key in ('start', 'end'):
+                self.tagTableView.setColumnWidth(section, max(
+                    offset_width, self.tagTableView.columnWidth(section)))
         self.tagTableView.setSelectionMode(
             QtWidgets.QTableView.SingleSelection)
         self.tagTableView.setSelectionBehavior(
             QtWidgets.QTableView.SelectRows)
 
+        self._jumpToTarget = create_action(
+            parent=self.tagTableView,
+            name='contextJumpToTarget',
+            text='Jump to target',
+            triggered=self.jump_to_target)
+        self._rankBases = create_action(
+            parent=self.tagTableView,
+            name='contextRankBases',
+            text='Rank relative bases ...',
+            triggered=self.rank_relative_bases)
+        self.tagTableView.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+
+        self.tagTypeFilterComboBox.addItem('Any type')
+        for tag_type in TagTypes:
+            self.tagTypeFilterComboBox.addItem(tag_type.name)
+        self.tagRoleFilterComboBox.addItem('Any role')
+        for tag_role in TagRoles:
+            self.tagRoleFilterComboBox.addItem(tag_role.name)
+        self.tagFilterLineEdit.textChanged.connect(self.tag_filter_changed)
+        self.tagTypeFilterComboBox.currentIndexChanged.connect(
+            self.tag_filter_changed)
+        self.tagRoleFilterComboBox.currentIndexChanged.connect(
+            self.tag_filter_changed)
+        self.tagStartFilterLineEdit.textChanged.connect(
+            self.tag_filter_changed)
+        self.tagEndFilterLineEdit.textChanged.connect(
+            self.tag_filter_changed)
+
+        # The tree is only given its model once it is first shown, so that
+        # the hierarchy is not built for nothing
+        self._tag_tree_model = TagTreeModel(self._tag_model, parent=self)
+        self.tagTabWidget.currentChanged.connect(self.tag_tab_changed)
+
+        # Search progress, shown while a search runs
+        self._search_progress = QtWidgets.QProgressBar(self.statusbar)
+        self._search_progress.setRange(0, 1000)
+        self._search_progress.setMaximumWidth(200)
+        self._search_progress.hide()
+        self.statusbar.addPermanentWidget(self._search_progress)
+
         self._tag_selection = self.tagTableView.selectionModel()
         self._tag_selection.selectionChanged.connect(
             self.tag_model_selection_changed)
@@ -142,23 +245,43 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.programmatic_change = False
         self._hexeditdata = None
         self._hexeditdatareader = None
+        self._filename = None
+        # The loaded file, mapped for as long as it is loaded
+        self._data = b''
+        self._pointer_index = None
+        self._pointer_index_task = None
+        self._search = None
+        self._search_task = None
+        # Tasks are kept until they finish, even once cancelled
+        self._tasks = set()
+        self._show_next_hit = False
+        self._statistics_task = None
+        self._compaction_task = None
+        self._offset_graph = OffsetGraph()
         # self._tags = []
 
+        # Tags first, so that the file's own autosaved tags are only
+        # loaded if no others are given
+        if tagfile is not None:
+            if tagfile.endswith('.tagdb'):
+                self.open_tag_database(tagfile)
+            else:
+                self.load_tags(tagfile)
+
         if filename is not None:
             self.load_file(filename)
 
-        if tagfile is not None:
-            self.load_tags(tagfile)
-
     def tag_edited(self, top_left, bottom_right):
         if not self.programmatic_change:
             if (top_left.row() != bottom_right.row()) or (top_left.column() != bottom_right.column()):
-                raise Exception('Rows and columns differ!')
+                # A range is the model refreshing itself, not an edit
+                return
             else:
                 row = top_left.row()
                 column = top_left.column()
 
                 print('Tag {} edited on row {}'.format(TAG_LABEL_ORDER[column][0], row))
+                self.update_value(row, TAG_LABEL_ORDER[column][1])
 
     # def tag_model_current_changed(self, current, previous):
     #     '''Called on _tag_selection currentChanged signal'''
@@ -172,33 +295,79 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         if not self.programmatic_change:
             # Hopefully not more than one.
             for sel in selected.indexes():
-                current_tag = self._tag_model.tags[sel.row()]
+                current_tag = self._tag_model.tags[
+                    self._tag_proxy.source_row(sel.row())]
                 if self._hexeditdata is not None:
                     self.hex_1.setSelection(current_tag.start, current_tag.end)
 
+    def tag_filter_changed(self, *args):
+        '''Shows the tags matching the filters above the tag table.'''
+        types = roles = ()
+        if self.tagTypeFilterComboBox.currentIndex() > 0:
+            types = (TagTypes[self.tagTypeFilterComboBox.currentText()],)
+        if self.tagRoleFilterComboBox.currentIndex() > 0:
+            roles = (TagRoles[self.tagRoleFilterComboBox.currentText()],)
+        self._tag_proxy.set_filter(
+            text=self.tagFilterLineEdit.text(),
+            types=types,
+            roles=roles,
+            start=_filter_offset(self.tagStartFilterLineEdit.text()),
+            end=_filter_offset(self.tagEndFilterLineEdit.text()))
+
+    def tag_tab_changed(self, index):
+        if self.tagTabWidget.widget(index) is not self.tagTreeTab:
+            return
+        if self.tagTreeView.model() is None:
+            self.tagTreeView.setModel(self._tag_tree_model)
+            self.tagTreeView.selectionModel().selectionChanged.connect(
+                self.tag_tree_selection_changed)
+
+    def tag_tree_selection_changed(self, selected, deselected):
+        '''Called on the tag tree's selectionChanged signal'''
+        for sel in selected.indexes():
+            current_tag = self._tag_model.tags[
+                self._tag_tree_model.tag_row(sel)]
+            if self._hexeditdata is not None:
+                self.hex_1.setSelection(current_tag.start, current_tag.end)
+            break
+
+    def enclosing_tag_identifier(self, start, end):
+        '''The identifier of the smallest tag holding all of [start, end],
+        or 0.'''
+        best = None
+        for row in self._tag_model.tag_rows_at(start, end):
+            tag = self._tag_model.tags[row]
+            if tag.start <= start and end <= tag.end and (
+                    best is None or tag.end - tag.start <= best[0]):
+                best = (tag.end - tag.start, tag.identifier)
+        return best[1] if best is not None else 0
+
+    @traced()
     def hex_1_position_changed(self, offset):
         # TODO: Can we expose this through the hexedit widget?
-        found = False
-        row = 0
-        for tag in self._tag_model.tags:
-            if offset in range(tag.start, tag.end + 1):
-                found = True
-                self.programmatic_change = True
-                # self._tag_selection.setCurrentIndex(
-                #     self._tag_model.index(row, 0),
-                #     QtCore.QItemSelectionModel.ClearAndSelect |
-                #     QtCore.QItemSelectionModel.Rows)
-                self._tag_selection.select(
-                    self._tag_model.index(row, 0),
-                    QtCore.QItemSelectionModel.Clear |
-                    QtCore.QItemSelectionModel.Current |
-                    QtCore.QItemSelectionModel.Select |
-                    QtCore.QItemSelectionModel.Rows)
-                self.programmatic_change = False
-                self.tagTableView.scrollTo(self._tag_model.index(row, 0))
-            row += 1
+        rows = self._tag_model.tag_rows_at(offset)
+        if rows and self._tag_model.is_database:
+            # Rows not fetched yet are fetched to be selected
+            self._tag_model.tags.fetch_rows(rows[-1] + 1)
+        # Those filtered out of the table are not selected
+        rows = [
+            row for row in map(self._tag_proxy.proxy_row, rows) if row >= 0]
+        for row in rows:
+            self.programmatic_change = True
+            # self._tag_selection.setCurrentIndex(
+            #     self._tag_proxy.index(row, 0),
+            #     QtCore.QItemSelectionModel.ClearAndSelect |
+            #     QtCore.QItemSelectionModel.Rows)
+            self._tag_selection.select(
+                self._tag_proxy.index(row, 0),
+                QtCore.QItemSelectionModel.Clear |
+                QtCore.QItemSelectionModel.Current |
+                QtCore.QItemSelectionModel.Select |
+                QtCore.QItemSelectionModel.Rows)
+            self.programmatic_change = False
+            self.tagTableView.scrollTo(self._tag_proxy.index(row, 0))
 
-        if not found:
+        if not rows:
             # Clear selection
             self.programmatic_change = True
             self._tag_selection.clearSelection()
@@ -207,8 +376,18 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def hex_1_selection_changed(self, length):
         pass
 
+    @traced()
     def load_file(self, filename):
         '''Load data from file and put it in the hex editors.'''
+        self.cancel_search()
+        if self._pointer_index_task is not None:
+            self._pointer_index_task.cancel()
+            self._pointer_index_task = None
+        self._filename = filename
+        self.close_data()
+        self._data = map_file(filename)
+        self._offset_graph = OffsetGraph()
+        self._search = None
         self._hexeditdata = QHexEditData.fromFile(filename)
         self._hexeditdatareader = QHexEditDataReader(
             self._hexeditdata,
@@ -217,28 +396,233 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.hex_1.set_data_reader(self._hexeditdatareader)
         self.hex_2.setData(self._hexeditdata)
         self.hex_2.set_data_reader(self._hexeditdatareader)
-
+        self._highlights.refresh()
+
+        # Without a tag file, tags are journalled next to the file, and
+        # those left from before are picked up again
+        if self._tag_model.journal is None and \
+                not self._tag_model.is_database and \
+                not len(self._tag_model.tags):
+            self.load_tags(filename + AUTOSAVE_SUFFIX)
+
+        self.update_values()
+        self.start_statistics()
+
+    def close_data(self):
+        '''Unmap the loaded file and its pointer index.'''
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b''
+        if self._pointer_index is not None:
+            self._pointer_index.close()
+            self._pointer_index = None
+
+    def start_statistics(self):
+        '''Work out the byte statistics of the loaded file in the
+        background, filling in the overview strip as they come.'''
+        if self._statistics_task is not None:
+            self._statistics_task.cancel()
+        task = StatisticsTask(self._filename)
+        task.signals.progress.connect(
+            lambda statistics, task=task:
+                self._statistics_progressed(task, statistics))
+        task.signals.finished.connect(
+            lambda complete, task=task:
+                self._statistics_finished(task, complete))
+        self._statistics_task = task
+        self._tasks.add(task)
+        self.overview.set_statistics(None)
+        QtCore.QThreadPool.globalInstance().start(task)
+
+    def _statistics_progressed(self, task, statistics):
+        if task is self._statistics_task:
+            self.overview.set_statistics(statistics)
+            self.update_overview()
+
+    def _statistics_finished(self, task, complete):
+        self._tasks.discard(task)
+        if task is self._statistics_task:
+            self._statistics_task = None
+
+    def start_compaction(self):
+        '''Fold the tag journal into the tag file in the background.'''
+        journal = self._tag_model.journal
+        if journal is None or self._compaction_task is not None:
+            return
+        generation = journal.start_compaction()
+        task = CompactionTask(
+            journal, self._tag_model.tags.copy(), generation)
+        task.signals.finished.connect(
+            lambda compacted, task=task:
+                self._compaction_finished(task, compacted))
+        self._compaction_task = task
+        self._tasks.add(task)
+        QtCore.QThreadPool.globalInstance().start(task)
+
+    def _compaction_finished(self, task, compacted):
+        self._tasks.discard(task)
+        task.journal.compaction_finished(compacted)
+        if task is self._compaction_task:
+            self._compaction_task = None
+
+    def update_overview(self, *args):
+        '''Outline the part of the file in view on the overview strip.'''
+        if self._hexeditdata is not None:
+            self.overview.set_view(
+                self.hex_1.visibleStartOffset(),
+                self.hex_1.visibleEndOffset())
+
+    @traced()
     def load_tags(self, tagfile):
 
         self.programmatic_change = True
-        self._tag_model.read_from_file(tagfile)
+        replayed = self._tag_model.read_from_file(tagfile, journal=True)
         self.programmatic_change = False
+        if replayed:
+            print('Replayed {} journalled changes to {}'.format(
+                replayed, tagfile))
 
-        self.tagTableView.resizeColumnsToContents()
+        self.tags_replaced()
+
+    def open_tag_database(self, filename):
+        '''Show the tags of a tag database, reading them as needed.'''
+        self.programmatic_change = True
+        self._tag_model.open_database(filename)
+        self.programmatic_change = False
 
-        for tag in self._tag_model.tags:
+        self.tags_replaced()
 
-            # Colour it
-            self.hex_1.highlightBackground(
-                tag.start,
-                tag.end,
-                ROLECOLOURS[tag.role])
+    def import_tags(self, tagfile):
+        '''Add the tags from a YAML file to those shown.'''
+        self.programmatic_change = True
+        self._tag_model.import_file(tagfile)
+        self.programmatic_change = False
+        self.tags_replaced()
+
+    def tags_replaced(self):
+        '''Bring the highlights, the count combobox and the values up to
+        date with a new set of tags.'''
+        # Tags read from a database are not sorted or filtered
+        self.tagFilterWidget.setEnabled(not self._tag_model.is_database)
+
+        # Colour and comment them
+        if self._tag_model.is_database:
+            self._highlights.set_query(
+                self._tag_model.tags.database.overlapping_tags)
+        else:
+            self._highlights.set_tags(self._tag_model.tags)
+
+        self._tag_contents.countComboBox.clear()
+        self._tag_contents.sizeComboBox.clear()
+        # Arrays need not have a Size tag
+        self._tag_contents.sizeComboBox.addItem('')
+        if self._tag_model.is_database:
+            database = self._tag_model.tags.database
+            for name in database.names_with_role(TagRoles.Count):
+                self.add_count_tag(name)
+            for name in database.names_with_role(TagRoles.Size):
+                self.add_size_tag(name)
+        else:
+            for tag in self._tag_model.tags:
+                if tag.role == TagRoles.Count:
+                    self.add_count_tag(tag.name)
+                elif tag.role == TagRoles.Size:
+                    self.add_size_tag(tag.name)
+
+        self.update_values()
+
+    def add_count_tag(self, name):
+        '''Add a Count tag to the tag dialog's count combobox.'''
+        self._tag_contents.countComboBox.addItem('')
+        self._tag_contents.countComboBox.setItemText(
+            self._tag_contents.countComboBox.count() - 1,
+            QtCore.QCoreApplication.translate(
+                self.objectName(), name))
+
+    def add_size_tag(self, name):
+        '''Add a Size tag to the tag dialog's size combobox.'''
+        self._tag_contents.sizeComboBox.addItem('')
+        self._tag_contents.sizeComboBox.setItemText(
+            self._tag_contents.sizeComboBox.count() - 1,
+            QtCore.QCoreApplication.translate(
+                self.objectName(), name))
+
+    @traced()
+    def update_values(self):
+        '''Decode the value of every tag from the loaded file.'''
+        if self._filename is None or not len(self._tag_model.tags):
+            return
+
+        if self._tag_model.is_database:
+            # Too many to decode at once, so rows are decoded as shown
+            self.programmatic_change = True
+            self._tag_model.set_value_decoder(self.decode_tag)
+            self.programmatic_change = False
+            return
 
-            # Comment it
-            self.hex_1.commentRange(
-                tag.start,
-                tag.end,
-                tag.name)
+        decoder = TagDecoder(self._tag_model.tags)
+        values = decoder.decode(self._data)
+        # Arrays are summarised, their elements are left undecoded
+        for row, view in resolve_arrays(
+                self._tag_model.tags, self._data).items():
+            values[row] = str(view)
+
+        self.programmatic_change = True
+        self._tag_model.set_values(values)
+        self.programmatic_change = False
+
+    def update_value(self, row, key=None):
+        '''Decode the value of one tag again once it has been created, or
+        once the field key of it has been edited. Arrays are resolved again
+        too if the tag is one, is the Count or Size of one, or may have
+        stopped being either.'''
+        if self._filename is None or self._tag_model.is_database:
+            # Rows are decoded as shown, and edits drop the old value
+            return
+        if key not in (None, 'name', 'start', 'end', 'type', 'role',
+                       'of', 'count', 'size'):
+            return
+
+        tags = self._tag_model.tags
+        tag = tags[row]
+        self.programmatic_change = True
+        self._tag_model.set_value(
+            row, decode_value(self._data, tag.start, tag.end, tag.type))
+        if tag.type == TagTypes.Array or \
+                tag.role in (TagRoles.Count, TagRoles.Size) or \
+                key in ('name', 'type', 'role'):
+            views = resolve_arrays(tags, self._data)
+            for array_row in tags.rows_with_type(TagTypes.Array):
+                view = views.get(array_row)
+                self._tag_model.set_value(
+                    array_row, None if view is None else str(view))
+        self.programmatic_change = False
+
+    def decode_tag(self, tag):
+        '''Decode the value of one tag from the loaded file. Arrays are
+        left undecoded.'''
+        return decode_value(self._data, tag.start, tag.end, tag.type)
+
+    def offset_edges(self):
+        '''Resolve every Offset tag against the loaded file, returning
+        (source row, target offset, target rows) tuples.'''
+        if self._filename is None:
+            return []
+        return self._offset_graph.resolve(
+            self._tag_model.tags, self._data, self._tag_model.interval_index)
+
+    def jump_to_target(self):
+        '''Move the cursor to where the selected Offset tag points.'''
+        if self._filename is None:
+            return
+        for sel in self._tag_selection.selectedRows():
+            tag = self._tag_model.tags[self._tag_proxy.source_row(sel.row())]
+            if tag.role == TagRoles.Offset:
+                target = self._offset_graph.target(tag, self._data)
+                if target is not None:
+                    self.hex_1.setCursorPos(target)
+                    self.hex_2.setCursorPos(target)
+                break
 
     def create_tag(self, **kwargs):
         pass
@@ -279,6 +663,27 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         if filename[0] != '':
             self._tag_model.write_to_file(filename[0])
 
+    @QtCore.pyqtSlot()
+    def on_actionOpenTagDatabase_triggered(self):
+        filename = QtWidgets.QFileDialog.getSaveFileName(
+            parent=self,
+            caption='Open Tag Database',
+            directory='.',
+            filter='Tag databases (*.tagdb);;All files (*)',
+            options=QtWidgets.QFileDialog.DontConfirmOverwrite)
+        if filename[0] != '':
+            self.open_tag_database(filename[0])
+
+    @QtCore.pyqtSlot()
+    def on_actionImportTags_triggered(self):
+        filename = QtWidgets.QFileDialog.getOpenFileName(
+            parent=self,
+            caption='Import Tags',
+            directory='.',
+            filter='YAML files (*.yaml);;All files (*)')
+        if filename[0] != '':
+            self.import_tags(filename[0])
+
     @QtCore.pyqtSlot('qint64', 'qint64')
     def on_create_tag(self, start, end):
         if self._hexeditdatareader is not None:
@@ -287,6 +692,9 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                 '0x{:08x}'.format(start))
             self._tag_contents.extents_end_lineedit.setText(
                 '0x{:08x}'.format(end))
+            parent = self.enclosing_tag_identifier(start, end)
+            self._tag_contents.parent_lineedit.setText(
+                str(parent) if parent else '')
             result = self._tag_dialog.exec_()
 
             if result:
@@ -297,7 +705,14 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                     type=self._tag_contents.typeComboBox.currentText(),
                     role=self._tag_contents.role_combobox.currentText(),
                     comment=self._tag_contents.comment_textedit.toPlainText(),
+                    parent=self._tag_contents.parent_lineedit.text(),
                 )
+                if new_tag.type == TagTypes.Array:
+                    new_tag.of = self._tag_contents.of_combobox.currentText()
+                    new_tag.count = \
+                        self._tag_contents.countComboBox.currentText()
+                    new_tag.size = \
+                        self._tag_contents.sizeComboBox.currentText()
 
                 # Store it
                 # self._tags.append(new_tag)
@@ -306,24 +721,14 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                 self.programmatic_change = False
 
                 if new_tag.role == TagRoles.Count:
-                    # Add it to the count combobox
-                    self._tag_contents.countComboBox.addItem('')
-                    self._tag_contents.countComboBox.setItemText(
-                        self._tag_contents.countComboBox.count() - 1,
-                        QtCore.QCoreApplication.translate(
-                            self.objectName(), new_tag.name))
-
-                # Colour it
-                self.hex_1.highlightBackground(
-                    new_tag.start,
-                    new_tag.end,
-                    ROLECOLOURS[new_tag.role])
-
-                # Comment it
-                self.hex_1.commentRange(
-                    new_tag.start,
-                    new_tag.end,
-                    new_tag.name)
+                    self.add_count_tag(new_tag.name)
+                elif new_tag.role == TagRoles.Size:
+                    self.add_size_tag(new_tag.name)
+
+                # Colour and comment it
+                self._highlights.add_tag(new_tag)
+
+                self.update_value(len(self._tag_model.tags) - 1)
 
     @QtCore.pyqtSlot()
     def on_actionQuit_triggered(self):
@@ -352,11 +757,15 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             self._tag_contents.of_label.setEnabled(True)
             self._tag_contents.countComboBox.setEnabled(True)
             self._tag_contents.count_label.setEnabled(True)
+            self._tag_contents.sizeComboBox.setEnabled(True)
+            self._tag_contents.size_label.setEnabled(True)
         else:
             self._tag_contents.of_combobox.setEnabled(False)
             self._tag_contents.of_label.setEnabled(False)
             self._tag_contents.countComboBox.setEnabled(False)
             self._tag_contents.count_label.setEnabled(False)
+            self._tag_contents.sizeComboBox.setEnabled(False)
+            self._tag_contents.size_label.setEnabled(False)
 
     @QtCore.pyqtSlot('qint64', 'qint64', 'qint64')
     def on_absolute_offset(self, start, length, offset):
@@ -366,38 +775,230 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
     @QtCore.pyqtSlot('qint64', 'qint64', 'qint64')
     def on_relative_offset(self, start, length, offset):
-        print('Not yet implemented')
+        '''Ask which base the selected relative offset in hex_1 is relative
+        to, and set the cursor position in hex_2 to the target.'''
+        if self._hexeditdatareader is None:
+            return
+        bases = relative_bases(
+            self._tag_model.tags,
+            start,
+            start + length,
+            cursor=self.hex_2.cursorPos(),
+            offset_targets=self.offset_targets(),
+            index=self._tag_model.interval_index)
+        self.choose_relative_target(
+            [(label, base + offset) for label, base in bases],
+            '{} relative to:'.format(offset))
+
+    def offset_targets(self):
+        '''(name, target) pairs for the resolved Offset tags.'''
+        tags = self._tag_model.tags
+        return [
+            (tags[row].name, target)
+            for row, target, target_rows in self.offset_edges()]
+
+    def choose_relative_target(self, targets, prompt):
+        '''Offer (label, target) pairs and set the cursor position in hex_2
+        to the chosen target.'''
+        size = os.path.getsize(self._filename)
+        items = []
+        for label, target in targets:
+            if 0 <= target < size:
+                items.append('{}: 0x{:08x}'.format(label, target))
+            else:
+                items.append('{}: {} (out of bounds)'.format(
+                    label, hex(target)))
+        item, accepted = QtWidgets.QInputDialog.getItem(
+            self, 'Relative offset', prompt, items, 0, False)
+        if accepted:
+            label, target = targets[items.index(item)]
+            if 0 <= target < size:
+                self.hex_2.setCursorPos(target)
+
+    def rank_relative_bases(self):
+        '''Rank the bases the selected tag could be relative to, over every
+        tag with the same name and type, then go to the target for the
+        chosen base.'''
+        if self._filename is None:
+            return
+        for sel in self._tag_selection.selectedRows():
+            row = self._tag_proxy.source_row(sel.row())
+            tags = self._tag_model.tags
+            tag = tags[row]
+            cursor = self.hex_2.cursorPos()
+            offset_targets = self.offset_targets()
+            ranking = rank_bases(
+                tags, row, self._data,
+                cursor=cursor,
+                offset_targets=offset_targets,
+                index=self._tag_model.interval_index)
+            value = TagDecoder([tag]).decode(self._data)[0]
+            if not ranking or value is None:
+                self.statusbar.showMessage(
+                    'Tag {} is not a number'.format(tag.name), 5000)
+                return
+
+            bases = dict(relative_bases(
+                tags, tag.start, tag.end,
+                cursor=cursor,
+                offset_targets=offset_targets,
+                index=self._tag_model.interval_index,
+                parent=tag.parent))
+            self.choose_relative_target(
+                [
+                    ('{} ({}/{} on a tag)'.format(label, aligned, count),
+                     bases[label] + value)
+                    for label, aligned, in_bounds, count in ranking
+                    if label in bases],
+                'Bases for {}, best first:'.format(tag.name))
+            break
 
     def allow_close(self):
         return True
 
+    def pointer_index(self):
+        '''The pointer index for the loaded file, or None until it has been
+        loaded or built in the background, which the first call starts.'''
+        if self._pointer_index is None and \
+                self._pointer_index_task is None and \
+                self._filename is not None:
+            task = PointerIndexTask(self._filename)
+            task.signals.finished.connect(
+                lambda index, task=task:
+                    self._pointer_index_finished(task, index))
+            self._pointer_index_task = task
+            self._tasks.add(task)
+            QtCore.QThreadPool.globalInstance().start(task)
+        return self._pointer_index
+
+    def _pointer_index_finished(self, task, index):
+        self._tasks.discard(task)
+        if task is self._pointer_index_task:
+            self._pointer_index = index
+        elif index is not None:
+            # For a file no longer loaded
+            index.close()
+
+    def start_search(self, pattern, alignment=1):
+        '''Search the loaded file for a byte pattern in the background,
+        showing the first hit as soon as it is found.'''
+        self.cancel_search()
+        self._search = SearchResults(pattern, alignment)
+        self._show_next_hit = True
+
+        task = SearchTask(self._filename, pattern, alignment)
+        task.signals.found.connect(
+            lambda hits, task=task: self._search_found(task, hits))
+        task.signals.progress.connect(
+            lambda searched, size, task=task:
+                self._search_progressed(task, searched, size))
+        task.signals.finished.connect(
+            lambda complete, task=task:
+                self._search_finished(task, complete))
+        self._search_task = task
+        self._tasks.add(task)
+
+        self._search_progress.setValue(0)
+        self._search_progress.show()
+        self.hex_2.set_searching(True)
+        self.statusbar.showMessage('Searching ...')
+        QtCore.QThreadPool.globalInstance().start(task)
+
+    def cancel_search(self):
+        '''Stop the running search, keeping the hits found so far.'''
+        if self._search_task is not None:
+            self._search_task.cancel()
+            self._search_task = None
+            self.statusbar.showMessage(
+                'Search cancelled after {} hits'.format(len(self._search)),
+                5000)
+        self._show_next_hit = False
+        self._search_progress.hide()
+        self.hex_2.set_searching(False)
+
+    def _search_found(self, task, hits):
+        if task is self._search_task:
+            self._search.add(hits)
+            if self._show_next_hit:
+                self.find_offset_again_cb()
+
+    def _search_progressed(self, task, searched, size):
+        if task is self._search_task:
+            self._search_progress.setValue(
+                searched * 1000 // size if size else 1000)
+
+    def _search_finished(self, task, complete):
+        self._tasks.discard(task)
+        if task is not self._search_task:
+            return
+        self._search_task = None
+        self._search_progress.hide()
+        self.hex_2.set_searching(False)
+        if not complete:
+            self.statusbar.showMessage('Search failed', 5000)
+            return
+        self._search.finish()
+        self.statusbar.showMessage(
+            'Found {} hits'.format(len(self._search)), 5000)
+        if self._show_next_hit:
+            self.find_offset_again_cb()
+
+    @traced()
     def find_offset_cb(self):
         if self._hexeditdatareader is not None:
             length = 4
-            current_pos = self.hex_2.cursorPos().to_bytes(
-                length,
-                sys.byteorder,
-                signed=False)
-            found_pos = self._hexeditdatareader.indexOf(current_pos, 0)
-            if found_pos > 0:
-                self._foundPos = found_pos
-                self.hex_1.show_search_result(found_pos, length)
+            target = self.hex_2.cursorPos()
+            if target >= 1 << (8 * length):
+                self.statusbar.showMessage(
+                    'Offset too large for {} bytes'.format(length), 5000)
+                return
+            pattern = target.to_bytes(length, sys.byteorder)
+            index = self.pointer_index()
+            hits = None
+            if index is not None:
+                # None for a target too common to be indexed
+                hits = index.sources(target, length, sys.byteorder)
+            if hits is not None:
+                self.cancel_search()
+                self._search = SearchResults.from_hits(pattern, hits)
+                self.find_offset_again_cb()
+            else:
+                self.start_search(pattern)
 
-    def find_offset_again_cb(self):
+    def find_pattern_cb(self):
         if self._hexeditdatareader is not None:
-            length = 4
-            current_pos = self.hex_2.cursorPos().to_bytes(
-                length,
-                sys.byteorder,
-                signed=False)
-            found_pos = self._hexeditdatareader.indexOf(
-                current_pos, self._foundPos)
-            if found_pos > 0:
-                self._foundPos = found_pos
-                self.hex_1.show_search_result(found_pos, length)
+            text, accepted = QtWidgets.QInputDialog.getText(
+                self,
+                'Find bytes',
+                'Hex bytes, or text in quotes:')
+            if not accepted:
+                return
+            try:
+                pattern = parse_pattern(text)
+            except ValueError as err:
+                self.statusbar.showMessage(str(err), 5000)
+                return
+            self.start_search(pattern)
+
+    def find_offset_again_cb(self):
+        '''Show the next cached hit, wrapping around once the search is
+        complete. If the search has not reached it yet, the next hit found
+        is shown instead.'''
+        if self._hexeditdatareader is not None and self._search is not None:
+            offset = self._search.next()
+            self._show_next_hit = offset is None and not self._search.complete
+            if offset is not None:
+                self.hex_1.show_search_result(
+                    offset, len(self._search.pattern))
 
     def closeEvent(self, event):
         if self.allow_close:
+            self.cancel_search()
+            if self._statistics_task is not None:
+                self._statistics_task.cancel()
+            if self._pointer_index_task is not None:
+                self._pointer_index_task.cancel()
+            self.close_data()
             event.accept()
         else:
             event.ignore()
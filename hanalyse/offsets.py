@@ -0,0 +1,99 @@
+'''Following Offset-role tags to the regions they point at.'''
+
+import sys
+
+from .decoding import TYPEFORMATS, decode_value
+from .intervals import IntervalIndex
+from .tagdb import DatabaseTags
+from .tags import TagRoles, TagStore
+
+__all__ = ['OffsetGraph']
+
+
+class OffsetGraph(object):
+    '''A directed graph from each Offset-role tag to the offset it points
+    at and the tags that cover that offset.
+
+    The decoded target of each source tag is memoised by tag identifier,
+    together with the start, end and type it was decoded from, so
+    resolving again only decodes the tags that were added or changed.
+    The graph is for one file's data; use a new graph for other data.'''
+
+    def __init__(self, byteorder=sys.byteorder):
+        self._byteorder = byteorder
+        self._targets = {}
+        self._edges = []
+        self._sources_by_target = {}
+
+    def target(self, tag, data):
+        '''Returns the offset an Offset-role tag points at, or None if it
+        is not numeric or points outside the data.'''
+        key = (tag.start, tag.end, tag.type)
+        try:
+            cached_key, target = self._targets[tag.identifier]
+            if cached_key == key:
+                return target
+        except KeyError:
+            pass
+
+        target = None
+        if tag.type in TYPEFORMATS:
+            value = decode_value(
+                data, tag.start, tag.end, tag.type, self._byteorder)
+            if value is not None and 0 <= value < len(data):
+                target = value
+        self._targets[tag.identifier] = (key, target)
+        return target
+
+    def resolve(self, tags, data, index=None):
+        '''Resolves every Offset-role tag in a sequence of tags, returning
+        the edges as (source row, target offset, target rows) tuples.
+
+        index is an IntervalIndex over the same tags, such as TagModel's;
+        one is built if it is not given.'''
+        if index is None:
+            index = IntervalIndex()
+            index.reset(
+                (tag.start for tag in tags), (tag.end for tag in tags))
+
+        if isinstance(tags, (TagStore, DatabaseTags)):
+            rows = tags.rows_with_role(TagRoles.Offset)
+        else:
+            rows = [
+                row for row, tag in enumerate(tags)
+                if tag.role == TagRoles.Offset]
+
+        live = set()
+        found = []
+        for row in rows:
+            tag = tags[row]
+            live.add(tag.identifier)
+            target = self.target(tag, data)
+            if target is not None:
+                found.append((row, target))
+
+        target_rows = index.overlapping_points(
+            target for row, target in found)
+        edges = []
+        sources_by_target = {}
+        for row, target in found:
+            edges.append((row, target, target_rows[target]))
+            sources_by_target.setdefault(target, []).append(row)
+
+        # Forget tags that have gone
+        for identifier in set(self._targets) - live:
+            del self._targets[identifier]
+
+        self._edges = edges
+        self._sources_by_target = sources_by_target
+        return edges
+
+    @property
+    def edges(self):
+        '''The edges found by the last resolve.'''
+        return self._edges
+
+    def sources(self, target):
+        '''The rows of the Offset tags found by the last resolve that point
+        at the given offset.'''
+        return self._sources_by_target.get(target, [])
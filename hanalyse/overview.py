@@ -0,0 +1,166 @@
+import threading
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from .bytestats import BLOCK_SIZE, compute_statistics
+
+__all__ = ['OverviewStrip', 'StatisticsTask']
+
+STRIP_WIDTH = 24
+
+ZERO_COLOUR = QtGui.QColor(48, 48, 48)
+TEXT_COLOUR = QtGui.QColor.fromHsv(120, 160, 220)
+VIEW_COLOUR = QtGui.QColor(255, 255, 255)
+
+
+class StatisticsSignals(QtCore.QObject):
+    '''The signals of a StatisticsTask.'''
+
+    # The ByteStatistics so far, after each chunk
+    progress = QtCore.pyqtSignal(object)
+    # True if every block was done
+    finished = QtCore.pyqtSignal(bool)
+
+
+class StatisticsTask(QtCore.QRunnable):
+    '''Computes the ByteStatistics of a file on a QThreadPool thread.
+
+    Like SearchTask, the task is not deleted by the pool; keep a reference
+    until finished is emitted.'''
+
+    def __init__(self, filename, block_size=BLOCK_SIZE):
+        super(StatisticsTask, self).__init__()
+        self.setAutoDelete(False)
+        self.signals = StatisticsSignals()
+        self._filename = filename
+        self._block_size = block_size
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        statistics = None
+        try:
+            for statistics in compute_statistics(
+                    self._filename,
+                    self._block_size,
+                    cancelled=self._cancelled):
+                self.signals.progress.emit(statistics)
+        except OSError as err:
+            print('Byte statistics failed: {}'.format(err))
+        self.signals.finished.emit(
+            statistics is not None and statistics.complete)
+
+
+class OverviewStrip(QtWidgets.QWidget):
+    '''A narrow strip beside a hex view showing the whole file top to
+    bottom, one line per run of blocks.
+
+    Mostly zero runs are dark, mostly printable runs are green and the
+    rest are coloured by their highest entropy, from blue for none to red
+    for eight bits per byte. The part of the file in view is outlined,
+    and clicking the strip emits the offset under the mouse.'''
+
+    offsetClicked = QtCore.pyqtSignal('qint64')
+
+    def __init__(self, parent=None):
+        super(OverviewStrip, self).__init__(parent)
+        self.setFixedWidth(STRIP_WIDTH)
+        self.setMouseTracking(True)
+        self._statistics = None
+        self._view = None
+        # The colour of each line, for the height and blocks done when they
+        # were worked out
+        self._lines = []
+        self._lines_done = 0
+
+    def set_statistics(self, statistics):
+        '''Shows a ByteStatistics, which may still be being added to.'''
+        if statistics is not self._statistics:
+            self._lines = []
+        self._statistics = statistics
+        self.update()
+
+    def set_view(self, start, end):
+        '''Outlines the offsets in view.'''
+        self._view = (start, end)
+        self.update()
+
+    def _offset_at(self, y):
+        size = self._statistics.size
+        return min(max(y, 0) * size // max(self.height(), 1), size - 1)
+
+    def _y_at(self, offset):
+        return offset * self.height() // max(self._statistics.size, 1)
+
+    def _colour(self, blocks):
+        statistics = self._statistics
+        zeros = min(statistics.zeros[block] for block in blocks)
+        if zeros > 0.9:
+            return ZERO_COLOUR
+        printable = min(statistics.printable[block] for block in blocks)
+        if printable > 0.9:
+            return TEXT_COLOUR
+        entropy = max(statistics.entropy[block] for block in blocks)
+        return QtGui.QColor.fromHsv(
+            int(240 * (1 - min(entropy, 8.0) / 8)), 200, 230)
+
+    def _line_colours(self):
+        '''The colour of each line, or None where no block is done yet.'''
+        statistics = self._statistics
+        height = self.height()
+        done = len(statistics.entropy)
+        if len(self._lines) != height:
+            self._lines = [None] * height
+            first = 0
+        elif done != self._lines_done:
+            # Only the lines from the first block added since are redone
+            first = self._y_at(self._lines_done * statistics.block_size)
+        else:
+            return self._lines
+
+        for y in range(first, height):
+            blocks = statistics.blocks_in(
+                self._offset_at(y), self._offset_at(y + 1) + 1)
+            self._lines[y] = self._colour(blocks) if len(blocks) else None
+        self._lines_done = done
+        return self._lines
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), self.palette().window())
+        if self._statistics is None or not self._statistics.size:
+            return
+
+        width = self.width()
+        for y, colour in enumerate(self._line_colours()):
+            if colour is not None:
+                painter.fillRect(0, y, width, 1, colour)
+
+        if self._view is not None:
+            top = self._y_at(self._view[0])
+            bottom = max(self._y_at(self._view[1]), top + 1)
+            painter.setPen(VIEW_COLOUR)
+            painter.drawRect(0, top, width - 1, bottom - top)
+
+    def mousePressEvent(self, event):
+        if self._statistics is not None and self._statistics.size:
+            self.offsetClicked.emit(self._offset_at(event.pos().y()))
+
+    def mouseMoveEvent(self, event):
+        statistics = self._statistics
+        if statistics is None or not statistics.size:
+            return
+        offset = self._offset_at(event.pos().y())
+        block = offset // statistics.block_size
+        if block < len(statistics.entropy):
+            QtWidgets.QToolTip.showText(
+                event.globalPos(),
+                '0x{:08x}\nEntropy {:.2f} bits/byte\n'
+                'Zeros {:.0%}, printable {:.0%}'.format(
+                    offset,
+                    statistics.entropy[block],
+                    statistics.zeros[block],
+                    statistics.printable[block]),
+                self)
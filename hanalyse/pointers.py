@@ -0,0 +1,477 @@
+'''An index of every value in a file that could be a pointer into it.
+
+For each integer width and byte order, every position (or optionally every
+aligned position) in the file is read as an unsigned integer, and those
+values that fall inside the file, other than 0, are kept as candidate
+targets. The (target, source offset) pairs are kept sorted in a file, so
+"what points here?" is a binary search over a memory map of it, and the
+index takes no more memory however large the file it is of.
+
+The file is read CHUNK bytes at a time, the pairs found in each chunk
+being sorted and written out as a run, and the runs are then merged
+MERGE_WAYS at a time until one is left, so building the index takes no
+more memory either. A target with more than MAX_SOURCES sources, such as
+a small number that is common in the file, is not indexed; sources
+returns None for it, and it is searched for instead.
+
+The index is saved next to the file it was built from and is only reused
+while that file's size and modification time match.'''
+
+from array import array
+import bisect
+from itertools import compress, islice, repeat
+import mmap
+import operator
+import os
+import re
+import struct
+import sys
+import tempfile
+
+__all__ = ['PointerIndex']
+
+MAGIC = b'HPTR'
+VERSION = 2
+
+# magic, version, aligned, little endian, table count, source size, source
+# mtime in ns; a multiple of 8 bytes long, as are the tables
+HEADER = struct.Struct('<4sHBBIxxxxQq')
+# width, little endian, pair count, count of targets too common to index
+TABLE_HEADER = struct.Struct('<BBxxxxxxQQ')
+
+TYPECODES = {2: 'H', 4: 'I', 8: 'Q'}
+
+# Bytes of the file read at a time, a multiple of every width
+CHUNK = 1 << 18
+# Runs merged at once
+MERGE_WAYS = 64
+# Pairs read from, or written to, a run at a time
+RUN_BLOCK = 1 << 12
+# Targets with more sources than this are not indexed
+MAX_SOURCES = 1 << 12
+
+# Maps each byte to whether it is non-zero
+_NON_ZERO = bytes([0]) + bytes([1]) * 255
+_CANDIDATES = re.compile(rb'\x01+')
+
+
+def index_filename(filename):
+    return filename + '.pointers'
+
+
+def _source_stat(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_run(run_file, position, count, shift):
+    '''Yields the pairs of a run, from a file of runs, RUN_BLOCK at a time,
+    each as the key target << shift | source, which orders as the pair
+    does.'''
+    end = position + 16 * count
+    while position < end:
+        length = min(16 * RUN_BLOCK, end - position)
+        run_file.seek(position)
+        block = array('Q')
+        block.frombytes(run_file.read(length))
+        position += length
+        yield list(map(
+            operator.or_,
+            map(operator.lshift, block[0::2], repeat(shift)),
+            block[1::2]))
+
+
+def _key_blocks(run_file, runs, shift):
+    '''Yields the keys of runs merged, a block at a time.
+
+    No key left to read from any run is below the least of the last keys
+    read from each, so every key read up to that one is taken from each
+    run and sorted together, which merges them.'''
+    readers = [_read_run(run_file, *run, shift) for run in runs]
+    buffers = [next(reader) for reader in readers]
+    positions = [0] * len(readers)
+    while readers:
+        bound = min(buffer[-1] for buffer in buffers)
+        block = []
+        for number, buffer in enumerate(buffers):
+            end = bisect.bisect_right(buffer, bound, positions[number])
+            block.extend(buffer[positions[number]:end])
+            positions[number] = end
+            if end == len(buffer):
+                buffers[number] = next(readers[number], None)
+                positions[number] = 0
+        block.sort()
+        yield block
+        live = [
+            number for number, buffer in enumerate(buffers)
+            if buffer is not None]
+        readers = [readers[number] for number in live]
+        buffers = [buffers[number] for number in live]
+        positions = [positions[number] for number in live]
+
+
+def _write_keys(keys, shift, output):
+    '''Writes keys out as alternate targets and sources.'''
+    pairs = array('Q', bytes(16 * len(keys)))
+    pairs[0::2] = array('Q', map(operator.rshift, keys, repeat(shift)))
+    mask = (1 << shift) - 1
+    pairs[1::2] = array('Q', map(operator.and_, keys, repeat(mask)))
+    output.write(pairs)
+
+
+def _merge(run_file, runs, shift):
+    '''Merges runs, given as (position, pair count), MERGE_WAYS at a time
+    into a new file of runs, until at most MERGE_WAYS are left. Returns
+    the file and the runs left.'''
+    while len(runs) > MERGE_WAYS:
+        merged_file = tempfile.TemporaryFile()
+        merged = []
+        for first in range(0, len(runs), MERGE_WAYS):
+            position = merged_file.tell()
+            count = 0
+            for keys in _key_blocks(
+                    run_file, runs[first:first + MERGE_WAYS], shift):
+                _write_keys(keys, shift, merged_file)
+                count += len(keys)
+            merged.append((position, count))
+        run_file.close()
+        run_file, runs = merged_file, merged
+    return run_file, runs
+
+
+def _uncommon(keys, targets, common):
+    '''The keys, sorted, of targets with at most MAX_SOURCES sources among
+    them, adding the other targets to common.'''
+    if not any(map(operator.eq, targets, targets[MAX_SOURCES:])):
+        return keys
+    kept = []
+    position = 0
+    while position < len(targets):
+        end = bisect.bisect_right(targets, targets[position], position)
+        if end - position > MAX_SOURCES:
+            common.append(targets[position])
+        else:
+            kept.extend(keys[position:end])
+        position = end
+    return kept
+
+
+class PointerIndex(object):
+    '''Maps candidate target offsets to the offsets of the values that
+    point at them, for each (width, byteorder) pair, from a memory map of
+    the index file. close releases the map.'''
+
+    def __init__(self, index_file, size, aligned):
+        self._file = index_file
+        self._size = size
+        self._aligned = aligned
+        self._map = None
+        self._views = []
+        # The size and modification time of the file it was built from
+        self._stat = None
+        # (width, byteorder): (pairs, common targets), as 'Q' memoryviews
+        self._tables = {}
+
+    @property
+    def size(self):
+        '''The size of the file the index was built from.'''
+        return self._size
+
+    @property
+    def aligned(self):
+        '''True if only positions that are a multiple of the width were
+        considered.'''
+        return self._aligned
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._tables = {}
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    @classmethod
+    def build(cls, filename, widths=(4, 8),
+              byteorders=('little', 'big'), aligned=False, cancelled=None):
+        '''Builds the index for a file into a temporary file, one pass per
+        width and byte order. Every 2-byte value is below the size of a
+        file larger than 64 KiB, so 2-byte tables are only built if asked
+        for. If the threading.Event cancelled is set, the build stops and
+        returns None.'''
+        index_file = tempfile.TemporaryFile()
+        if not cls._write(
+                filename, index_file, widths, byteorders, aligned,
+                cancelled):
+            index_file.close()
+            return None
+        return cls._open(index_file)
+
+    @classmethod
+    def _write(cls, filename, index_file, widths, byteorders, aligned,
+               cancelled):
+        '''Writes the index for a file. Returns False if it was
+        cancelled.'''
+        size, mtime = _source_stat(filename)
+        tables = [
+            (width, byteorder)
+            for width in widths for byteorder in byteorders]
+        index_file.write(HEADER.pack(
+            MAGIC, VERSION, aligned, sys.byteorder == 'little',
+            len(tables), size, mtime))
+        with open(filename, 'rb') as source:
+            view = None
+            if size:
+                view = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for width, byteorder in tables:
+                    if not cls._write_table(
+                            view, size, width, byteorder, aligned,
+                            index_file, cancelled):
+                        return False
+            finally:
+                if view is not None:
+                    view.close()
+        index_file.flush()
+        return True
+
+    @staticmethod
+    def _write_table(view, size, width, byteorder, aligned, index_file,
+                     cancelled):
+        run_file = tempfile.TemporaryFile()
+        runs = []
+        for start in range(0, size, CHUNK):
+            if cancelled is not None and cancelled.is_set():
+                run_file.close()
+                return False
+            pairs = _chunk_pairs(view, size, start, width, byteorder, aligned)
+            if pairs:
+                runs.append((run_file.tell(), len(pairs) // 2))
+                run_file.write(pairs)
+        shift = max(size - 1, 1).bit_length()
+        run_file, runs = _merge(run_file, runs, shift)
+
+        header = index_file.tell()
+        index_file.write(TABLE_HEADER.pack(width, byteorder == 'little', 0, 0))
+        count = 0
+        common = array('Q')
+        # The keys of the last target of a block are held back, as it may
+        # have more sources in the next, and a target found to be common
+        # is dropped from the blocks that follow too.
+        held = []
+        dropped = None
+        for keys in _key_blocks(run_file, runs, shift):
+            targets = list(map(operator.rshift, keys, repeat(shift)))
+            if dropped is not None:
+                skip = bisect.bisect_right(targets, dropped)
+                keys, targets = keys[skip:], targets[skip:]
+                if not keys:
+                    continue
+                dropped = None
+            if held:
+                targets = [held[0] >> shift] * len(held) + targets
+                keys = held + keys
+            cut = bisect.bisect_left(targets, targets[-1])
+            held = keys[cut:]
+            keys = _uncommon(keys[:cut], targets[:cut], common)
+            if len(held) > MAX_SOURCES:
+                dropped = targets[-1]
+                common.append(dropped)
+                held = []
+            _write_keys(keys, shift, index_file)
+            count += len(keys)
+        _write_keys(held, shift, index_file)
+        count += len(held)
+        run_file.close()
+        index_file.write(common)
+        end = index_file.tell()
+        index_file.seek(header)
+        index_file.write(TABLE_HEADER.pack(
+            width, byteorder == 'little', count, len(common)))
+        index_file.seek(end)
+        return True
+
+    def sources(self, target, width=4, byteorder=sys.byteorder):
+        '''Returns the ascending offsets of all values of the given width
+        and byte order that equal target, or None if target is 0 or too
+        common to be indexed.'''
+        pairs, common = self._tables[(width, byteorder)]
+        if target == 0:
+            return None
+        found = bisect.bisect_left(common, target)
+        if found < len(common) and common[found] == target:
+            return None
+        with pairs[0::2] as targets:
+            low = bisect.bisect_left(targets, target)
+            high = bisect.bisect_right(targets, target, low)
+        with pairs[2 * low + 1:2 * high:2] as sources:
+            return array('Q', sources)
+
+    @classmethod
+    def _open(cls, index_file):
+        '''The index in a file, or None if it is not an index of the file
+        it names as it is now.'''
+        index_file.seek(0)
+        header = index_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        (magic, version, aligned, little, table_count, size,
+         mtime) = HEADER.unpack(header)
+        if (magic != MAGIC or version != VERSION or
+                little != (sys.byteorder == 'little')):
+            return None
+
+        index = cls(index_file, size, bool(aligned))
+        index._map = mmap.mmap(
+            index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        words = memoryview(index._map).cast('Q')
+        index._views.append(words)
+        position = HEADER.size
+        for table in range(table_count):
+            if len(index._map) < position + TABLE_HEADER.size:
+                index.close()
+                return None
+            width, little, count, common_count = TABLE_HEADER.unpack_from(
+                index._map, position)
+            position += TABLE_HEADER.size
+            end = position + 16 * count + 8 * common_count
+            if len(index._map) < end:
+                index.close()
+                return None
+            pairs = words[position // 8:position // 8 + 2 * count]
+            common = words[position // 8 + 2 * count:end // 8]
+            index._views.extend((pairs, common))
+            byteorder = 'little' if little else 'big'
+            index._tables[(width, byteorder)] = (pairs, common)
+            position = end
+        index._stat = (size, mtime)
+        return index
+
+    @classmethod
+    def load(cls, filename):
+        '''Loads the index saved next to a file, or returns None if there is
+        none or the file has changed since.'''
+        try:
+            index_file = open(index_filename(filename), 'rb')
+        except OSError:
+            return None
+        try:
+            index = cls._open(index_file)
+        except ValueError:
+            # Empty file
+            index = None
+        if index is None:
+            index_file.close()
+        elif index._stat != _source_stat(filename):
+            index.close()
+            index = None
+        return index
+
+    @classmethod
+    def for_file(cls, filename, widths=(4, 8),
+                 byteorders=('little', 'big'), aligned=False, cancelled=None):
+        '''Loads the saved index for a file if it is current, otherwise
+        builds it next to the file, or in a temporary file if it cannot be
+        saved. Returns None if the build is cancelled.'''
+        index = cls.load(filename)
+        if index is not None:
+            if index.aligned == aligned:
+                return index
+            index.close()
+
+        saved = index_filename(filename)
+        partial = saved + '.partial'
+        try:
+            index_file = open(partial, 'w+b')
+        except OSError as err:
+            print('Could not save pointer index: {}'.format(err))
+            return cls.build(
+                filename, widths, byteorders, aligned, cancelled)
+        with index_file:
+            written = cls._write(
+                filename, index_file, widths, byteorders, aligned,
+                cancelled)
+        if not written:
+            os.remove(partial)
+            return None
+        os.replace(partial, saved)
+        return cls.load(filename)
+
+
+def _lanes(view, first, end, width, lanes, count):
+    '''For each value of a width from first to end, 1 in its byte of an int
+    if any of the given bytes of the value are non-zero.'''
+    combined = 0
+    for lane in lanes:
+        combined |= int.from_bytes(view[first + lane:end:width], 'little')
+    return int.from_bytes(
+        combined.to_bytes(count, 'little').translate(_NON_ZERO), 'little')
+
+
+def _chunk_pairs(view, size, start, width, byteorder, aligned):
+    '''The (target, source) pairs of the values starting in the CHUNK bytes
+    of a file from start, sorted, as an array of alternate targets and
+    sources.'''
+    typecode = TYPECODES[width]
+    phases = range(1) if aligned else range(width)
+    # The bytes of a value below size that can be non-zero, the most
+    # significant of which is at most top
+    low_bytes = min(((size - 1).bit_length() + 7) // 8, width)
+    top = (size - 1) >> (8 * (low_bytes - 1))
+    if byteorder == 'little':
+        high_bytes = range(low_bytes, width)
+        top_byte = low_bytes - 1
+    else:
+        high_bytes = range(width - low_bytes)
+        top_byte = width - low_bytes
+    low_bytes = [lane for lane in range(width) if lane not in high_bytes]
+    above_top = bytes(int(byte > top) for byte in range(256))
+
+    # Each hit is encoded as target * CHUNK + offset in the chunk, so that
+    # a single sort of plain ints orders by target, then source.
+    keys = []
+    for phase in phases:
+        first = start + phase
+        count = min(
+            (CHUNK - phase + width - 1) // width, (size - first) // width)
+        if count <= 0:
+            continue
+        end = first + count * width
+        values = array(typecode)
+        values.frombytes(view[first:end])
+        if byteorder != sys.byteorder:
+            values.byteswap()
+
+        # Only values whose high bytes are all zero, and whose top byte is
+        # at most top, can be below size, and 0, which is in every run of
+        # zeros, is left out. OR together each byte of every value, a
+        # column at a time, and take the values with only low bytes set as
+        # candidates, so that nothing is done per value that cannot be a
+        # pointer.
+        high = _lanes(view, first, end, width, high_bytes, count)
+        high |= int.from_bytes(
+            view[first + top_byte:end:width].translate(above_top), 'little')
+        low = _lanes(view, first, end, width, low_bytes, count)
+        candidates = (low & ~high).to_bytes(count, 'little')
+        positions = []
+        for run in _CANDIDATES.finditer(candidates):
+            positions.extend(range(run.start(), run.end()))
+
+        targets = list(map(values.__getitem__, positions))
+        hits = list(map(size.__gt__, targets))
+        offsets = map(
+            range(phase, phase + count * width, width).__getitem__,
+            compress(positions, hits))
+        keys.extend(map(
+            operator.add,
+            map(operator.mul, compress(targets, hits), repeat(CHUNK)),
+            offsets))
+    keys.sort()
+
+    pairs = array('Q', bytes(16 * len(keys)))
+    pairs[0::2] = array('Q', map(operator.floordiv, keys, repeat(CHUNK)))
+    pairs[1::2] = array('Q', map(
+        operator.add, map(operator.mod, keys, repeat(CHUNK)), repeat(start)))
+    return pairs
@@ -0,0 +1,193 @@
+'''Opt-in timing of the hot paths, written as a Chrome trace.
+
+Functions marked with traced are timed, and their calls counted, only when
+profiling was enabled before the module defining them was imported: either
+by hanalyse --profile, or by setting HANALYSE_PROFILE to the name of the
+trace file to write. Otherwise traced hands back the function itself, so
+there is no cost at all when profiling is off.
+
+The trace is in Chrome's trace-event JSON format, and can be loaded into
+chrome://tracing or Perfetto. Each call is a complete event, with a
+counter of the memory traced by tracemalloc alongside, and the peak memory
+is kept in the trace's metadata. Calls made too often to be worth an event
+each, such as TagModel.data, are only counted. With a summary, a table of
+calls and times is printed on exit as well; HANALYSE_PROFILE_SUMMARY=1
+asks for one.'''
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+__all__ = ['Profiler', 'enable', 'enabled', 'profiler', 'traced']
+
+# Events kept in the trace at most, so that a long session cannot use up
+# memory; calls are still counted once it is full.
+MAX_EVENTS = 1000000
+
+_profiler = None
+
+
+class Profiler(object):
+    '''Collects the calls of traced functions: trace events, and per
+    function the number of calls and the total and longest times.'''
+
+    def __init__(self, trace_filename=None, memory=True):
+        # Imported here, as importing it is not free and profiling is
+        # usually off
+        import tracemalloc
+
+        self._tracemalloc = tracemalloc
+        self._trace_filename = trace_filename
+        self._memory = memory
+        self._started = time.perf_counter()
+        self._events = []
+        # name: [calls, total seconds, longest seconds]
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def record(self, name, started, finished, event=True):
+        '''Records one call that ran from started to finished, as
+        perf_counter times.'''
+        duration = finished - started
+        with self._lock:
+            try:
+                stats = self._stats[name]
+            except KeyError:
+                stats = self._stats[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += duration
+            if duration > stats[2]:
+                stats[2] = duration
+
+            if not event or len(self._events) >= MAX_EVENTS:
+                return
+            timestamp = (started - self._started) * 1e6
+            thread = threading.get_ident()
+            self._events.append({
+                'name': name, 'cat': 'hanalyse', 'ph': 'X',
+                'ts': timestamp, 'dur': duration * 1e6,
+                'pid': self._pid, 'tid': thread})
+            if self._memory:
+                current, peak = self._tracemalloc.get_traced_memory()
+                self._events.append({
+                    'name': 'memory', 'ph': 'C',
+                    'ts': (finished - self._started) * 1e6,
+                    'pid': self._pid, 'tid': thread,
+                    'args': {'traced': current}})
+
+    @property
+    def peak_memory(self):
+        '''The most memory traced by tracemalloc, or None.'''
+        tracemalloc = self._tracemalloc
+        if not self._memory or not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.get_traced_memory()[1]
+
+    def stats(self):
+        '''(name, calls, total seconds, longest seconds) for each traced
+        function called, the longest total first.'''
+        with self._lock:
+            rows = [
+                (name, calls, total, longest)
+                for name, (calls, total, longest) in self._stats.items()]
+        rows.sort(key=lambda row: -row[2])
+        return rows
+
+    def write_trace(self, filename=None):
+        '''Writes the trace events as Chrome trace-event JSON.'''
+        filename = filename or self._trace_filename
+        if filename is None:
+            return
+        with self._lock:
+            events = list(self._events)
+        trace = {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'peak_memory': self.peak_memory,
+                'dropped_events': len(events) >= MAX_EVENTS,
+            },
+        }
+        with open(filename, 'w') as trace_file:
+            json.dump(trace, trace_file)
+
+    def summary(self):
+        '''A table of the calls of each traced function, as text.'''
+        lines = ['{:<40} {:>9} {:>11} {:>9} {:>9}'.format(
+            'function', 'calls', 'total ms', 'mean ms', 'max ms')]
+        for name, calls, total, longest in self.stats():
+            lines.append('{:<40} {:>9} {:>11.1f} {:>9.3f} {:>9.1f}'.format(
+                name[-40:], calls, total * 1e3, total * 1e3 / calls,
+                longest * 1e3))
+        peak = self.peak_memory
+        if peak is not None:
+            lines.append('peak traced memory: {:.1f} MiB'.format(
+                peak / (1 << 20)))
+        return '\n'.join(lines)
+
+
+def enable(trace_filename=None, summary=False, memory=True):
+    '''Turns profiling on for functions traced from now on, writing the
+    trace and printing the summary on exit. Returns the Profiler.'''
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(trace_filename, memory)
+
+        def finish(profiler=_profiler):
+            try:
+                profiler.write_trace()
+            except OSError as err:
+                print('Could not write the profile trace: {}'.format(err))
+            if summary:
+                sys.stderr.write(profiler.summary() + '\n')
+        atexit.register(finish)
+    return _profiler
+
+
+def enabled():
+    return _profiler is not None
+
+
+def profiler():
+    '''The Profiler, or None if profiling is off.'''
+    return _profiler
+
+
+def traced(name=None, events=True):
+    '''Decorates a function to be timed when profiling is on, under name
+    or its qualified name. Without events its calls are only counted,
+    for functions called too often to trace each call.'''
+    def decorate(function):
+        if _profiler is None:
+            return function
+        label = name or function.__qualname__
+        record = _profiler.record
+        clock = time.perf_counter
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(label, started, clock(), events)
+        return wrapper
+    return decorate
+
+
+def _from_environment():
+    trace_filename = os.environ.get('HANALYSE_PROFILE')
+    summary = os.environ.get('HANALYSE_PROFILE_SUMMARY', '') not in (
+        '', '0')
+    if trace_filename or summary:
+        enable(trace_filename or None, summary)
+
+
+_from_environment()
@@ -0,0 +1,187 @@
+'''Resolving relative offsets against candidate bases.
+
+A relative offset is added to a base to give the offset it points at. The
+base is rarely written down, so the candidates are gathered from what is
+around the field: the cursor, the field itself, the tags that contain it,
+the field's parent, the start of the file and the targets of the
+Offset-role tags.
+
+rank_bases tries every candidate over every occurrence of a field, that is
+every tag with the same name and type, and ranks the bases by how many of
+the targets land on the start of a tag and how many land inside the data.
+'''
+
+import sys
+
+from .decoding import TYPEFORMATS, TagDecoder
+from .intervals import IntervalIndex
+from .tags import TagStore
+
+__all__ = ['relative_bases', 'rank_bases']
+
+CURSOR = 'Cursor'
+FILE_START = 'File start'
+FIELD_START = 'Field start'
+FIELD_END = 'After field'
+TAG_START = 'Containing tag start'
+STRUCTURE_START = 'Structure start'
+
+
+def _containing(tags, index, start, end):
+    '''A tag with exactly the extent [start, end], and the innermost and
+    outermost other tags containing it, or None.'''
+    field = inner = outer = None
+    for row in index.overlapping(start, end):
+        tag = tags[row]
+        if tag.start > start or tag.end < end:
+            continue
+        if tag.start == start and tag.end == end:
+            if field is None:
+                field = tag
+            continue
+        extent = tag.end - tag.start
+        if inner is None or extent < inner.end - inner.start:
+            inner = tag
+        if outer is None or extent > outer.end - outer.start:
+            outer = tag
+    return field, inner, outer
+
+
+def _tag_starts(tags, identifiers):
+    '''A dict mapping those of a set of identifiers that name a tag to the
+    tag's start.'''
+    if isinstance(tags, TagStore):
+        pairs = zip(tags.identifiers, tags.starts)
+    else:
+        pairs = ((tag.identifier, tag.start) for tag in tags)
+    starts = {}
+    for identifier, start in pairs:
+        if identifier in identifiers and identifier not in starts:
+            starts[identifier] = start
+    return starts
+
+
+def _field_bases(tags, index, start, end, parent=None, parent_starts=None):
+    '''(label, base) pairs that depend on where the field is.
+
+    The structure is the field's parent, the parent of the tag with the
+    field's extent if parent is None, and the outermost tag containing the
+    field if it has none. parent_starts maps identifiers to the starts of
+    their tags, and is looked up from tags if not given.'''
+    bases = [(FIELD_START, start), (FIELD_END, end + 1)]
+    field, inner, outer = _containing(tags, index, start, end)
+    if inner is not None:
+        bases.append((TAG_START, inner.start))
+    if parent is None:
+        parent = field.parent if field is not None else 0
+    if parent:
+        if parent_starts is None:
+            parent_starts = _tag_starts(tags, {parent})
+        if parent in parent_starts:
+            bases.append((STRUCTURE_START, parent_starts[parent]))
+            return bases
+    if outer is not None and outer is not inner:
+        bases.append((STRUCTURE_START, outer.start))
+    return bases
+
+
+def _fixed_bases(cursor, offset_targets):
+    '''(label, base) pairs that are the same for every field.'''
+    bases = [(FILE_START, 0)]
+    if cursor is not None:
+        bases.append((CURSOR, cursor))
+    seen = set()
+    for name, target in offset_targets:
+        if target not in seen:
+            seen.add(target)
+            bases.append(('Target of {}'.format(name), target))
+    return bases
+
+
+def relative_bases(tags, start, end, cursor=None, offset_targets=(),
+                   index=None, parent=None):
+    '''Returns the candidate (label, base) pairs for a relative offset held
+    in [start, end].
+
+    offset_targets is an iterable of (name, target) pairs for the Offset
+    tags that have been resolved. index is an IntervalIndex over the tags,
+    such as TagModel's; one is built if it is not given. parent is the
+    identifier of the field's parent, taken from a tag with the field's
+    extent if not given.'''
+    if index is None:
+        index = IntervalIndex()
+        index.reset((tag.start for tag in tags), (tag.end for tag in tags))
+    return (
+        _field_bases(tags, index, start, end, parent) +
+        _fixed_bases(cursor, offset_targets))
+
+
+def rank_bases(tags, row, data, cursor=None, offset_targets=(),
+               index=None, byteorder=sys.byteorder):
+    '''Ranks the candidate bases for the numeric tag at row.
+
+    The value of every occurrence of the tag, that is every tag with the
+    same name and type, is added to each candidate base. Returns a list of
+    (label, aligned, in_bounds, occurrences) tuples, best first, where
+    aligned is how many targets are the start of a tag and in_bounds is
+    how many fall inside the data. Bases that depend on the field, such as
+    the field's own start, are taken per occurrence; the others are fixed.
+    '''
+    field = tags[row]
+    if field.type not in TYPEFORMATS:
+        return []
+    if index is None:
+        index = IntervalIndex()
+        index.reset((tag.start for tag in tags), (tag.end for tag in tags))
+
+    occurrences = [
+        tag for tag in tags
+        if tag.name == field.name and tag.type == field.type]
+    values = TagDecoder(
+        [(tag.start, tag.end, tag.type) for tag in occurrences],
+        byteorder).decode(data)
+    pairs = [
+        (tag, value) for tag, value in zip(occurrences, values)
+        if value is not None]
+    if not pairs:
+        return []
+    values = [value for tag, value in pairs]
+
+    # One column of bases per label, one entry per occurrence
+    columns = {}
+    labels = []
+    parent_starts = _tag_starts(
+        tags, {tag.parent for tag, value in pairs} - {0})
+    for tag, value in pairs:
+        for label, base in _field_bases(
+                tags, index, tag.start, tag.end, tag.parent, parent_starts):
+            if label not in columns:
+                labels.append(label)
+                columns[label] = {}
+            columns[label][tag.identifier] = base
+
+    if isinstance(tags, TagStore):
+        tag_starts = frozenset(tags.starts)
+    else:
+        tag_starts = frozenset(tag.start for tag in tags)
+    size = len(data)
+
+    def score(label, targets):
+        return (
+            label,
+            sum(map(tag_starts.__contains__, targets)),
+            sum(1 for target in targets if 0 <= target < size),
+            len(targets))
+
+    ranking = []
+    for label in labels:
+        bases = columns[label]
+        targets = [
+            bases[tag.identifier] + value
+            for tag, value in pairs if tag.identifier in bases]
+        ranking.append(score(label, targets))
+    for label, base in _fixed_bases(cursor, offset_targets):
+        ranking.append(score(label, [base + value for value in values]))
+
+    ranking.sort(key=lambda entry: (-entry[1], -entry[2], -entry[3]))
+    return ranking
@@ -0,0 +1,147 @@
+'''Searching files for byte patterns a chunk at a time.
+
+A search walks a memory-mapped file in chunks, reporting the hits found in
+each chunk as it goes so that they can be shown before the whole file has
+been read, and stops early when it is cancelled. The hits are collected in
+SearchResults, which doubles as the cursor for "Find again".'''
+
+from array import array
+import bisect
+import re
+import threading
+
+from .decoding import mapped_file
+
+__all__ = ['SearchResults', 'parse_pattern', 'search_file']
+
+CHUNK_SIZE = 16 << 20
+
+_HEX_DIGITS = re.compile(r'(?:0x)?([0-9a-f]+)', re.IGNORECASE)
+
+
+def parse_pattern(text):
+    '''Returns the bytes given as hex digits, optionally separated by white
+    space and each group optionally prefixed by 0x, or as text in quotes.
+    Raises ValueError if the text is neither.'''
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '\'"':
+        return text[1:-1].encode('latin-1')
+
+    digits = []
+    for group in text.split():
+        match = _HEX_DIGITS.fullmatch(group)
+        if match is None:
+            raise ValueError('not a hex pattern: {!r}'.format(group))
+        digits.append(match.group(1))
+    digits = ''.join(digits)
+    if not digits or len(digits) % 2:
+        raise ValueError('a hex pattern needs whole bytes')
+    return bytes.fromhex(digits)
+
+
+def _find_all(data, pattern, start, end, alignment):
+    '''The ascending offsets in [start, end) at which pattern starts and
+    which are a multiple of alignment.'''
+    hits = []
+    limit = min(end + len(pattern) - 1, len(data))
+    position = data.find(pattern, start, limit)
+    while position >= 0:
+        remainder = position % alignment
+        if remainder:
+            position = data.find(
+                pattern, position + alignment - remainder, limit)
+            continue
+        hits.append(position)
+        position = data.find(pattern, position + alignment, limit)
+    return hits
+
+
+def search_file(filename, pattern, alignment=1, chunk_size=CHUNK_SIZE,
+                cancelled=None):
+    '''Yields (searched, size, hits) after each chunk of a file has been
+    searched for pattern, where searched is how many bytes have been
+    searched so far and hits are the offsets found in the chunk.
+
+    cancelled is an optional threading.Event; the search stops at the end
+    of the chunk during which it is set.'''
+    if cancelled is None:
+        cancelled = threading.Event()
+    with mapped_file(filename) as data:
+        size = len(data)
+        if not pattern:
+            yield size, size, []
+            return
+        for chunk in range(0, size, chunk_size):
+            if cancelled.is_set():
+                return
+            chunk_end = min(chunk + chunk_size, size)
+            yield chunk_end, size, _find_all(
+                data, pattern, chunk, chunk_end, alignment)
+
+
+class SearchResults(object):
+    '''The hits of one search, in ascending order, and the position of the
+    last one shown.
+
+    Hits are added as they are found. next wraps around to the first hit
+    only once the search is complete; until then there may be more to
+    come.'''
+
+    def __init__(self, pattern=b'', alignment=1):
+        self._pattern = pattern
+        self._alignment = alignment
+        self._hits = array('Q')
+        self._complete = False
+        self._position = -1
+
+    @classmethod
+    def from_hits(cls, pattern, hits, alignment=1):
+        '''Results for a search that has already been answered, such as
+        from a PointerIndex.'''
+        results = cls(pattern, alignment)
+        results.add(hits)
+        results.finish()
+        return results
+
+    @property
+    def pattern(self):
+        return self._pattern
+
+    @property
+    def alignment(self):
+        return self._alignment
+
+    @property
+    def complete(self):
+        '''True once every chunk has been searched.'''
+        return self._complete
+
+    @property
+    def position(self):
+        '''The offset of the last hit returned by next, or -1.'''
+        return self._position
+
+    def __len__(self):
+        return len(self._hits)
+
+    def __getitem__(self, index):
+        return self._hits[index]
+
+    def add(self, hits):
+        '''Appends hits, which must follow those already added.'''
+        self._hits.extend(hits)
+
+    def finish(self):
+        self._complete = True
+
+    def next(self):
+        '''Moves to and returns the first hit after the current position,
+        wrapping around once the search is complete. Returns None if there
+        is no such hit yet.'''
+        index = bisect.bisect_right(self._hits, self._position)
+        if index == len(self._hits):
+            if not self._complete or not self._hits:
+                return None
+            index = 0
+        self._position = self._hits[index]
+        return self._position
@@ -0,0 +1,101 @@
+import threading
+
+from PyQt5 import QtCore
+
+from .pointers import PointerIndex
+from .search import CHUNK_SIZE, search_file
+
+__all__ = ['PointerIndexTask', 'SearchTask']
+
+
+class SearchSignals(QtCore.QObject):
+    '''The signals of a SearchTask, which as a QRunnable cannot have its
+    own.'''
+
+    # The hits in the chunk just searched, as a list of offsets
+    found = QtCore.pyqtSignal(object)
+    # Bytes searched so far, and the file size
+    progress = QtCore.pyqtSignal('qint64', 'qint64')
+    # True if the search ran to the end of the file
+    finished = QtCore.pyqtSignal(bool)
+
+
+class SearchTask(QtCore.QRunnable):
+    '''Searches a file for a byte pattern on a QThreadPool thread, emitting
+    the hits chunk by chunk.
+
+    The signals object is created in the thread that creates the task, so
+    slots connected to it run there, not on the pool thread. The task is
+    not deleted by the pool; keep a reference until finished is emitted.'''
+
+    def __init__(self, filename, pattern, alignment=1,
+                 chunk_size=CHUNK_SIZE):
+        super(SearchTask, self).__init__()
+        self.setAutoDelete(False)
+        self.signals = SearchSignals()
+        self._filename = filename
+        self._pattern = pattern
+        self._alignment = alignment
+        self._chunk_size = chunk_size
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        '''Stops the search after the chunk it is searching.'''
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        try:
+            for searched, size, hits in search_file(
+                    self._filename,
+                    self._pattern,
+                    self._alignment,
+                    self._chunk_size,
+                    self._cancelled):
+                if self._cancelled.is_set():
+                    break
+                if hits:
+                    self.signals.found.emit(hits)
+                self.signals.progress.emit(searched, size)
+        except OSError as err:
+            print('Search failed: {}'.format(err))
+            self._cancelled.set()
+        self.signals.finished.emit(not self._cancelled.is_set())
+
+
+class PointerIndexSignals(QtCore.QObject):
+    '''The signals of a PointerIndexTask.'''
+
+    # The PointerIndex, or None if it was cancelled or failed
+    finished = QtCore.pyqtSignal(object)
+
+
+class PointerIndexTask(QtCore.QRunnable):
+    '''Loads or builds, and saves, the PointerIndex for a file on a
+    QThreadPool thread.
+
+    Like SearchTask, the task is not deleted by the pool; keep a reference
+    until finished is emitted.'''
+
+    def __init__(self, filename):
+        super(PointerIndexTask, self).__init__()
+        self.setAutoDelete(False)
+        self.signals = PointerIndexSignals()
+        self._filename = filename
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        '''Stops the build before the next chunk of the file it reads.'''
+        self._cancelled.set()
+
+    def run(self):
+        index = None
+        try:
+            index = PointerIndex.for_file(
+                self._filename, cancelled=self._cancelled)
+        except OSError as err:
+            print('Pointer index failed: {}'.format(err))
+        self.signals.finished.emit(index)
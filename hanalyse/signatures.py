@@ -0,0 +1,254 @@
+'''hanalyse scan -- find Signature and Constant tags' bytes in large images.
+
+The bytes of every Signature and Constant tag are taken from a reference
+file that the tag file describes. All of the patterns are then searched
+for together in one pass over each image: a single compiled regular
+expression finds every position where any pattern may start, and the
+patterns sharing that first byte are checked there. The expression is
+nested as a trie of the patterns, so the regular expression engine steps
+through it as a multi-pattern automaton rather than trying every pattern
+in turn. Images are read in overlapping chunks from a memory map, so their
+size does not matter, and the chunks can be scanned in a pool of worker
+processes.'''
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from .decoding import mapped_file
+from .tags import TagRoles, read_tags
+
+__all__ = ['SignatureScanner', 'patterns_from_tags', 'main']
+
+CHUNK_SIZE = 64 << 20
+
+SCANNED_ROLES = (TagRoles.Signature, TagRoles.Constant)
+
+
+def patterns_from_tags(tags, data, roles=SCANNED_ROLES):
+    '''Returns a dict mapping the bytes of each tag with one of the given
+    roles, as found in the reference data, to the names of those tags.'''
+    patterns = {}
+    for tag in tags:
+        if tag.role in roles and tag.start <= tag.end < len(data):
+            pattern = bytes(data[tag.start:tag.end + 1])
+            patterns.setdefault(pattern, []).append(tag.name)
+    return patterns
+
+
+def _common_prefix(patterns):
+    first = min(patterns)
+    last = max(patterns)
+    for index, byte in enumerate(first):
+        if byte != last[index]:
+            return first[:index]
+    return first
+
+
+def _trie_expression(patterns):
+    '''Builds a regular expression matching any of the patterns, nested
+    as a trie on their leading bytes.'''
+    optional = b'' in patterns
+    groups = {}
+    for pattern in patterns:
+        if pattern:
+            groups.setdefault(pattern[0], []).append(pattern)
+
+    branches = []
+    for first, group in sorted(groups.items()):
+        prefix = _common_prefix(group)
+        branches.append(
+            re.escape(prefix) +
+            _trie_expression([pattern[len(prefix):] for pattern in group]))
+
+    if not branches:
+        return b''
+    if len(branches) == 1 and not optional:
+        return branches[0]
+    return b'(?:' + b'|'.join(branches) + (b')?' if optional else b')')
+
+
+class SignatureScanner(object):
+    '''Finds every occurrence of any of a set of byte patterns.'''
+
+    def __init__(self, patterns):
+        '''patterns is a dict mapping each pattern to a list of names.'''
+        self._patterns = {
+            pattern: names for pattern, names in patterns.items() if pattern}
+        self._longest = max(map(len, self._patterns), default=0)
+
+        # The patterns to try at a position, by the byte found there,
+        # longest first.
+        self._by_first = {}
+        for pattern in sorted(self._patterns, key=len, reverse=True):
+            self._by_first.setdefault(pattern[0], []).append(pattern)
+
+        # A zero-width match at every position where a pattern starts.
+        self._regex = re.compile(
+            b'(?=' + _trie_expression(list(self._patterns)) + b')',
+            re.DOTALL)
+
+    @property
+    def overlap(self):
+        '''How far chunks must overlap for no match to be split.'''
+        return max(self._longest - 1, 0)
+
+    def scan(self, data, start=0, end=None):
+        '''Yields (offset, pattern, names) for each occurrence of a pattern
+        starting in data[start:end]. The pattern may run on past end.'''
+        if not self._patterns:
+            return
+        if end is None:
+            end = len(data)
+        by_first = self._by_first
+        patterns = self._patterns
+        search_end = min(end + self.overlap, len(data))
+        for match in self._regex.finditer(data, start, search_end):
+            offset = match.start()
+            if offset >= end:
+                break
+            for pattern in by_first[data[offset]]:
+                if data[offset:offset + len(pattern)] == pattern:
+                    yield offset, pattern, patterns[pattern]
+
+    def scan_file(self, filename, start=0, end=None,
+                  chunk_size=CHUNK_SIZE):
+        '''Yields the occurrences in a file, or in the part of it between
+        start and end, reading it in overlapping chunks.'''
+        with mapped_file(filename) as data:
+            if end is None:
+                end = len(data)
+            for chunk in range(start, end, chunk_size):
+                chunk_end = min(chunk + chunk_size, end)
+                view = data[chunk:min(chunk_end + self.overlap, len(data))]
+                for offset, pattern, names in self.scan(
+                        view, 0, chunk_end - chunk):
+                    yield chunk + offset, pattern, names
+
+
+# The scanner for the worker processes, set by _init_worker.
+_worker_scanner = None
+
+
+def _init_worker(patterns):
+    global _worker_scanner
+    _worker_scanner = SignatureScanner(patterns)
+
+
+def _scan_in_worker(filename, start, end):
+    return list(_worker_scanner.scan_file(filename, start, end))
+
+
+def scan_files(filenames, patterns, jobs=1, chunk_size=CHUNK_SIZE):
+    '''Yields (filename, offset, pattern, names) for every occurrence in
+    each file, in order. With more than one job, the chunks of each file
+    are scanned in a pool of worker processes.'''
+    if jobs == 1:
+        scanner = SignatureScanner(patterns)
+        for filename in filenames:
+            for offset, pattern, names in scanner.scan_file(
+                    filename, chunk_size=chunk_size):
+                yield filename, offset, pattern, names
+        return
+
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(patterns,)) as executor:
+        for filename in filenames:
+            size = os.path.getsize(filename)
+            futures = [
+                executor.submit(
+                    _scan_in_worker, filename, chunk,
+                    min(chunk + chunk_size, size))
+                for chunk in range(0, size, chunk_size)]
+            for future in futures:
+                for offset, pattern, names in future.result():
+                    yield filename, offset, pattern, names
+
+
+def main(argv=None):
+    '''Command line options.'''
+    parser = argparse.ArgumentParser(
+        prog='hanalyse scan',
+        description='Find the Signature and Constant tags of a tag file '
+                    'in other files')
+
+    parser.add_argument(
+        '-t',
+        '--tag',
+        dest='tagfile',
+        required=True,
+        metavar='FILE',
+        help='the tag file')
+
+    parser.add_argument(
+        '-r',
+        '--reference',
+        dest='reference',
+        required=True,
+        metavar='FILE',
+        help='the file the tag file describes, to take the bytes from')
+
+    parser.add_argument(
+        '-o',
+        '--out',
+        dest='outfile',
+        default=None,
+        metavar='FILE',
+        help='the output file (default: standard output)')
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        dest='jobs',
+        type=int,
+        default=1,
+        help='the number of worker processes (default: 1)')
+
+    parser.add_argument(
+        'files',
+        nargs='+',
+        metavar='FILE',
+        help='the files to scan')
+
+    args = parser.parse_args(argv)
+
+    with mapped_file(args.reference) as data:
+        patterns = patterns_from_tags(read_tags(args.tagfile), data)
+
+    if args.outfile is None:
+        out = sys.stdout
+    else:
+        out = open(args.outfile, 'w')
+
+    started = time.perf_counter()
+    matches = 0
+    try:
+        for filename, offset, pattern, names in scan_files(
+                args.files, patterns, args.jobs):
+            matches += 1
+            out.write(json.dumps({
+                'file': filename,
+                'offset': offset,
+                'length': len(pattern),
+                'names': names,
+            }))
+            out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+
+    byte_count = sum(os.path.getsize(filename) for filename in args.files)
+    sys.stderr.write(
+        'Found {} matches of {} patterns in {:.1f} MB in {:.2f}s: '
+        '{:.1f} MB/s\n'.format(
+            matches, len(patterns), byte_count / 1e6, elapsed,
+            byte_count / 1e6 / elapsed))
+    return 0
@@ -0,0 +1,146 @@
+'''A binary sidecar cache for YAML tag files.
+
+The cache sits next to the tag file (kwdb.yaml.cache for kwdb.yaml) and
+holds the TagStore columns as packed arrays followed by the string table,
+so a warm load is a handful of copies out of a memory-mapped file instead
+of a YAML parse. It records the size, modification time and SHA-1 of the
+tag file it was built from and is ignored when those no longer match.'''
+
+from array import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+__all__ = ['cache_filename', 'read_cache', 'write_cache']
+
+MAGIC = b'HTAG'
+VERSION = 4
+
+# magic, version, byte order, 'L' item size, tag count, string count,
+# source size, source mtime in ns, source SHA-1
+HEADER = struct.Struct('<4sHBBQQQq20s')
+
+
+def cache_filename(filename):
+    return filename + '.cache'
+
+
+def _file_hash(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.digest()
+
+
+def _header_fields(filename):
+    stat = os.stat(filename)
+    return (
+        MAGIC, VERSION, sys.byteorder == 'little', array('L').itemsize,
+        stat.st_size, stat.st_mtime_ns)
+
+
+def write_cache(filename, store):
+    '''Writes the cache for a tag file from the TagStore loaded from it.'''
+    magic, version, little, l_size, size, mtime = _header_fields(filename)
+    strings = [string.encode('utf-8') for string in store.strings]
+    string_ends = array('Q')
+    total = 0
+    for string in strings:
+        total += len(string)
+        string_ends.append(total)
+
+    with open(cache_filename(filename), 'wb') as cache:
+        cache.write(HEADER.pack(
+            magic, version, little, l_size, len(store), len(strings),
+            size, mtime, _file_hash(filename)))
+        for column in store.columns:
+            cache.write(column)
+        cache.write(string_ends)
+        cache.write(b''.join(strings))
+
+
+def _rewrite_header(filename, header):
+    try:
+        with open(cache_filename(filename), 'r+b') as cache:
+            cache.write(header)
+    except OSError as err:
+        print('Could not update tag cache: {}'.format(err))
+
+
+def read_cache(filename):
+    '''Returns the TagStore.from_columns arguments cached for a tag file,
+    or None if there is no cache or it was not built from the file as it
+    is now.'''
+    try:
+        cache = open(cache_filename(filename), 'rb')
+    except OSError:
+        return None
+
+    with cache:
+        try:
+            view = mmap.mmap(cache.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+        with view:
+            if len(view) < HEADER.size:
+                return None
+            (magic, version, little, l_size, count, string_count,
+             size, mtime, sha1) = HEADER.unpack_from(view)
+            expected = _header_fields(filename)
+            if (magic, version, little, l_size, size) != expected[:5]:
+                return None
+            stale_mtime = mtime != expected[5]
+            if stale_mtime and sha1 != _file_hash(filename):
+                return None
+
+            position = HEADER.size
+            columns_size = count * (4 * 8 + 3 + 4 * l_size)
+            if len(view) < position + columns_size + string_count * 8:
+                return None
+
+            def take(typecode, length):
+                nonlocal position
+                column = array(typecode)
+                end = position + length * column.itemsize
+                column.frombytes(view[position:end])
+                position = end
+                return column
+
+            identifiers = take('Q', count)
+            starts = take('Q', count)
+            ends = take('Q', count)
+            types = bytearray(view[position:position + count])
+            position += count
+            roles = bytearray(view[position:position + count])
+            position += count
+            names = take('L', count)
+            comments = take('L', count)
+            ofs = bytearray(view[position:position + count])
+            position += count
+            counts = take('L', count)
+            sizes = take('L', count)
+            parents = take('Q', count)
+            string_ends = take('Q', string_count)
+
+            blob = view[position:]
+            strings = []
+            begin = 0
+            for end in string_ends:
+                strings.append(blob[begin:end].decode('utf-8'))
+                begin = end
+
+    if stale_mtime:
+        # The contents are unchanged, so record the new mtime to skip
+        # hashing the file on the next load.
+        _rewrite_header(
+            filename, HEADER.pack(
+                magic, version, little, l_size, count, string_count,
+                size, expected[5], sha1))
+
+    return (
+        identifiers, starts, ends, types, roles, names, comments, ofs, counts, sizes,
+        parents, strings)
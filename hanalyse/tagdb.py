@@ -0,0 +1,549 @@
+'''A SQLite database of tags, for annotation sets too large to hold in
+memory or to rewrite on every save.
+
+Each tag is a row of the tags table, keyed by an id that also orders the
+rows as they are shown. Tag extents are kept in an R*Tree, updated by
+triggers, so "which tags overlap this range?" reads only the matching
+rows. Where SQLite was built without the R*Tree module, an index on the
+start offset is used instead.
+
+Every change is its own transaction. Tags can be imported from, and
+exported to, the YAML tag files. A tag's identifier is the id of its row,
+and its parent the id of its parent's row, or 0.
+
+DatabaseTags presents a database as a sequence of tags like a TagStore,
+but only the ids of the rows fetched so far are held in memory, and the
+rows themselves are read a page at a time as they are asked for.'''
+
+from array import array
+import bisect
+import collections
+
+from .tags import (
+    TagRoles, TagStore, TagTypes, _to_identifier, _to_offset, _to_role,
+    _to_type, read_tags)
+
+__all__ = ['TagDatabase', 'DatabaseTags']
+
+# The columns of the tags table, after the id, in TagStore.append order
+COLUMNS = (
+    'name', 'start', 'end', 'type', 'role', 'comment', 'of', 'count', 'size',
+    'parent')
+
+_SELECT_COLUMNS = ', '.join('"{}"'.format(column) for column in COLUMNS)
+_INSERT = 'INSERT INTO tags ({}) VALUES ({})'.format(
+    _SELECT_COLUMNS, ', '.join('?' * len(COLUMNS)))
+_INSERT_WITH_ID = 'INSERT INTO tags (id, {}) VALUES ({})'.format(
+    _SELECT_COLUMNS, ', '.join('?' * (len(COLUMNS) + 1)))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL DEFAULT '',
+    start INTEGER NOT NULL,
+    "end" INTEGER NOT NULL,
+    type INTEGER NOT NULL,
+    role INTEGER NOT NULL,
+    comment TEXT NOT NULL DEFAULT '',
+    of INTEGER NOT NULL,
+    count TEXT NOT NULL DEFAULT '',
+    size TEXT NOT NULL DEFAULT '',
+    parent INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tags_start ON tags (start);
+CREATE INDEX IF NOT EXISTS tags_role ON tags (role);
+'''
+
+RTREE_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS tag_extents
+    USING rtree(id, start, "end");
+CREATE TRIGGER IF NOT EXISTS tags_inserted AFTER INSERT ON tags BEGIN
+    INSERT INTO tag_extents VALUES (new.id, new.start, new."end");
+END;
+CREATE TRIGGER IF NOT EXISTS tags_moved
+        AFTER UPDATE OF start, "end" ON tags BEGIN
+    UPDATE tag_extents SET start = new.start, "end" = new."end"
+        WHERE id = new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS tags_deleted AFTER DELETE ON tags BEGIN
+    DELETE FROM tag_extents WHERE id = old.id;
+END;
+'''
+
+# R*Tree coordinates are 32-bit floats, rounded outwards, so its matches
+# are checked against the exact offsets.
+_OVERLAPPING_RTREE = '''
+SELECT tags.id FROM tag_extents JOIN tags ON tags.id = tag_extents.id
+WHERE tag_extents.start <= :end AND tag_extents."end" >= :start
+    AND tags.start <= :end AND tags."end" >= :start
+ORDER BY tags.id
+'''
+
+_OVERLAPPING_INDEX = '''
+SELECT id FROM tags WHERE start <= :end AND "end" >= :start ORDER BY id
+'''
+
+PAGE_SIZE = 1024
+CACHED_PAGES = 64
+
+
+def _row_values(tag):
+    '''The column values for a tag or a dict of tag fields.'''
+    if isinstance(tag, dict):
+        get = tag.get
+    else:
+        def get(key, default=None):
+            return getattr(tag, key, default)
+    return (
+        get('name', ''),
+        _to_offset(get('start', 0)),
+        _to_offset(get('end', 0)),
+        int(_to_type(get('type', TagTypes.Unknown))),
+        int(_to_role(get('role', TagRoles.Unknown))),
+        get('comment', ''),
+        int(_to_type(get('of', TagTypes.Unknown))),
+        get('count', ''),
+        get('size', ''),
+        _to_identifier(get('parent', 0)))
+
+
+def _column_value(key, value):
+    '''Converts a field value as TagStore would, for storing.'''
+    if key in ('start', 'end'):
+        return _to_offset(value)
+    if key in ('type', 'of'):
+        return int(_to_type(value))
+    if key == 'role':
+        return int(_to_role(value))
+    if key == 'parent':
+        return _to_identifier(value)
+    return value
+
+
+def _numbered_rows(tags):
+    '''The id and column values of each tag in a TagStore, the id being
+    its identifier or, where an earlier tag had that, a new one.'''
+    seen = set()
+    spare = tags.next_identifier
+    for tag in tags:
+        identifier = tag.identifier
+        if identifier in seen:
+            identifier = spare
+            spare += 1
+        seen.add(identifier)
+        yield (identifier,) + _row_values(tag)
+
+
+class TagDatabase(object):
+    '''A tag database file, created if it does not exist.'''
+
+    def __init__(self, filename):
+        # Imported here so that only opening a database pays for it
+        import sqlite3
+
+        self._filename = filename
+        self._connection = sqlite3.connect(filename)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        with self._connection:
+            self._connection.executescript(SCHEMA)
+            self._add_missing_columns()
+            try:
+                self._connection.executescript(RTREE_SCHEMA)
+                self._overlapping = _OVERLAPPING_RTREE
+            except sqlite3.OperationalError:
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS tags_end ON tags ("end")')
+                self._overlapping = _OVERLAPPING_INDEX
+        self._count = None
+
+    def _add_missing_columns(self):
+        '''Adds the columns a database made before them lacks.'''
+        present = {
+            row[1] for row in self._connection.execute(
+                'PRAGMA table_info(tags)')}
+        if 'parent' not in present:
+            self._connection.execute(
+                'ALTER TABLE tags '
+                'ADD COLUMN parent INTEGER NOT NULL DEFAULT 0')
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def close(self):
+        self._connection.close()
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self._connection.execute(
+                'SELECT count(*) FROM tags').fetchone()[0]
+        return self._count
+
+    def insert(self, tag):
+        '''Adds a tag, or a dict of tag fields, returning its id, which is
+        a new one whatever the tag's identifier.'''
+        with self._connection:
+            cursor = self._connection.execute(_INSERT, _row_values(tag))
+        if self._count is not None:
+            self._count += 1
+        return cursor.lastrowid
+
+    def update(self, identifier, key, value):
+        '''Sets one field of a tag.'''
+        if key not in COLUMNS:
+            raise KeyError(key)
+        with self._connection:
+            self._connection.execute(
+                'UPDATE tags SET "{}" = ? WHERE id = ?'.format(key),
+                (_column_value(key, value), identifier))
+
+    def delete(self, identifiers):
+        '''Removes the tags with the given ids.'''
+        with self._connection:
+            self._connection.executemany(
+                'DELETE FROM tags WHERE id = ?',
+                ((identifier,) for identifier in identifiers))
+        self._count = None
+
+    def import_tags(self, tags):
+        '''Adds every tag from an iterable in one transaction. Their
+        identifiers, and the parents naming them, are moved past the ids
+        already used, to be the ids of their rows.'''
+        store = TagStore()
+        store.extend(tags)
+        with self._connection:
+            last = self._connection.execute(
+                'SELECT max(id) FROM tags').fetchone()[0]
+            store.renumber((last or 0) + 1)
+            self._connection.executemany(
+                _INSERT_WITH_ID, _numbered_rows(store))
+        self._count = None
+
+    def import_file(self, filename):
+        '''Adds the tags from a YAML tag file.'''
+        self.import_tags(read_tags(filename))
+
+    def export_file(self, filename):
+        '''Writes every tag to a YAML tag file, sorted by start offset, a
+        page at a time.'''
+        from .tagyaml import TagWriter
+
+        parents = {
+            row[0] for row in self._connection.execute(
+                'SELECT DISTINCT parent FROM tags WHERE parent != 0')}
+        with open(filename, 'w') as save_file:
+            writer = TagWriter(save_file, parents)
+            writer.open()
+            for identifiers, page in self.pages(order='start'):
+                for tag in page:
+                    writer.write(tag)
+            writer.close()
+
+    def ids_after(self, identifier, limit):
+        '''The ids following the given one, in order, at most limit.'''
+        return [
+            row[0] for row in self._connection.execute(
+                'SELECT id FROM tags WHERE id > ? ORDER BY id LIMIT ?',
+                (identifier, limit))]
+
+    def ids_up_to(self, after, identifier):
+        '''The ids after one id up to and including another.'''
+        return [
+            row[0] for row in self._connection.execute(
+                'SELECT id FROM tags WHERE id > ? AND id <= ? ORDER BY id',
+                (after, identifier))]
+
+    def count_between(self, after, before):
+        '''The number of ids after one id and before another.'''
+        return self._connection.execute(
+            'SELECT count(*) FROM tags WHERE id > ? AND id < ?',
+            (after, before)).fetchone()[0]
+
+    def id_after(self, identifier, skip):
+        '''The id skip places on from the id following the given one, or
+        None.'''
+        row = self._connection.execute(
+            'SELECT id FROM tags WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?',
+            (identifier, skip)).fetchone()
+        return row[0] if row is not None else None
+
+    def page(self, first, limit):
+        '''Returns the ids and a TagStore of the rows from the given id on,
+        at most limit.'''
+        identifiers = []
+        page = TagStore()
+        for row in self._connection.execute(
+                'SELECT id, {} FROM tags WHERE id >= ? ORDER BY id LIMIT ?'
+                .format(_SELECT_COLUMNS), (first, limit)):
+            identifiers.append(row[0])
+            page.append(*row[1:], identifier=row[0])
+        return identifiers, page
+
+    def pages(self, order='id', page_size=PAGE_SIZE):
+        '''Yields (ids, TagStore) for every tag, a page at a time, ordered
+        by id or by start offset.'''
+        if order == 'start':
+            order_by = 'start, id'
+        else:
+            order_by = 'id'
+        cursor = self._connection.execute(
+            'SELECT id, {} FROM tags ORDER BY {}'.format(
+                _SELECT_COLUMNS, order_by))
+        while True:
+            rows = cursor.fetchmany(page_size)
+            if not rows:
+                break
+            page = TagStore()
+            for row in rows:
+                page.append(*row[1:], identifier=row[0])
+            yield [row[0] for row in rows], page
+
+    def overlapping(self, start, end=None):
+        '''The ascending ids of the tags overlapping [start, end].'''
+        if end is None:
+            end = start
+        return [
+            row[0] for row in self._connection.execute(
+                self._overlapping, {'start': start, 'end': end})]
+
+    def overlapping_tags(self, start, end=None):
+        '''A TagStore of the tags overlapping [start, end], in id order.'''
+        if end is None:
+            end = start
+        tags = TagStore()
+        identifiers = self.overlapping(start, end)
+        for first in range(0, len(identifiers), PAGE_SIZE):
+            batch = identifiers[first:first + PAGE_SIZE]
+            for row in self._connection.execute(
+                    'SELECT id, {} FROM tags WHERE id IN ({}) ORDER BY id'
+                    .format(_SELECT_COLUMNS, ', '.join('?' * len(batch))),
+                    batch):
+                tags.append(*row[1:], identifier=row[0])
+        return tags
+
+    def ids_with_role(self, role):
+        '''The ascending ids of the tags with a role.'''
+        return [
+            row[0] for row in self._connection.execute(
+                'SELECT id FROM tags WHERE role = ? ORDER BY id',
+                (int(role),))]
+
+    def names_with_role(self, role):
+        '''The names of the tags with a role, in id order.'''
+        return [
+            row[0] for row in self._connection.execute(
+                'SELECT name FROM tags WHERE role = ? ORDER BY id',
+                (int(role),))]
+
+
+class DatabaseTags(object):
+    '''A TagDatabase as a sequence of tags in id order.
+
+    Rows are fetched in pages, as views are scrolled, and only the ids of
+    fetched rows are held; the tags themselves are read a page at a time
+    into a small cache. Tag views from a DatabaseTags are snapshots: use
+    set_field to change a tag.
+
+    Queries give rows in the order of every tag in the database, fetched
+    or not, and rows past those fetched can be read but are only a model's
+    once fetch_rows fetches them. Rows may be fetched by fetch_rows and
+    fetch_until as well as by fetch_more, so a model over a DatabaseTags
+    sets rows_inserting and rows_inserted to be told before and after rows
+    are added.'''
+
+    def __init__(self, database, page_size=PAGE_SIZE):
+        self._database = database
+        self._page_size = page_size
+        self._ids = array('q')
+        self._pages = collections.OrderedDict()
+        self._all_fetched = False
+        self.index = DatabaseIndex(self)
+        self.rows_inserting = None
+        self.rows_inserted = None
+
+    @property
+    def database(self):
+        return self._database
+
+    def close(self):
+        self._database.close()
+
+    def __len__(self):
+        '''The number of rows fetched so far.'''
+        return len(self._ids)
+
+    @property
+    def total(self):
+        '''The number of tags in the database.'''
+        return len(self._database)
+
+    def can_fetch_more(self):
+        return not self._all_fetched
+
+    def fetch_more(self, count=None):
+        '''Fetches the ids of up to count more rows, a page by default.
+        Returns how many were fetched.'''
+        count = count or self._page_size
+        last = self._ids[-1] if self._ids else 0
+        identifiers = self._database.ids_after(last, count)
+        if len(identifiers) < count:
+            self._all_fetched = True
+        self._extend(identifiers)
+        return len(identifiers)
+
+    def _extend(self, identifiers):
+        if not identifiers:
+            return
+        first = len(self._ids)
+        if self.rows_inserting is not None:
+            self.rows_inserting(first, first + len(identifiers) - 1)
+        self._ids.extend(identifiers)
+        if self.rows_inserted is not None:
+            self.rows_inserted()
+
+    def import_tags(self, tags):
+        '''Adds every tag from an iterable in one transaction. The new rows
+        come with later fetches.'''
+        self._database.import_tags(tags)
+        self._all_fetched = False
+
+    def fetch_until(self, identifier):
+        '''Fetches every row up to the one with the given id. Returns how
+        many were fetched.'''
+        last = self._ids[-1] if self._ids else 0
+        if identifier <= last:
+            return 0
+        identifiers = self._database.ids_up_to(last, identifier)
+        self._extend(identifiers)
+        return len(identifiers)
+
+    def identifier(self, row):
+        '''The database id of a row.'''
+        return self._ids[row]
+
+    def row(self, identifier):
+        '''The row of a fetched id, or None.'''
+        row = bisect.bisect_left(self._ids, identifier)
+        if row < len(self._ids) and self._ids[row] == identifier:
+            return row
+        return None
+
+    def rows(self, identifiers):
+        '''The rows of ascending ids of tags in the database. Rows past
+        those fetched are counted rather than fetched, so they may be
+        indexed but are not yet rows of a model.'''
+        last = self._ids[-1] if self._ids else 0
+        rows = []
+        row = len(self._ids) - 1
+        for identifier in identifiers:
+            if identifier <= last:
+                rows.append(self.row(identifier))
+            else:
+                row += 1 + self._database.count_between(last, identifier)
+                rows.append(row)
+                last = identifier
+        return rows
+
+    def fetch_rows(self, count):
+        '''Fetches rows until there are at least count, if there are that
+        many.'''
+        while len(self._ids) < count and not self._all_fetched:
+            self.fetch_more(count - len(self._ids))
+
+    def _page(self, row):
+        '''The cached page holding a row, and the row's place in it, or
+        None for the place of a row past the last.'''
+        number = row // self._page_size
+        first = number * self._page_size
+        try:
+            identifiers, page = self._pages[number]
+            self._pages.move_to_end(number)
+        except KeyError:
+            if first < len(self._ids):
+                identifier = self._ids[first]
+            else:
+                # Not fetched, so found from the last row that is
+                identifier = self._database.id_after(
+                    self._ids[-1] if self._ids else 0,
+                    first - len(self._ids))
+            if identifier is None:
+                return None, None
+            identifiers, page = self._database.page(
+                identifier, self._page_size)
+            self._pages[number] = (identifiers, page)
+            if len(self._pages) > CACHED_PAGES:
+                self._pages.popitem(last=False)
+        if row < len(self._ids):
+            position = bisect.bisect_left(identifiers, self._ids[row])
+        elif row - first < len(page):
+            position = row - first
+        else:
+            position = None
+        return page, position
+
+    def __getitem__(self, row):
+        '''The tag in a row, which may be past those fetched, as rows
+        returns.'''
+        if isinstance(row, slice):
+            return [self[r] for r in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if row < 0:
+            raise IndexError('tag row out of range')
+        page, position = self._page(row)
+        if position is None:
+            raise IndexError('tag row out of range')
+        return page[position]
+
+    def __iter__(self):
+        '''Iterates over the rows fetched so far, as len and indexing see
+        them. TagDatabase.pages covers every tag in the database.'''
+        for row in range(len(self)):
+            yield self[row]
+
+    def rows_with_role(self, role):
+        '''The rows of the tags with a role, as rows gives them.'''
+        return self.rows(self._database.ids_with_role(role))
+
+    def set_field(self, row, key, value):
+        '''Sets one field of the tag in a row, in its own transaction.'''
+        self._database.update(self._ids[row], key, value)
+        self._forget_page(row)
+
+    def _forget_page(self, row):
+        self._pages.pop(row // self._page_size, None)
+
+    def append(self, tag):
+        '''Adds a tag in its own transaction. Returns its row if every row
+        has been fetched, otherwise None as it will come with a later
+        fetch.'''
+        identifier = self._database.insert(tag)
+        if not self._all_fetched:
+            return None
+        self._forget_page(len(self._ids))
+        self._extend([identifier])
+        return len(self._ids) - 1
+
+    def remove(self, row, count=1):
+        '''Deletes the tags in a run of rows.'''
+        self._database.delete(self._ids[row:row + count])
+        del self._ids[row:row + count]
+        self._pages.clear()
+
+
+class DatabaseIndex(object):
+    '''Answers IntervalIndex queries for a DatabaseTags from the database.
+    The rows given may be past those fetched, as DatabaseTags.rows gives
+    them.'''
+
+    def __init__(self, tags):
+        self._tags = tags
+
+    def overlapping(self, start, end=None):
+        '''The sorted rows of the tags overlapping [start, end].'''
+        return self._tags.rows(self._tags.database.overlapping(start, end))
+
+    def overlapping_points(self, points):
+        '''A dict mapping each point to the sorted rows overlapping it.'''
+        return {point: self.overlapping(point) for point in set(points)}
@@ -0,0 +1,322 @@
+'''Sorting and filtering the tags of a TagStore, fast enough to follow each
+key typed into a search box with a million tags.
+
+Each sort order is worked out once, as an array of rows, from copies of
+the columns it uses, so that a change to one tag can be taken in by
+finding the tag by its old fields and moving it to where its new ones put
+it, rather than by starting again. The orders also find the tags with a
+type, role, name or comment, which are next to each other in them.
+
+Text is found through a trigram index of the store's table of interned
+strings: the strings holding some text are among those holding every three
+characters of it, and only those are checked in full. As that table is
+only ever added to, so is the index.'''
+
+from array import array
+import bisect
+import itertools
+import operator
+
+__all__ = ['SORT_KEYS', 'TagIndex', 'TextIndex']
+
+# The keys tags can be sorted by, and the fields each is worked out from
+SORT_KEYS = {
+    'start': ('start',),
+    'end': ('end',),
+    'length': ('start', 'end'),
+    'type': ('type',),
+    'role': ('role',),
+    'name': ('name',),
+    'comment': ('comment',),
+    'parent': ('parent',),
+    'identifier': ('identifier',),
+}
+# The fields searched for text
+TEXT_FIELDS = ('name', 'comment')
+
+# Strings indexed together by TextIndex
+BLOCK_STRINGS = 64
+# The fields copied, as indices into TagStore.columns
+_COLUMNS = {
+    'identifier': 0,
+    'start': 1,
+    'end': 2,
+    'type': 3,
+    'role': 4,
+    'name': 5,
+    'comment': 6,
+    'parent': 10,
+}
+_STRING_FIELDS = ('name', 'comment')
+# Orders kept besides those of SORT_KEYS: of names and comments by string
+# id, to find the rows with a string
+_ORDER_FIELDS = dict(SORT_KEYS, name_id=('name',), comment_id=('comment',))
+# Rows matching the filters are sorted by themselves, rather than picked out
+# of a whole sort order, when fewer than one in this many match
+_SORT_MATCHES = 8
+# Text found in more strings than this is looked for row by row, a byte per
+# row, rather than string by string
+_FEW_STRINGS = 1024
+# The end of an offset range with no end given
+_END = (1 << 63) - 1
+
+
+def _string_key(string):
+    # Ignoring case, but in a fixed order for strings differing only in it
+    return (string.lower(), string)
+
+
+class TextIndex(object):
+    '''A trigram index over a list of strings that is only appended to,
+    such as TagStore.strings, finding the strings holding some text,
+    ignoring case.
+
+    The index is of blocks of BLOCK_STRINGS strings rather than of each
+    string, which makes it many times quicker to build, and a block that
+    might hold the text is simply searched. Strings appended since the
+    last search are indexed on the next, and those after the last whole
+    block searched directly.'''
+
+    def __init__(self, strings):
+        self._strings = strings
+        self._lowered = []
+        # trigram: array of the blocks holding it
+        self._trigrams = {}
+        # Blocks indexed
+        self._blocks = 0
+
+    def _catch_up(self):
+        strings = self._strings
+        lowered = self._lowered
+        trigrams = self._trigrams
+        lowered.extend(
+            string.lower() for string in strings[len(lowered):])
+        first = len(lowered) // BLOCK_STRINGS * BLOCK_STRINGS
+        for block in range(self._blocks, first // BLOCK_STRINGS):
+            text = '\n'.join(lowered[
+                block * BLOCK_STRINGS:(block + 1) * BLOCK_STRINGS])
+            for trigram in set(zip(text, text[1:], text[2:])):
+                try:
+                    trigrams[trigram].append(block)
+                except KeyError:
+                    trigrams[trigram] = array('L', (block,))
+        self._blocks = first // BLOCK_STRINGS
+
+    def matching(self, text):
+        '''The ids of the strings holding text, in order.'''
+        self._catch_up()
+        text = text.lower()
+        lowered = self._lowered
+        if len(text) < 3:
+            # Too short for a trigram, but then short texts are in most
+            # strings anyway
+            return [
+                string_id for string_id, string in enumerate(lowered)
+                if text in string]
+        blocks = None
+        for trigram in zip(text, text[1:], text[2:]):
+            found = self._trigrams.get(trigram, ())
+            if blocks is None or len(found) < len(blocks):
+                blocks = found
+        string_ids = [
+            string_id
+            for block in blocks
+            for string_id in range(
+                block * BLOCK_STRINGS, (block + 1) * BLOCK_STRINGS)
+            if text in lowered[string_id]]
+        string_ids.extend(
+            string_id
+            for string_id in range(
+                self._blocks * BLOCK_STRINGS, len(lowered))
+            if text in lowered[string_id])
+        return string_ids
+
+
+class TagIndex(object):
+    '''Sort orders and filters over the rows of a TagStore, built as first
+    needed.
+
+    The owner of the store passes on changes: changed for fields of a row,
+    appended for rows added at the end. Any other insertion or removal
+    needs a new TagIndex. An IntervalIndex kept over the same rows, such
+    as TagModel.interval_index, is used to filter by offset if given.'''
+
+    def __init__(self, tags, interval_index=None):
+        self._tags = tags
+        self._interval_index = interval_index
+        self._text = TextIndex(tags.strings)
+        self._count = len(tags)
+        # field: a copy of its column, as the orders know it
+        self._fields = {}
+        # sort key: array of rows in order, ties in row order
+        self._orders = {}
+
+    def __len__(self):
+        return self._count
+
+    def _field(self, field):
+        try:
+            return self._fields[field]
+        except KeyError:
+            column = self._tags.columns[_COLUMNS[field]][:self._count]
+            self._fields[field] = column
+            return column
+
+    def _sort_key(self, key):
+        '''A function giving where a row goes in the order of key, by the
+        copied fields.'''
+        if key == 'length':
+            starts = self._field('start')
+            ends = self._field('end')
+            return lambda row: (ends[row] - starts[row], row)
+        values = self._field(_ORDER_FIELDS[key][0])
+        if key in _STRING_FIELDS:
+            strings = self._tags.strings
+            return lambda row: (_string_key(strings[values[row]]), row)
+        return lambda row: (values[row], row)
+
+    def order(self, key):
+        '''The rows in order of one of SORT_KEYS, ties in row order. The
+        array is changed as the tags are.'''
+        try:
+            return self._orders[key]
+        except KeyError:
+            pass
+        if key == 'length':
+            values = array('q', map(
+                operator.sub, self._field('end'), self._field('start')))
+        elif key in _STRING_FIELDS:
+            # Sorted by the rank of each string rather than the string, so
+            # that every comparison is between integers
+            strings = self._tags.strings
+            values = self._field(key)
+            ranked = sorted(
+                set(values), key=lambda string_id: _string_key(
+                    strings[string_id]))
+            ranks = dict(zip(ranked, range(len(ranked))))
+            values = array('L', map(ranks.__getitem__, values))
+        else:
+            values = self._field(_ORDER_FIELDS[key][0])
+        order = array('L', sorted(range(self._count), key=values.__getitem__))
+        self._orders[key] = order
+        return order
+
+    def _with_value(self, key, value):
+        '''The rows with a value of the field a key is of, other than a
+        string, which are next to each other in its order.'''
+        order = self.order(key)
+        values = self._field(_ORDER_FIELDS[key][0]).__getitem__
+        return order[
+            bisect.bisect_left(order, value, key=values):
+            bisect.bisect_right(order, value, key=values)]
+
+    def changed(self, row, fields):
+        '''Takes in a change to some fields of the tag in a row.'''
+        fields = [field for field in fields if field in self._fields]
+        if not fields:
+            return
+        keys = [
+            key for key in self._orders
+            if not set(_ORDER_FIELDS[key]).isdisjoint(fields)]
+        # Found by the fields it had, and placed by those it has
+        for key in keys:
+            sort_key = self._sort_key(key)
+            order = self._orders[key]
+            del order[bisect.bisect_left(order, sort_key(row), key=sort_key)]
+        columns = self._tags.columns
+        for field in fields:
+            self._fields[field][row] = columns[_COLUMNS[field]][row]
+        for key in keys:
+            self._place(key, row)
+
+    def appended(self):
+        '''Takes in the rows appended to the tags since the index was made
+        or last told.'''
+        first = self._count
+        self._count = len(self._tags)
+        columns = self._tags.columns
+        for field, values in self._fields.items():
+            values.extend(columns[_COLUMNS[field]][first:self._count])
+        for key in self._orders:
+            for row in range(first, self._count):
+                self._place(key, row)
+
+    def _place(self, key, row):
+        sort_key = self._sort_key(key)
+        order = self._orders[key]
+        order.insert(
+            bisect.bisect_left(order, sort_key(row), key=sort_key), row)
+
+    def rows_with_text(self, text):
+        '''The rows whose name or comment holds text, ignoring case, in
+        order.'''
+        string_ids = self._text.matching(text)
+        if len(string_ids) <= _FEW_STRINGS:
+            rows = set()
+            for field in TEXT_FIELDS:
+                for string_id in string_ids:
+                    rows.update(self._with_value(field + '_id', string_id))
+            return sorted(rows)
+        found = bytearray(len(self._tags.strings))
+        for string_id in string_ids:
+            found[string_id] = 1
+        return list(itertools.compress(range(self._count), map(
+            operator.or_,
+            map(found.__getitem__, self._field('name')),
+            map(found.__getitem__, self._field('comment')))))
+
+    def matching(self, text='', types=(), roles=(), start=None, end=None):
+        '''The rows of the tags whose name or comment holds text, whose
+        type and role are among those given, and which overlap the offsets
+        from start to end, in order, or None for all rows if nothing is
+        asked for. The rows matching the first filter given are found
+        through the index, and checked against the rest.'''
+        rows = None
+        if text:
+            rows = self.rows_with_text(text)
+        for field, values in (('type', types), ('role', roles)):
+            if not values:
+                continue
+            values = {int(value) for value in values}
+            if rows is None:
+                rows = sorted(itertools.chain.from_iterable(
+                    self._with_value(field, value) for value in values))
+            else:
+                column = self._field(field)
+                rows = [row for row in rows if column[row] in values]
+        if start is not None or end is not None:
+            start = start or 0
+            end = _END if end is None else end
+            if rows is None and self._interval_index is not None:
+                rows = self._interval_index.overlapping(start, end)
+            else:
+                starts = self._field('start')
+                ends = self._field('end')
+                rows = [
+                    row for row in (
+                        range(self._count) if rows is None else rows)
+                    if starts[row] <= end and ends[row] >= start]
+        return rows
+
+    def rows(self, key=None, descending=False, **filters):
+        '''The rows matching filters, as for matching, in the order of a
+        sort key or else in row order, or None for all rows in row order.
+        The array returned is the caller's own.'''
+        matches = self.matching(**filters)
+        if key is None:
+            if matches is None:
+                return None
+            rows = array('L', matches)
+        else:
+            order = self.order(key)
+            if matches is None:
+                rows = order[:]
+            elif len(matches) * _SORT_MATCHES < len(order):
+                rows = array('L', sorted(matches, key=self._sort_key(key)))
+            else:
+                matches = set(matches)
+                rows = array('L', itertools.compress(
+                    order, map(matches.__contains__, order)))
+        if descending:
+            rows.reverse()
+        return rows
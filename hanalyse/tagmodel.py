@@ -0,0 +1,624 @@
+import os
+
+from PyQt5 import QtCore
+
+from .intervals import IntervalIndex
+from .journal import TagJournal
+from .profiling import traced
+from .tagdb import DatabaseTags, TagDatabase
+from .tags import TagRoles, TagStore, TagTypes, read_tags, write_tags
+
+__all__ = ['TagModel']
+
+# Rows whose display text is kept, the cache being emptied when full; a
+# view only shows a page of rows at a time
+MAX_DISPLAY_ROWS = 10000
+# Fields shown as hexadecimal offsets, as in the tag dialog
+_OFFSET_KEYS = ('start', 'end')
+# Fields that cannot be edited: values are decoded from the file, and
+# identifiers are what parents are found by
+_READ_ONLY_KEYS = ('value', 'identifier')
+
+
+class TagModel(QtCore.QAbstractTableModel):
+    '''A table of tags, held in a TagStore or, for large sets, read from a
+    tag database as views are scrolled.
+
+    Over a database, rows are fetched a page at a time through
+    canFetchMore and fetchMore, each edit is written through in its own
+    transaction, and values are decoded as rows are shown rather than all
+    at once.
+
+    A model over tags read from a YAML file can journal every change, see
+    read_from_file, and emits compactionDue when the journal should be
+    compacted.
+
+    The text shown for a tag is worked out for all its fields at once, the
+    first time any is painted, and kept until the tag is changed, so that
+    repainting a table costs no more than a lookup per cell.'''
+
+    compactionDue = QtCore.pyqtSignal()
+
+    def __init__(self, parent, orientation, label_order):
+        super(TagModel, self).__init__(parent)
+        self._orientation = orientation
+        self._label_order = label_order
+        self._tags = TagStore()
+        self._index = IntervalIndex()
+        self._values = []
+        self._value_decoder = None
+        self._decoded = {}
+        # item number: the DisplayRole data of each label, in order
+        self._display = {}
+        self._journal = None
+
+    @property
+    def orientation(self):
+        return self._orientation
+
+    @property
+    def label_order(self):
+        return self._label_order
+
+    @property
+    def tags(self):
+        return self._tags
+
+    @property
+    def journal(self):
+        '''The TagJournal changes are recorded in, or None.'''
+        return self._journal
+
+    def _check_journal(self):
+        if self._journal.needs_compaction:
+            self.compactionDue.emit()
+
+    @property
+    def is_database(self):
+        '''True if the tags are read from a tag database.'''
+        return isinstance(self._tags, DatabaseTags)
+
+    def _index_tag(self, position):
+        self._index.update(
+            position,
+            self._tags.starts[position],
+            self._tags.ends[position])
+
+    def set_values(self, values):
+        '''Sets the decoded value of each tag, shown under the 'value' key.
+        Tags added later have no value until set_value is called for
+        them.'''
+        self._values = list(values)
+        self._display = {}
+        self._emit_all_changed()
+
+    def set_value(self, item_number, value):
+        '''Sets the decoded value of one tag, such as one just added or
+        edited.'''
+        if self.is_database:
+            self._decoded[item_number] = value
+        else:
+            if item_number >= len(self._values):
+                self._values.extend(
+                    [None] * (item_number + 1 - len(self._values)))
+            self._values[item_number] = value
+        self._display.pop(item_number, None)
+        if self._orientation == QtCore.Qt.Horizontal:
+            self.dataChanged.emit(
+                self.index(item_number, 0),
+                self.index(item_number, self.columnCount() - 1))
+        else:
+            self.dataChanged.emit(
+                self.index(0, item_number),
+                self.index(self.rowCount() - 1, item_number))
+
+    def set_value_decoder(self, decoder):
+        '''Sets a function decoding the value of a tag, called for each row
+        as it is shown, instead of decoding every value up front.'''
+        self._value_decoder = decoder
+        self._decoded = {}
+        self._display = {}
+        self._emit_all_changed()
+
+    def _drop_values(self):
+        '''Drops the values given to set_values, once they no longer match
+        the tags, with the text shown for them.'''
+        if self._values:
+            self._values = []
+            self._display = {}
+
+    def _emit_all_changed(self):
+        if len(self._tags):
+            self.dataChanged.emit(
+                self.index(0, 0),
+                self.index(self.rowCount() - 1, self.columnCount() - 1))
+
+    @property
+    def interval_index(self):
+        '''The IntervalIndex over the tags' extents, or its equivalent for
+        a tag database.'''
+        return self._index
+
+    def tag_rows_at(self, start, end=None):
+        '''Returns the sorted rows of all tags overlapping the given offset,
+        or the range [start, end] if end is given.'''
+        return self._index.overlapping(start, end)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        else:
+            if self._orientation == QtCore.Qt.Horizontal:
+                return len(self._tags)
+            else:
+                return len(self._label_order)
+
+    def canFetchMore(self, parent):
+        if parent.isValid() or not self.is_database:
+            return False
+        return self._tags.can_fetch_more()
+
+    def fetchMore(self, parent):
+        if not parent.isValid() and self.is_database:
+            self._tags.fetch_more()
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        else:
+            if self._orientation == QtCore.Qt.Horizontal:
+                return len(self._label_order)
+            else:
+                return len(self._tags)
+
+    @traced(events=False)
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole:
+            if self._orientation == QtCore.Qt.Horizontal:
+                item_number = index.row()
+                section = index.column()
+            else:
+                item_number = index.column()
+                section = index.row()
+            try:
+                texts = self._display[item_number]
+            except KeyError:
+                # Not shown since it last changed, or not a tag at all
+                if not self._in_range(index):
+                    return None
+                texts = self._display_texts(item_number)
+            if 0 <= section < len(texts):
+                return texts[section]
+            return None
+        elif role != QtCore.Qt.EditRole or not self._in_range(index):
+            return None
+
+        if self._orientation == QtCore.Qt.Horizontal:
+            # Row is item, column is key
+            item_number = index.row()
+            key = self._label_order[index.column()][1]
+        else:
+            # Row is key, column is item
+            item_number = index.column()
+            key = self._label_order[index.row()][1]
+        return self._field(item_number, key)
+
+    def _in_range(self, index):
+        return (
+            index.isValid() and
+            0 <= index.row() < self.rowCount() and
+            0 <= index.column() < self.columnCount())
+
+    def _display_texts(self, item_number):
+        '''Works out and keeps what is shown for each field of a tag.'''
+        if len(self._display) >= MAX_DISPLAY_ROWS:
+            self._display = {}
+        tag = self._tags[item_number]
+        texts = []
+        for section in range(len(self._label_order)):
+            key = self._label_order[section][1]
+            if key in _OFFSET_KEYS:
+                texts.append('0x{:08x}'.format(getattr(tag, key)))
+            else:
+                texts.append(self._field(item_number, key, tag))
+        texts = self._display[item_number] = tuple(texts)
+        return texts
+
+    def _forget_display(self, position, removed=0, inserted=0):
+        '''Drops the kept display text of removed tags, and moves that of
+        the tags after them along by the number of tags inserted or
+        removed.'''
+        moved = inserted - removed
+        display = {}
+        for item_number, texts in self._display.items():
+            if item_number < position:
+                display[item_number] = texts
+            elif item_number >= position + removed:
+                display[item_number + moved] = texts
+        self._display = display
+
+    def _field(self, item_number, key, tag=None):
+        '''A field of a tag, with types and roles by name.'''
+        if key == 'value':
+            if item_number < len(self._values):
+                return self._values[item_number]
+            if self._value_decoder is not None:
+                try:
+                    return self._decoded[item_number]
+                except KeyError:
+                    value = self._value_decoder(self._tags[item_number])
+                    self._decoded[item_number] = value
+                    return value
+            return None
+
+        if tag is None:
+            tag = self._tags[item_number]
+        attr_val = getattr(tag, key, None)
+        if ((type(attr_val) == TagTypes) or (type(attr_val) == TagRoles)):
+            attr_val = attr_val.name
+        elif key == 'parent' and not attr_val:
+            attr_val = ''
+        return attr_val
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation != self._orientation:
+            return None
+        return self._label_order[section][0]
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid():
+            return False
+        elif not 0 <= index.row() < self.rowCount():
+            return False
+        elif not 0 <= index.column() < self.columnCount():
+            return False
+        elif role != QtCore.Qt.EditRole:
+            return False
+
+        if self._orientation == QtCore.Qt.Horizontal:
+            # row is item, column is key
+            item_number = index.row()
+            key = self._label_order[index.column()][1]
+        else:
+            # row is key, column is item
+            item_number = index.column()
+            key = self._label_order[index.row()][1]
+
+        if key in _READ_ONLY_KEYS:
+            return False
+
+        old = getattr(self._tags[item_number], key)
+        try:
+            self._tags.set_field(item_number, key, value)
+        except (ValueError, TypeError, OverflowError) as err:
+            print('Not setting {} to {!r}: {}'.format(key, value, err))
+            return False
+        if self._journal is not None:
+            # Only once it is set, as replaying it must succeed too
+            self._journal.changed(
+                item_number, key, getattr(self._tags[item_number], key),
+                old)
+            self._check_journal()
+        if key in ('start', 'end', 'type'):
+            self._decoded.pop(item_number, None)
+        self._display.pop(item_number, None)
+        if key in ('start', 'end') and not self.is_database:
+            self._index_tag(item_number)
+        self.dataChanged.emit(index, index)
+        return True
+
+    # def setHeaderData(
+    #         self,
+    #         section,
+    #         orientation,
+    #         value,
+    #         role=QtCore.Qt.EditRole):
+    #     pass
+
+    def flags(self, index):
+        if self._orientation == QtCore.Qt.Horizontal:
+            section = index.column()
+        else:
+            section = index.row()
+        if self._label_order[section][1] in _READ_ONLY_KEYS:
+            return QtCore.Qt.ItemIsSelectable | \
+                QtCore.Qt.ItemIsEnabled
+        return QtCore.Qt.ItemIsSelectable | \
+            QtCore.Qt.ItemIsEditable | \
+            QtCore.Qt.ItemIsEnabled
+
+    def insertRows(self, row, count=1, parent=QtCore.QModelIndex()):
+        success = False
+        if self._orientation == QtCore.Qt.Horizontal:
+            # Adding new items
+            # Rows of a database only come from it, see append_tag
+            if 0 <= row <= len(self._tags) and not self.is_database:
+                self._insert_items(row, count)
+                if self._journal is not None:
+                    self._journal.created(row, self._tags[row:row + count])
+                    self._check_journal()
+                success = True
+        else:
+            # Adding new labels
+            if 0 <= row <= len(self._label_order):
+                self.beginInsertRows(parent, row, row + count - 1)
+                self.endInsertRows()
+                success = True
+        return success
+
+    def removeRows(self, row, count=1, parent=QtCore.QModelIndex()):
+        success = False
+        if self._orientation == QtCore.Qt.Horizontal:
+            # Removing items
+            if row + count <= len(self._tags):
+                self.beginRemoveRows(parent, row, row + count - 1)
+                self._remove_items(row, count)
+                self.endRemoveRows()
+                success = True
+        else:
+            # Removing labels
+            if row + count <= len(self._label_order):
+                self.beginRemoveRows(parent, row, row + count - 1)
+                self.endRemoveRows()
+                success = True
+        return success
+
+    def insertColumns(self, column, count=1, parent=QtCore.QModelIndex()):
+        success = False
+        if self._orientation == QtCore.Qt.Horizontal:
+            # Adding new labels
+            if 0 <= column <= len(self._label_order):
+                self.beginInsertColumns(parent, column, column + count - 1)
+                self.endInsertColumns()
+                success = True
+        else:
+            # Adding new items
+            # Rows of a database only come from it, see append_tag
+            if 0 <= column <= len(self._tags) and not self.is_database:
+                self._insert_items(column, count)
+                if self._journal is not None:
+                    self._journal.created(
+                        column, self._tags[column:column + count])
+                    self._check_journal()
+                success = True
+        return success
+
+    def removeColumns(self, column, count=1, parent=QtCore.QModelIndex()):
+        success = False
+        if self._orientation == QtCore.Qt.Horizontal:
+            # Removing labels
+            if column + count <= len(self._label_order):
+                self.beginRemoveColumns(parent, column, column + count - 1)
+                self.endRemoveColumns()
+                success = True
+        else:
+            # Removing items
+            if column + count <= len(self._tags):
+                self.beginRemoveColumns(parent, column, column + count - 1)
+                self._remove_items(column, count)
+                self.endRemoveColumns()
+                success = True
+        return success
+
+    def _insert_items(self, position, count):
+        '''Inserts blank tags, as rows or columns.'''
+        self._begin_insert(position, position + count - 1)
+        self._tags.insert(position, count)
+        if self._values:
+            self._values[position:position] = [None] * count
+        self._decoded = {}
+        self._forget_display(position, inserted=count)
+        for c in range(count):
+            self._index.insert(position + c, 0, 0)
+        self._end_insert()
+
+    def _remove_items(self, position, count):
+        if self._journal is not None:
+            self._journal.deleted(
+                position, self._tags[position:position + count])
+            self._check_journal()
+        self._tags.remove(position, count)
+        del self._values[position:position + count]
+        self._decoded = {}
+        self._forget_display(position, removed=count)
+        if not self.is_database:
+            self._index.remove(position, count)
+
+    def clear_rows(self):
+        self.removeRows(0, self.rowCount())
+
+    def clear_columns(self):
+        self.removeColumns(0, self.columnCount())
+
+    def append_tag(self, tag):
+        if self.is_database:
+            # The row is added by the store's rows_inserting hooks, if the
+            # rows before it have all been fetched.
+            self._tags.append(tag)
+            return
+
+        try:
+            if self._orientation == QtCore.Qt.Horizontal:
+                position = self.rowCount()
+                self._insert_items(position, 1)
+                top_left = self.index(position, 0, QtCore.QModelIndex())
+                bottom_right = self.index(
+                    position,
+                    len(self._label_order) - 1,
+                    QtCore.QModelIndex())
+            else:
+                position = self.columnCount()
+                self._insert_items(position, 1)
+                top_left = self.index(0, position, QtCore.QModelIndex())
+                bottom_right = self.index(
+                    len(self._label_order) - 1,
+                    position,
+                    QtCore.QModelIndex())
+
+            # self._tags[position].update(tag)
+            self._tags[position] = tag
+            self._display.pop(position, None)
+            self._index_tag(position)
+            if self._journal is not None:
+                self._journal.created(
+                    position, self._tags[position:position + 1])
+                self._check_journal()
+            self.dataChanged.emit(top_left, bottom_right)
+
+        except Exception as err:
+            raise err
+
+    def extend_tags(self, tags):
+        '''Appends all tags from an iterable, notifying views once.'''
+        if self.is_database:
+            self._tags.import_tags(tags)
+            self.fetchMore(QtCore.QModelIndex())
+            return
+
+        store = TagStore()
+        store.extend(tags)
+        if not len(store):
+            return
+        # Numbered after the tags already here, the parents among them
+        # following
+        store.renumber(self._tags.next_identifier)
+
+        position = len(self._tags)
+        last = position + len(store) - 1
+        self._begin_insert(position, last)
+        self._tags.extend(store)
+        if self._values:
+            self._values.extend([None] * len(store))
+        self._decoded = {}
+        for row in range(len(store)):
+            self._index.insert(
+                position + row, store.starts[row], store.ends[row])
+        self._end_insert()
+        if self._journal is not None:
+            self._journal.created(position, store)
+            self._check_journal()
+
+    def _begin_insert(self, first, last):
+        if self._orientation == QtCore.Qt.Horizontal:
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+        else:
+            self.beginInsertColumns(QtCore.QModelIndex(), first, last)
+
+    def _end_insert(self):
+        if self._orientation == QtCore.Qt.Horizontal:
+            self.endInsertRows()
+        else:
+            self.endInsertColumns()
+
+    def set_tags(self, tags):
+        '''Replaces all tags with those from an iterable, resetting the
+        model once.'''
+        store = TagStore()
+        store.extend(tags)
+        self._set_store(store)
+
+    def _set_store(self, store, journal=None):
+        self.beginResetModel()
+        if self.is_database:
+            self._tags.close()
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = journal
+        self._tags = store
+        self._values = []
+        self._decoded = {}
+        self._display = {}
+        if isinstance(store, DatabaseTags):
+            store.fetch_more()
+            store.rows_inserting = self._begin_insert
+            store.rows_inserted = self._rows_inserted
+            self._index = store.index
+        else:
+            self._index = IntervalIndex()
+            self._index.reset(store.starts, store.ends)
+        self.endResetModel()
+
+    def _rows_inserted(self):
+        self._drop_values()
+        self._end_insert()
+
+    @traced()
+    def read_from_file(self, filename, use_cache=True, journal=False):
+        '''Clears the current model and reads tags from a YAML file. Unless
+        use_cache is False, the binary cache next to the file is used if it
+        is up to date, and rebuilt if not.
+
+        With journal, the changes journalled since the file was written are
+        replayed, and every change from now on is journalled; the file need
+        not exist yet. Returns the number of changes replayed.'''
+        if not journal:
+            self._set_store(read_tags(filename, use_cache))
+            return 0
+
+        if os.path.exists(filename):
+            store = read_tags(filename, use_cache)
+        else:
+            store = TagStore()
+        tag_journal = TagJournal(filename)
+        replayed = tag_journal.replay(store)
+        self._set_store(store, tag_journal)
+        return replayed
+
+    def open_database(self, filename):
+        '''Clears the current model and shows the tags of a tag database,
+        which is created if it does not exist. Only the first page of rows
+        is read.'''
+        self._set_store(DatabaseTags(TagDatabase(filename)))
+
+    def import_file(self, filename):
+        '''Appends the tags from a YAML file.'''
+        self.extend_tags(read_tags(filename))
+
+    @traced()
+    def write_to_file(self, filename):
+        '''Writes all tags to a YAML file. Sorts them by tag start offset.'''
+        if self.is_database:
+            self._tags.database.export_file(filename)
+        elif self._journal is not None:
+            # Journalled rows must match the file, so the tags are put in
+            # the order they are written in
+            self._sort_by_start()
+            if filename != self._journal.filename:
+                self._journal.close()
+                self._journal = TagJournal(filename)
+            self._journal.save(self._tags)
+        else:
+            write_tags(filename, self._tags)
+
+    def _sort_by_start(self):
+        starts = self._tags.starts
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        if all(row == old for row, old in enumerate(order)):
+            return
+
+        self.layoutAboutToBeChanged.emit()
+        store = TagStore()
+        store.extend(self._tags[old] for old in order)
+        new_rows = [0] * len(order)
+        for row, old in enumerate(order):
+            new_rows[old] = row
+        for index in self.persistentIndexList():
+            if self._orientation == QtCore.Qt.Horizontal:
+                moved = self.createIndex(
+                    new_rows[index.row()], index.column())
+            else:
+                moved = self.createIndex(
+                    index.row(), new_rows[index.column()])
+            self.changePersistentIndex(index, moved)
+        self._tags = store
+        if self._values:
+            values = self._values
+            values.extend([None] * (len(order) - len(values)))
+            self._values = [values[old] for old in order]
+        self._decoded = {}
+        self._display = {
+            new_rows[old]: texts for old, texts in self._display.items()}
+        self._index.reset(store.starts, store.ends)
+        self.layoutChanged.emit()
@@ -0,0 +1,277 @@
+from array import array
+
+from PyQt5 import QtCore
+
+from .tagindex import SORT_KEYS, TEXT_FIELDS, TagIndex
+
+__all__ = ['TagProxyModel']
+
+
+class TagProxyModel(QtCore.QAbstractProxyModel):
+    '''The rows of a TagModel, which must show tags as rows, sorted and
+    filtered through a TagIndex rather than by comparing rows one by one,
+    as QSortFilterProxyModel would.
+
+    Until a sort key or filter is set the rows are the TagModel's own, and
+    no index is built. Changes to one tag at a time, and tags appended,
+    are taken into the index; other changes build it again when next
+    needed. A TagModel over a tag database is shown as it is.'''
+
+    def __init__(self, source, parent=None):
+        super(TagProxyModel, self).__init__(parent)
+        self._tag_index = None
+        # The source rows in order, or None for all in row order
+        self._rows = None
+        # The position of each source row in _rows, or -1, made as needed
+        self._positions = None
+        self._sort_key = None
+        self._descending = False
+        self._filters = {}
+        self._resetting = False
+        self.setSourceModel(source)
+
+        source.modelAboutToBeReset.connect(self._begin_reset)
+        source.modelReset.connect(self._end_reset)
+        source.layoutAboutToBeChanged.connect(self._begin_reset)
+        source.layoutChanged.connect(self._end_reset)
+        source.rowsAboutToBeInserted.connect(self._rows_inserting)
+        source.rowsInserted.connect(self._rows_inserted)
+        source.rowsAboutToBeRemoved.connect(self._rows_removing)
+        source.rowsRemoved.connect(self._rows_removed)
+        source.dataChanged.connect(self._data_changed)
+        source.headerDataChanged.connect(self.headerDataChanged)
+
+    @property
+    def tag_index(self):
+        '''The TagIndex over the source's tags, built when first asked
+        for.'''
+        if self._tag_index is None:
+            source = self.sourceModel()
+            self._tag_index = TagIndex(source.tags, source.interval_index)
+        return self._tag_index
+
+    @property
+    def sort_key(self):
+        return self._sort_key
+
+    @property
+    def filters(self):
+        return dict(self._filters)
+
+    @property
+    def is_filtered(self):
+        '''True if rows are hidden or in another order.'''
+        return self._rows is not None
+
+    def _active(self):
+        return (
+            (self._sort_key is not None or self._filters) and
+            not self.sourceModel().is_database)
+
+    def _find_rows(self):
+        if not self._active():
+            return None
+        return self.tag_index.rows(
+            self._sort_key, self._descending, **self._filters)
+
+    def sort_by(self, key, descending=False):
+        '''Shows the rows in order of one of tagindex.SORT_KEYS, which
+        takes in length as well as the fields, or in row order for None.'''
+        if key is not None and key not in SORT_KEYS:
+            raise ValueError('Cannot sort tags by {}'.format(key))
+        self._sort_key = key
+        self._descending = descending and key is not None
+        self._refresh()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        '''Sorts by a column, for views with sorting enabled. Columns that
+        are not a sort key, and -1, show the rows in row order.'''
+        key = None
+        if 0 <= column < self.columnCount():
+            key = self.sourceModel().label_order[column][1]
+        self.sort_by(
+            key if key in SORT_KEYS else None,
+            order == QtCore.Qt.DescendingOrder)
+
+    def set_filter(self, text='', types=(), roles=(), start=None, end=None):
+        '''Shows only the tags whose name or comment holds text, ignoring
+        case, whose type and role are among those given, and which overlap
+        the offsets from start to end. Filters left out, or empty, let
+        every tag through.'''
+        filters = {}
+        if text:
+            filters['text'] = text
+        if types:
+            filters['types'] = tuple(types)
+        if roles:
+            filters['roles'] = tuple(roles)
+        if start is not None:
+            filters['start'] = start
+        if end is not None:
+            filters['end'] = end
+        self._filters = filters
+        self._refresh()
+
+    def _refresh(self):
+        '''Works the rows out again, keeping the views' places.'''
+        self.layoutAboutToBeChanged.emit()
+        indexes = self.persistentIndexList()
+        sources = [self.mapToSource(index) for index in indexes]
+        self._rows = self._find_rows()
+        self._positions = None
+        self.changePersistentIndexList(
+            indexes, [self.mapFromSource(index) for index in sources])
+        self.layoutChanged.emit()
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index):
+        return QtCore.QModelIndex()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._rows is None:
+            return self.sourceModel().rowCount()
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.sourceModel().columnCount()
+
+    def source_row(self, row):
+        '''The TagModel row shown in a row.'''
+        if self._rows is None:
+            return row
+        return self._rows[row]
+
+    def proxy_row(self, source_row):
+        '''The row a TagModel row is shown in, or -1 if it is filtered
+        out.'''
+        if self._rows is None:
+            return source_row
+        if self._positions is None:
+            positions = array('q', [-1]) * self.sourceModel().rowCount()
+            for row, shown in enumerate(self._rows):
+                positions[shown] = row
+            self._positions = positions
+        return self._positions[source_row]
+
+    def mapToSource(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        return self.sourceModel().index(
+            self.source_row(index.row()), index.column())
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QtCore.QModelIndex()
+        row = self.proxy_row(source_index.row())
+        if row < 0:
+            return QtCore.QModelIndex()
+        return self.createIndex(row, source_index.column())
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        return self.sourceModel().data(self.mapToSource(index), role)
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return self.sourceModel().flags(self.mapToSource(index))
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        return self.sourceModel().headerData(section, orientation, role)
+
+    def _begin_reset(self, *args):
+        if not self._resetting:
+            self._resetting = True
+            self.beginResetModel()
+
+    def _end_reset(self, *args):
+        if self._resetting:
+            self._tag_index = None
+            self._rows = self._find_rows()
+            self._positions = None
+            self._resetting = False
+            self.endResetModel()
+
+    def _rows_inserting(self, parent, first, last):
+        if self._rows is None:
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+        elif first != len(self.tag_index):
+            # Only rows appended are taken in one at a time
+            self._begin_reset()
+
+    def _rows_inserted(self, parent, first, last):
+        if self._resetting:
+            self._end_reset()
+            return
+        if self._tag_index is not None:
+            if first == len(self._tag_index):
+                self._tag_index.appended()
+            else:
+                self._tag_index = None
+        if self._rows is None:
+            self.endInsertRows()
+        else:
+            self._refresh()
+
+    def _rows_removing(self, parent, first, last):
+        if self._rows is None:
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+        else:
+            self._begin_reset()
+
+    def _rows_removed(self, parent, first, last):
+        if self._resetting:
+            self._end_reset()
+            return
+        self._tag_index = None
+        self.endRemoveRows()
+
+    def _data_changed(self, top_left, bottom_right, roles=()):
+        if self._resetting:
+            return
+        first = top_left.column()
+        last = bottom_right.column()
+        if top_left.row() != bottom_right.row():
+            # Values decoded, which nothing is sorted or filtered by
+            if self.rowCount():
+                self.dataChanged.emit(
+                    self.index(0, first),
+                    self.index(self.rowCount() - 1, last))
+            return
+
+        row = top_left.row()
+        label_order = self.sourceModel().label_order
+        fields = {label_order[column][1] for column in range(first, last + 1)}
+        if self._tag_index is not None:
+            self._tag_index.changed(row, fields)
+        if self._rows is not None and not fields.isdisjoint(self._used()):
+            self._refresh()
+            return
+        index = self.mapFromSource(self.sourceModel().index(row, first))
+        if index.isValid():
+            self.dataChanged.emit(
+                index, index.sibling(index.row(), last))
+
+    def _used(self):
+        '''The fields the rows shown depend on.'''
+        used = set()
+        if self._sort_key is not None:
+            used.update(SORT_KEYS[self._sort_key])
+        if 'text' in self._filters:
+            used.update(TEXT_FIELDS)
+        if 'types' in self._filters:
+            used.add('type')
+        if 'roles' in self._filters:
+            used.add('role')
+        if 'start' in self._filters or 'end' in self._filters:
+            used.update(('start', 'end'))
+        return used
@@ -1,7 +1,7 @@
+from array import array
 from enum import IntEnum
-import uuid
-import yaml
-from PyQt5 import QtCore
+
+from .tagcache import read_cache, write_cache
 
 
 class TagTypes(IntEnum):
@@ -36,420 +36,533 @@ class TagRoles(IntEnum):
     Unknown = 6
 
 
+def _to_offset(value):
+    '''Interprets a string as a decimal or hexadecimal number.'''
+    if type(value) == str:
+        if value[:2].lower() == '0x':
+            value = int(value, 16)
+        else:
+            value = int(value)
+    return value
+
+
+def _to_identifier(value):
+    '''Interprets a tag identifier, 0 for none, which may be a string of
+    decimal digits.'''
+    if type(value) == str:
+        if value.isdigit():
+            value = int(value)
+        else:
+            if value:
+                print('Ignoring tag identifier {}'.format(value))
+            value = 0
+    return value
+
+
+def _to_type(value):
+    if type(value) == str:
+        try:
+            value = TagTypes[value]
+        except KeyError:
+            print('Using Unknown for type {}'.format(value))
+            value = TagTypes.Unknown
+    return value
+
+
+def _to_role(value):
+    if type(value) == str:
+        try:
+            value = TagRoles[value]
+        except KeyError:
+            print('Using Unknown for role {}'.format(value))
+            value = TagRoles.Unknown
+    return value
+
+
+# Enum members indexed by value, the values being contiguous from zero.
+_TYPES = tuple(TagTypes)
+_ROLES = tuple(TagRoles)
+
+
+def _rows_with(column, value):
+    '''The positions of a value in a byte column.'''
+    needle = bytes([value])
+    rows = []
+    row = column.find(needle)
+    while row >= 0:
+        rows.append(row)
+        row = column.find(needle, row + 1)
+    return rows
+
+
+class TagStore(object):
+    '''The TagStore holds the metadata for many tags in columns rather
+    than one object per tag. Offsets are kept in unsigned 64-bit arrays,
+    types, roles and array element types in byte arrays, and names,
+    comments and the names of array count and size tags as indices into a
+    table of interned strings.
+
+    Each tag has an identifier, unique in its store and kept when the tags
+    are written and read back, by which other tags name it as their
+    parent; 0 is no tag. A tag appended without one is given the next
+    after the highest the store has seen.
+
+    Indexing a TagStore returns a Tag view onto that row. Views refer to
+    the row position, so a view should not be kept across removals of
+    earlier rows.'''
+
+    def __init__(self):
+        self._identifiers = array('Q')
+        self._starts = array('Q')
+        self._ends = array('Q')
+        self._types = bytearray()
+        self._roles = bytearray()
+        self._names = array('L')
+        self._comments = array('L')
+        self._ofs = bytearray()
+        self._counts = array('L')
+        self._sizes = array('L')
+        self._parents = array('Q')
+        self._strings = ['']
+        self._string_ids = {'': 0}
+        self._next_identifier = 1
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[r] for r in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('tag row out of range')
+        return Tag._view(self, row)
+
+    def __setitem__(self, row, tag):
+        '''Copies the fields of a tag into the given row, and its
+        identifier unless it has none.'''
+        self._set_row(
+            row, tag.name, tag.start, tag.end, tag.type, tag.role,
+            tag.comment, tag.of, tag.count, tag.size, tag.parent)
+        if tag.identifier:
+            self._identifiers[row] = self._take_identifier(tag.identifier)
+
+    def __iter__(self):
+        view = Tag._view
+        for row in range(len(self)):
+            yield view(self, row)
+
+    @classmethod
+    def from_columns(cls, identifiers, starts, ends, types, roles, names,
+                     comments, ofs, counts, sizes, parents, strings):
+        '''Creates a store that takes ownership of ready-made columns:
+        array('Q') identifiers, starts, ends and parents, bytearray types,
+        roles and ofs, and array('L') names, comments, counts and sizes
+        indexing into the list of strings.'''
+        store = cls()
+        store._identifiers = identifiers
+        store._starts = starts
+        store._ends = ends
+        store._types = types
+        store._roles = roles
+        store._names = names
+        store._comments = comments
+        store._ofs = ofs
+        store._counts = counts
+        store._sizes = sizes
+        store._parents = parents
+        store._strings = strings
+        store._string_ids = {
+            string: index for index, string in enumerate(strings)}
+        store._next_identifier = max(identifiers, default=0) + 1
+        return store
+
+    @property
+    def columns(self):
+        '''The columns in from_columns order, without the strings.'''
+        return (
+            self._identifiers, self._starts, self._ends, self._types,
+            self._roles, self._names, self._comments, self._ofs,
+            self._counts, self._sizes, self._parents)
+
+    @property
+    def strings(self):
+        return self._strings
+
+    @property
+    def name_ids(self):
+        '''The names of the tags, as indices into strings.'''
+        return self._names
+
+    @property
+    def identifiers(self):
+        return self._identifiers
+
+    @property
+    def parents(self):
+        '''The identifiers of the tags' parents.'''
+        return self._parents
+
+    @property
+    def starts(self):
+        return self._starts
+
+    @property
+    def ends(self):
+        return self._ends
+
+    def set_field(self, row, key, value):
+        '''Sets one field of the tag in a row.'''
+        setattr(Tag._view(self, row), key, value)
+
+    def copy(self):
+        '''Returns a new store with copies of the columns.'''
+        return TagStore.from_columns(
+            *(column[:] for column in self.columns),
+            strings=list(self._strings))
+
+    def rows_with_role(self, role):
+        '''Returns the rows of all tags with the given role.'''
+        return _rows_with(self._roles, role)
+
+    def rows_with_type(self, tag_type):
+        '''Returns the rows of all tags with the given type.'''
+        return _rows_with(self._types, tag_type)
+
+    @property
+    def next_identifier(self):
+        '''The identifier the next tag appended without one is given.'''
+        return self._next_identifier
+
+    def renumber(self, first):
+        '''Moves the identifiers up, and the parents naming them with
+        them, so that the lowest is at least first: the tags can then join
+        a store whose identifiers are all below it.'''
+        offset = first - min(self._identifiers, default=first)
+        if offset <= 0:
+            return
+        self._identifiers = array(
+            'Q', [identifier + offset for identifier in self._identifiers])
+        self._parents = array(
+            'Q', [parent + offset if parent else 0
+                  for parent in self._parents])
+        self._next_identifier += offset
+
+    def _take_identifier(self, identifier):
+        '''Returns an identifier, or the next if it is 0, and makes sure
+        none at or below it is given out again.'''
+        if not identifier:
+            identifier = self._next_identifier
+        if identifier >= self._next_identifier:
+            self._next_identifier = identifier + 1
+        return identifier
+
+    def intern(self, string):
+        '''Returns the index of a string in the string table, adding it
+        if necessary.'''
+        try:
+            return self._string_ids[string]
+        except KeyError:
+            index = len(self._strings)
+            self._strings.append(string)
+            self._string_ids[string] = index
+            return index
+
+    def string(self, index):
+        return self._strings[index]
+
+    def insert(self, row, count=1):
+        '''Inserts count blank rows before row.'''
+        first = self._next_identifier
+        self._next_identifier += count
+        self._identifiers[row:row] = array('Q', range(first, first + count))
+        zeros = array('Q', bytes(8 * count))
+        self._starts[row:row] = zeros
+        self._ends[row:row] = zeros
+        self._types[row:row] = bytes([TagTypes.Unknown]) * count
+        self._roles[row:row] = bytes([TagRoles.Unknown]) * count
+        empty = array('L', bytes(self._names.itemsize * count))
+        self._names[row:row] = empty
+        self._comments[row:row] = empty
+        self._ofs[row:row] = bytes([TagTypes.Unknown]) * count
+        self._counts[row:row] = empty
+        self._sizes[row:row] = empty
+        self._parents[row:row] = zeros
+
+    def remove(self, row, count=1):
+        for column in self.columns:
+            del column[row:row + count]
+
+    def clear(self):
+        self.remove(0, len(self))
+
+    def append(self, name='', start=0, end=0, type=TagTypes.Unknown,
+               role=TagRoles.Unknown, comment='', of=TagTypes.Unknown,
+               count='', size='', parent=0, identifier=0, **unknown):
+        '''Appends a tag built from the given fields, returning its row.
+        Unknown fields are ignored.'''
+        for key in unknown:
+            print('Ignoring unknown tag field {}'.format(key))
+        row = len(self)
+        self._identifiers.append(
+            self._take_identifier(_to_identifier(identifier)))
+        self._starts.append(_to_offset(start))
+        self._ends.append(_to_offset(end))
+        self._types.append(_to_type(type))
+        self._roles.append(_to_role(role))
+        self._names.append(self.intern(name))
+        self._comments.append(self.intern(comment))
+        self._ofs.append(_to_type(of))
+        self._counts.append(self.intern(count))
+        self._sizes.append(self.intern(size))
+        self._parents.append(_to_identifier(parent))
+        return row
+
+    def extend(self, tags):
+        '''Appends copies of the fields of each tag in an iterable, with
+        their identifiers.'''
+        for tag in tags:
+            self.append(
+                tag.name, tag.start, tag.end, tag.type, tag.role,
+                tag.comment, tag.of, tag.count, tag.size, tag.parent,
+                tag.identifier)
+
+    def _set_row(self, row, name, start, end, type, role, comment, of,
+                 count, size, parent):
+        self._starts[row] = _to_offset(start)
+        self._ends[row] = _to_offset(end)
+        self._types[row] = _to_type(type)
+        self._roles[row] = _to_role(role)
+        self._names[row] = self.intern(name)
+        self._comments[row] = self.intern(comment)
+        self._ofs[row] = _to_type(of)
+        self._counts[row] = self.intern(count)
+        self._sizes[row] = self.intern(size)
+        self._parents[row] = _to_identifier(parent)
+
+
 class Tag(object):
     ''' The Tag object is used to hold the metadata associated with a sequence
-    of bytes in the file.'''
+    of bytes in the file. It is a view onto one row of a TagStore; a Tag
+    created directly gets a store of its own.'''
 
-    def __init__(self, **kwargs):
-        self._identifier = uuid.uuid4()
-        self._parent_tag = None
+    __slots__ = ('_store', '_row')
 
-        self.name = kwargs.get('name', '')
-        self.start = kwargs.get('start', 0)
-        self.end = kwargs.get('end', 0)
-        self.type = kwargs.get('type', TagTypes.Unknown)
-        self.role = kwargs.get('role', TagRoles.Unknown)
-        self.comment = kwargs.get('comment', '')
+    def __init__(self, **kwargs):
+        self._store = TagStore()
+        self._row = self._store.append(**kwargs)
+        # Numbered by the store it is copied into, unless given
+        self._store._identifiers[self._row] = _to_identifier(
+            kwargs.get('identifier', 0))
+
+    @classmethod
+    def _view(cls, store, row):
+        tag = cls.__new__(cls)
+        tag._store = store
+        tag._row = row
+        return tag
 
     @property
     def identifier(self):
-        '''The unique identifier for the tag.'''
-        return self._identifier
+        '''The identifier of the tag, unique in its store, or 0 for a tag
+        created on its own that has not been given one.'''
+        return self._store._identifiers[self._row]
 
     @property
     def name(self):
         '''The human-readable name for a tag.'''
-        return self._name
+        return self._store._strings[self._store._names[self._row]]
 
     @name.setter
     def name(self, value):
-        self._name = value
+        self._store._names[self._row] = self._store.intern(value)
 
     @property
     def start(self):
         '''The absolute offset to the start of the tag. If set from a
         string, an attempt is made to interpret the string as a decimal
         or hexadecimal number.'''
-        return self._start
+        return self._store._starts[self._row]
 
     @start.setter
     def start(self, value):
-        if type(value) == str:
-            if value[:2].lower() == '0x':
-                value = int(value, 16)
-            else:
-                value = int(value)
-        self._start = value
+        self._store._starts[self._row] = _to_offset(value)
 
     @property
     def end(self):
         '''The absolute offset to the end of the tag. If set from a
         string, an attempt is made to interpret the string as a decimal
         or hexadecimal number.'''
-        return self._end
+        return self._store._ends[self._row]
 
     @end.setter
     def end(self, value):
-        if type(value) == str:
-            if value[:2].lower() == '0x':
-                value = int(value, 16)
-            else:
-                value = int(value)
-        self._end = value
+        self._store._ends[self._row] = _to_offset(value)
 
     @property
     def type(self):
         '''The type of data pointed to by the tag.'''
-        return self._type
+        return _TYPES[self._store._types[self._row]]
 
     @type.setter
     def type(self, value):
-        if type(value) == str:
-            try:
-                value = TagTypes[value]
-            except KeyError:
-                print('Using string for type')
-        self._type = value
+        self._store._types[self._row] = _to_type(value)
 
     @property
     def role(self):
         '''The role the tag plays in the file.'''
-        return self._role
+        return _ROLES[self._store._roles[self._row]]
 
     @role.setter
     def role(self, value):
-        if type(value) == str:
-            try:
-                value = TagRoles[value]
-            except KeyError:
-                print('Using string for role')
-        self._role = value
+        self._store._roles[self._row] = _to_role(value)
 
     @property
     def comment(self):
         '''A textual comment for the tag.'''
-        return self._comment
+        return self._store._strings[self._store._comments[self._row]]
 
     @comment.setter
     def comment(self, value):
-        self._comment = value
-
-    def __str__(self):
-        return '''Tag:
-\tParent: {}
-\tName: {}
-\tStart: {}
-\tEnd: {}
-\tType: {}
-\tRole: {}
-\tComment: {}'''.format(
-            self._parent_tag,
-            self._name,
-            self._start,
-            self._end,
-            self._type.name,
-            self._role.name,
-            self._comment)
-
-    # @classmethod
-    # def _iter_fields(cls, as_declared=False):
-    #     bases = cls.mro()[:2]
-    #     if as_declared:
-    #         bases.reverse()
-
-    #     for base in bases:
-    #         fields = base.__dict__.get('fields')
-    #         if fields:
-    #             for field in fields:
-    #                 yield field['name'], field
-
-
-class TagRepresenter(yaml.representer.SafeRepresenter):
-    def represent_tag_object(self, data):
-        # d = []
-        # for name, field in data.__class__._iter_fields(True):
-        #     d.append((name, getattr(data, name)))
-        #     return self.represent_mapping('tag:yaml.org,2002:map', d)
-        d = [
-            ('name', data.name),
-            ('start', data.start),
-            ('end', data.end),
-            ('type', data.type.name),
-            ('role', data.role.name),
-            ('comment', data.comment),
-        ]
-        return self.represent_mapping('tag:yaml.org,2002:map', d)
-
-    def represent_tag_enum(self, data):
-        return self.represent_scalar('tag:yaml.org,2002:str', data.name)
-
-TagRepresenter.add_multi_representer(
-    Tag, TagRepresenter.represent_tag_object)
-
-TagRepresenter.add_multi_representer(
-    IntEnum, TagRepresenter.represent_tag_enum)
-
-
-class TagDumper(
-        yaml.emitter.Emitter,
-        yaml.serializer.Serializer,
-        TagRepresenter,
-        yaml.resolver.Resolver):
-
-    def __init__(
-            self, stream, default_style=None, default_flow_style=None,
-            canonical=None, indent=None, width=None,
-            allow_unicode=None, line_break=None,
-            encoding=None, explicit_start=None, explicit_end=None,
-            version=None, tags=None):
-        yaml.emitter.Emitter.__init__(
-            self, stream, canonical=canonical,
-            indent=indent, width=width,
-            allow_unicode=allow_unicode, line_break=line_break)
-        yaml.serializer.Serializer.__init__(
-            self, encoding=encoding,
-            explicit_start=explicit_start, explicit_end=explicit_end,
-            version=version, tags=tags)
-        TagRepresenter.__init__(
-            self, default_style=default_style,
-            default_flow_style=default_flow_style)
-        yaml.resolver.Resolver.__init__(self)
-
-
-class TagModel(QtCore.QAbstractTableModel):
-
-    def __init__(self, parent, orientation, label_order):
-        super(TagModel, self).__init__(parent)
-        self._orientation = orientation
-        self._label_order = label_order
-        self._tags = []
+        self._store._comments[self._row] = self._store.intern(value)
 
     @property
-    def orientation(self):
-        return self._orientation
+    def of(self):
+        '''For an Array, the type of its elements.'''
+        return _TYPES[self._store._ofs[self._row]]
 
-    @property
-    def label_order(self):
-        return self._label_order
+    @of.setter
+    def of(self, value):
+        self._store._ofs[self._row] = _to_type(value)
 
     @property
-    def tags(self):
-        return self._tags
-
-    def rowCount(self, parent=QtCore.QModelIndex()):
-        if parent.isValid():
-            return 0
-        else:
-            if self._orientation == QtCore.Qt.Horizontal:
-                return len(self._tags)
-            else:
-                return len(self._label_order)
-
-    def columnCount(self, parent=QtCore.QModelIndex()):
-        if parent.isValid():
-            return 0
-        else:
-            if self._orientation == QtCore.Qt.Horizontal:
-                return len(self._label_order)
-            else:
-                return len(self._tags)
-
-    def data(self, index, role=QtCore.Qt.DisplayRole):
-        if not index.isValid():
-            return None
-        elif not 0 <= index.row() < self.rowCount():
-            return None
-        elif not 0 <= index.column() < self.columnCount():
-            return None
-        elif not (
-                (role == QtCore.Qt.DisplayRole) or
-                (role == QtCore.Qt.EditRole)):
-            return None
-
-        if self._orientation == QtCore.Qt.Horizontal:
-            # Row is item, column is key
-            item_number = index.row()
-            key = self._label_order[index.column()][1]
-        else:
-            # Row is key, column is item
-            item_number = index.column()
-            key = self._label_order[index.row()][1]
-
-        attr_val = getattr(self._tags[item_number], key, None)
-        if ((type(attr_val) == TagTypes) or (type(attr_val) == TagRoles)):
-            attr_val = attr_val.name
-        return attr_val
-
-    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
-        if role != QtCore.Qt.DisplayRole:
-            return None
-        if orientation != self._orientation:
-            return None
-        return self._label_order[section][0]
-
-    def setData(self, index, value, role=QtCore.Qt.EditRole):
-        if not index.isValid():
-            return False
-        elif not 0 <= index.row() < self.rowCount():
-            return False
-        elif not 0 <= index.column() < self.columnCount():
-            return False
-        elif role != QtCore.Qt.EditRole:
-            return False
-
-        if self._orientation == QtCore.Qt.Horizontal:
-            # row is item, column is key
-            item_number = index.row()
-            key = self._label_order[index.column()][1]
-        else:
-            # row is key, column is item
-            item_number = index.column()
-            key = self._label_order[index.row()][1]
-
-        setattr(self._tags[item_number], key, value)
-        self.dataChanged.emit(index, index)
-        return True
-
-    # def setHeaderData(
-    #         self,
-    #         section,
-    #         orientation,
-    #         value,
-    #         role=QtCore.Qt.EditRole):
-    #     pass
-
-    def flags(self, index):
-        return QtCore.Qt.ItemIsSelectable | \
-            QtCore.Qt.ItemIsEditable | \
-            QtCore.Qt.ItemIsEnabled
-
-    def insertRows(self, row, count=1, parent=QtCore.QModelIndex()):
-        success = False
-        if self._orientation == QtCore.Qt.Horizontal:
-            # Adding new items
-            if 0 <= row <= len(self._tags):
-                self.beginInsertRows(parent, row, row + count - 1)
-                for c in range(count):
-                    self._tags.insert(row + c, None)
-                self.endInsertRows()
-                success = True
-        else:
-            # Adding new labels
-            if 0 <= row <= len(self._label_order):
-                self.beginInsertRows(parent, row, row + count - 1)
-                self.endInsertRows()
-                success = True
-        return success
-
-    def removeRows(self, row, count=1, parent=QtCore.QModelIndex()):
-        success = False
-        if self._orientation == QtCore.Qt.Horizontal:
-            # Removing items
-            if row + count <= len(self._tags):
-                self.beginRemoveRows(parent, row, row + count - 1)
-                del self._tags[row:row + count]
-                self.endRemoveRows()
-                success = True
-        else:
-            # Removing labels
-            if row + count <= len(self._label_order):
-                self.beginRemoveRows(parent, row, row + count - 1)
-                self.endRemoveRows()
-                success = True
-        return success
-
-    def insertColumns(self, column, count=1, parent=QtCore.QModelIndex()):
-        success = False
-        if self._orientation == QtCore.Qt.Horizontal:
-            # Adding new labels
-            if 0 <= column <= len(self._label_order):
-                self.beginInsertColumns(parent, column, column + count - 1)
-                self.endInsertColumns()
-                success = True
-        else:
-            # Adding new items
-            if 0 <= column <= len(self._tags):
-                self.beginInsertColumns(parent, column, column + count - 1)
-                for c in range(count):
-                    self._tags.insert(column + c, None)
-                self.endInsertColumns()
-                success = True
-        return success
-
-    def removeColumns(self, column, count=1, parent=QtCore.QModelIndex()):
-        success = False
-        if self._orientation == QtCore.Qt.Horizontal:
-            # Removing labels
-            if column + count <= len(self._label_order):
-                self.beginRemoveColumns(parent, column, column + count - 1)
-                self.endRemoveColumns()
-                success = True
-        else:
-            # Removing items
-            if column + count <= len(self._tags):
-                self.beginRemoveColumns(parent, column, column + count - 1)
-                del self._tags[column:column + count]
-                self.endRemoveColumns()
-                success = True
-        return success
-
-    def clear_rows(self):
-        self.removeRows(0, self.rowCount())
+    def count(self):
+        '''For an Array, the name of the Count tag holding the number of
+        elements, or an empty string.'''
+        return self._store._strings[self._store._counts[self._row]]
 
-    def clear_columns(self):
-        self.removeColumns(0, self.columnCount())
-
-    def append_tag(self, tag):
-        try:
-            if self._orientation == QtCore.Qt.Horizontal:
-                position = self.rowCount()
-                self.insertRows(position)
-                top_left = self.index(position, 0, QtCore.QModelIndex())
-                bottom_right = self.index(
-                    position,
-                    len(self._label_order) - 1,
-                    QtCore.QModelIndex())
-            else:
-                position = self.columnCount()
-                self.insertColumns(position)
-                top_left = self.index(0, position, QtCore.QModelIndex())
-                bottom_right = self.index(
-                    len(self._label_order) - 1,
-                    position,
-                    QtCore.QModelIndex())
-
-            # self._tags[position].update(tag)
-            self._tags[position] = tag
-            self.dataChanged.emit(top_left, bottom_right)
-
-        except Exception as err:
-            raise err
-
-    def read_from_file(self, filename):
-        '''Clears the current model and reads tags from a YAML file.'''
-        load_file = open(filename, 'r')
-        tags = yaml.safe_load(load_file)
-        load_file.close()
-
-        self.clear_rows()
+    @count.setter
+    def count(self, value):
+        self._store._counts[self._row] = self._store.intern(value)
 
-        for tag in tags:
-            # Create it
-            new_tag = Tag(**tag)
+    @property
+    def size(self):
+        '''For an Array, the name of the Size tag holding the size of each
+        element, or an empty string if the size is that of its type.'''
+        return self._store._strings[self._store._sizes[self._row]]
 
-            # Store it
-            self.append_tag(new_tag)
+    @size.setter
+    def size(self, value):
+        self._store._sizes[self._row] = self._store.intern(value)
 
-    def write_to_file(self, filename):
-        '''Writes all tags to a YAML file. Sorts them by tag start offset.'''
+    @property
+    def parent(self):
+        '''The identifier of the tag this one is part of, such as the
+        record holding a field, or 0 for a top-level tag.'''
+        return self._store._parents[self._row]
 
-        def tag_start(tag):
-            return tag.start
+    @parent.setter
+    def parent(self, value):
+        self._store._parents[self._row] = _to_identifier(value)
 
-        save_file = open(filename, 'w')
-        # yaml.dump(self._tags, save_file, Dumper=TagDumper)
-        yaml.dump(
-            sorted(self._tags, key=tag_start),
-            save_file,
-            Dumper=TagDumper)
-        save_file.close()
+    def __str__(self):
+        return '''Tag:
+\tIdentifier: {}
+\tParent: {}
+\tName: {}
+\tStart: {}
+\tEnd: {}
+\tType: {}
+\tRole: {}
+\tComment: {}'''.format(
+            self.identifier,
+            self.parent or None,
+            self.name,
+            self.start,
+            self.end,
+            self.type.name,
+            self.role.name,
+            self.comment)
+
+
+# The YAML classes live in tagyaml, which imports PyYAML; they are still
+# found here, but only imported when asked for.
+_YAML_NAMES = (
+    'TagDumper', 'TagLoader', 'TagReader', 'TagWriter', 'UnexpectedTagEvent')
+
+
+def __getattr__(name):
+    if name in _YAML_NAMES:
+        from . import tagyaml
+        return getattr(tagyaml, name)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def read_tags(filename, use_cache=True):
+    '''Reads tags from a YAML file into a new TagStore. Unless use_cache
+    is False, the binary cache next to the file is used if it is up to
+    date, and rebuilt if not.'''
+    if use_cache:
+        cached = read_cache(filename)
+        if cached is not None:
+            return TagStore.from_columns(*cached)
+
+    import yaml
+    from .tagyaml import TagLoader, TagReader, UnexpectedTagEvent
+
+    def append(tag):
+        # A tag without an identifier has the one after the tag before's,
+        # as TagWriter leaves it out where that is the tag's own.
+        if 'identifier' not in tag:
+            tag['identifier'] = store.identifiers[-1] + 1 if store else 1
+        store.append(**tag)
+
+    store = TagStore()
+    load_file = open(filename, 'r')
+    try:
+        for tag in TagReader(load_file):
+            append(tag)
+    except UnexpectedTagEvent:
+        # Not laid out as we write it, so construct it in full.
+        load_file.seek(0)
+        store = TagStore()
+        for tag in yaml.load(load_file, Loader=TagLoader):
+            append(tag)
+    load_file.close()
+
+    if use_cache:
+        try:
+            write_cache(filename, store)
+        except OSError as err:
+            print('Could not write tag cache: {}'.format(err))
+
+    return store
+
+
+def write_tags(filename, tags, sort=True, exact=False):
+    '''Writes tags to a YAML file. Sorts them by tag start offset unless
+    sort is False. Identifiers are written as TagWriter does, so that they
+    all read back as they are if exact is true, and otherwise only as far
+    as parents need them.'''
+
+    def tag_start(tag):
+        return tag.start
+
+    from .tagyaml import TagWriter
+
+    if isinstance(tags, TagStore):
+        parents = set(tags.parents)
+    else:
+        tags = list(tags)
+        parents = {tag.parent for tag in tags}
+    parents.discard(0)
+
+    save_file = open(filename, 'w')
+    writer = TagWriter(save_file, parents, exact)
+    writer.open()
+    for tag in sorted(tags, key=tag_start) if sort else tags:
+        writer.write(tag)
+    writer.close()
+    save_file.close()
@@ -0,0 +1,328 @@
+from PyQt5 import QtCore
+
+from .hierarchy import TOP, TagHierarchy
+
+__all__ = ['TagTreeModel']
+
+# Children added to the tree at a time, as a node is expanded or scrolled
+FETCH_ROWS = 1000
+
+
+class _Node(object):
+    '''A tag with children shown in the tree, or the top level. An index
+    points to the node of its parent, as PyQt can only keep objects in an
+    index, and a node is only made for a tag whose children are shown.'''
+
+    __slots__ = ('row', 'fetched')
+
+    def __init__(self, row):
+        self.row = row
+        # How many children views have been told of
+        self.fetched = 0
+
+
+class TagTreeModel(QtCore.QAbstractItemModel):
+    '''The tags of a TagModel as a tree, each under the tag whose
+    identifier is its parent, with the TagModel's columns.
+
+    The hierarchy is only built once the tree is first shown, and the
+    children of a tag are added FETCH_ROWS at a time through canFetchMore
+    and fetchMore, so a tag with a great many children expands at once.
+    Data and edits go through to the TagModel, which must show tags as
+    rows.
+
+    Appending tags, or changing the parent of a tag, moves just that tag
+    and its children; a change that would make a loop, or to the
+    identifier of a tag with children, lays the tree out again, and
+    inserting or removing other rows resets it. The TagModel changes
+    parents a row at a time: a change to many rows at once is taken to be
+    to their values.'''
+
+    def __init__(self, source, parent=None):
+        super(TagTreeModel, self).__init__(parent)
+        self._source = source
+        self._hierarchy = None
+        self._nodes = {}
+        self._root = _Node(TOP)
+        self._resetting = False
+        # Set while views are told of rows added or moved, as some fetch
+        # more on being told, and would see the rows early
+        self._notifying = False
+
+        source.modelAboutToBeReset.connect(self._begin_reset)
+        source.modelReset.connect(self._end_reset)
+        source.layoutAboutToBeChanged.connect(self._begin_reset)
+        source.layoutChanged.connect(self._end_reset)
+        source.rowsAboutToBeRemoved.connect(self._begin_reset)
+        source.rowsRemoved.connect(self._end_reset)
+        source.rowsAboutToBeInserted.connect(self._rows_inserting)
+        source.rowsInserted.connect(self._rows_inserted)
+        source.dataChanged.connect(self._data_changed)
+        source.headerDataChanged.connect(self.headerDataChanged)
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def hierarchy(self):
+        '''The TagHierarchy, built when first asked for.'''
+        if self._hierarchy is None:
+            self._hierarchy = TagHierarchy(self._source.tags)
+        return self._hierarchy
+
+    def _node(self, row):
+        if row == TOP:
+            return self._root
+        try:
+            return self._nodes[row]
+        except KeyError:
+            node = self._nodes[row] = _Node(row)
+            return node
+
+    def _node_index(self, node):
+        '''The index of the tag a node is for.'''
+        if node.row == TOP:
+            return QtCore.QModelIndex()
+        hierarchy = self.hierarchy
+        return self.createIndex(
+            hierarchy.position(node.row), 0,
+            self._node(hierarchy.parent(node.row)))
+
+    def _index_node(self, index):
+        '''The node of the tag at an index, whose children it holds.'''
+        if not index.isValid():
+            return self._root
+        return self._node(self.tag_row(index))
+
+    def tag_row(self, index):
+        '''The TagModel row of the tag at an index.'''
+        node = index.internalPointer()
+        return self.hierarchy.children(node.row)[index.row()]
+
+    def tag_index(self, row, column=0):
+        '''The index of the tag in a TagModel row, fetching the children of
+        its ancestors as far as it.'''
+        hierarchy = self.hierarchy
+        parent = QtCore.QModelIndex()
+        node = self._root
+        for ancestor in hierarchy.path(row):
+            position = hierarchy.position(ancestor)
+            while node.fetched <= position:
+                self.fetchMore(parent)
+            parent = self.createIndex(position, 0, node)
+            node = self._node(ancestor)
+        return parent.sibling(parent.row(), column)
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, self._index_node(parent))
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        return self._node_index(index.internalPointer())
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return self._index_node(parent).fetched
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return self._source.columnCount()
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return False
+        return self.hierarchy.child_count(self._index_node(parent).row) > 0
+
+    def canFetchMore(self, parent):
+        if parent.column() > 0 or self._notifying:
+            return False
+        node = self._index_node(parent)
+        return node.fetched < self.hierarchy.child_count(node.row)
+
+    def fetchMore(self, parent):
+        node = self._index_node(parent)
+        total = self.hierarchy.child_count(node.row)
+        count = min(FETCH_ROWS, total - node.fetched)
+        if count <= 0 or self._notifying:
+            return
+        self._notifying = True
+        try:
+            self.beginInsertRows(
+                parent, node.fetched, node.fetched + count - 1)
+            node.fetched += count
+            self.endInsertRows()
+        finally:
+            self._notifying = False
+
+    def _source_index(self, index):
+        return self._source.index(self.tag_row(index), index.column())
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        return self._source.data(self._source_index(index), role)
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid():
+            return False
+        return self._source.setData(self._source_index(index), value, role)
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return self._source.flags(self._source_index(index))
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        return self._source.headerData(section, orientation, role)
+
+    def _begin_reset(self, *args):
+        if not self._resetting:
+            self._resetting = True
+            self.beginResetModel()
+
+    def _end_reset(self, *args):
+        if self._resetting:
+            self._hierarchy = None
+            self._nodes = {}
+            self._root = _Node(TOP)
+            self._resetting = False
+            self.endResetModel()
+
+    def _relayout(self):
+        '''Builds the hierarchy again, keeping the views' places, after a
+        change that leaves every row where it was.'''
+        self.layoutAboutToBeChanged.emit()
+        old = self._hierarchy
+        indexes = self.persistentIndexList()
+        rows = [
+            old.children(index.internalPointer().row)[index.row()]
+            for index in indexes]
+        self._hierarchy = hierarchy = TagHierarchy(self._source.tags)
+        for node in list(self._nodes.values()) + [self._root]:
+            node.fetched = min(node.fetched, hierarchy.child_count(node.row))
+        for index, row in zip(indexes, rows):
+            # Shown where it now is, as if its ancestors were expanded
+            node = self._root
+            for ancestor in hierarchy.path(row):
+                node.fetched = max(
+                    node.fetched, hierarchy.position(ancestor) + 1)
+                parent_node = node
+                node = self._node(ancestor)
+            self.changePersistentIndex(index, self.createIndex(
+                hierarchy.position(row), index.column(), parent_node))
+        self.layoutChanged.emit()
+
+    def _rows_inserting(self, parent, first, last):
+        # Only rows appended are taken in one at a time
+        if self._hierarchy is not None and first != len(self._hierarchy):
+            self._begin_reset()
+
+    def _rows_inserted(self, parent, first, last):
+        if self._resetting:
+            self._end_reset()
+            return
+        if self._hierarchy is None:
+            return
+        hierarchy = self._hierarchy
+        tags = self._source.tags
+        for row in range(first, last + 1):
+            tag = tags[row]
+            # Appended after every row shown, so the rows shown stay put
+            parent_row = hierarchy.append(tag.identifier, tag.parent)
+            if parent_row is None:
+                self._begin_reset()
+                self._end_reset()
+                return
+            node = self._node(parent_row)
+            if node.fetched == hierarchy.child_count(parent_row) - 1:
+                self._notifying = True
+                self.beginInsertRows(
+                    self._node_index(node), node.fetched, node.fetched)
+                node.fetched += 1
+                self.endInsertRows()
+                self._notifying = False
+
+    def _data_changed(self, top_left, bottom_right, roles=()):
+        if self._hierarchy is None or self._resetting:
+            return
+        row = top_left.row()
+        if row == bottom_right.row():
+            keys = {
+                self._source.label_order[column][1]
+                for column in range(
+                    top_left.column(), bottom_right.column() + 1)}
+            if keys & {'identifier', 'parent'}:
+                self._move(row)
+        self._forward_changes(top_left, bottom_right)
+
+    def _move(self, row):
+        '''Takes in a change to the identifier or parent of the tag in a
+        row.'''
+        hierarchy = self._hierarchy
+        tag = self._source.tags[row]
+        identifier = tag.identifier
+        parent = tag.parent
+        parent_row = hierarchy.new_parent(row, identifier, parent)
+        if parent_row is None:
+            self._relayout()
+            return
+        old_parent = hierarchy.parent(row)
+        if parent_row == old_parent:
+            hierarchy.update(row, identifier, parent, parent_row)
+            return
+
+        old_node = self._node(old_parent)
+        old_position = hierarchy.position(row)
+        was_shown = old_position < old_node.fetched
+        node = self._node(parent_row)
+        position = hierarchy.insertion_position(row, parent_row)
+        shown = position < node.fetched or (
+            node.fetched == hierarchy.child_count(parent_row))
+
+        self._notifying = True
+        if was_shown and shown:
+            self.beginMoveRows(
+                self._node_index(old_node), old_position, old_position,
+                self._node_index(node), position)
+        elif was_shown:
+            self.beginRemoveRows(
+                self._node_index(old_node), old_position, old_position)
+        elif shown:
+            self.beginInsertRows(self._node_index(node), position, position)
+        hierarchy.update(row, identifier, parent, parent_row)
+        if was_shown:
+            old_node.fetched -= 1
+        if shown:
+            node.fetched += 1
+        if was_shown and shown:
+            self.endMoveRows()
+        elif was_shown:
+            self.endRemoveRows()
+        elif shown:
+            self.endInsertRows()
+        self._notifying = False
+
+    def _forward_changes(self, top_left, bottom_right):
+        '''Passes on a change to the data of TagModel rows, for the rows
+        the tree shows.'''
+        hierarchy = self._hierarchy
+        first = top_left.column()
+        last = bottom_right.column()
+        if top_left.row() != bottom_right.row():
+            for node in [self._root] + list(self._nodes.values()):
+                if node.fetched:
+                    self.dataChanged.emit(
+                        self.createIndex(0, first, node),
+                        self.createIndex(node.fetched - 1, last, node))
+            return
+        row = top_left.row()
+        node = self._node(hierarchy.parent(row))
+        position = hierarchy.position(row)
+        if position < node.fetched:
+            self.dataChanged.emit(
+                self.createIndex(position, first, node),
+                self.createIndex(position, last, node))
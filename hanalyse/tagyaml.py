@@ -0,0 +1,267 @@
+'''Reading and writing tags as YAML.
+
+Kept apart from tags so that the tag stores, which the headless commands
+use without ever touching a tag file, do not pay for importing PyYAML;
+read_tags and write_tags import this module when they are first called.'''
+
+from enum import IntEnum
+
+import yaml
+from yaml.events import (
+    StreamStartEvent, StreamEndEvent, DocumentStartEvent, DocumentEndEvent,
+    SequenceStartEvent, SequenceEndEvent, MappingStartEvent, MappingEndEvent,
+    ScalarEvent)
+
+from .tags import Tag, TagTypes
+
+__all__ = ['TagDumper', 'TagLoader', 'TagReader', 'TagWriter',
+           'UnexpectedTagEvent']
+
+
+class TagRepresenter(yaml.representer.SafeRepresenter):
+    def __init__(self, default_style=None, default_flow_style=False,
+                 sort_keys=True):
+        yaml.representer.SafeRepresenter.__init__(
+            self, default_style=default_style,
+            default_flow_style=default_flow_style, sort_keys=sort_keys)
+        # The identifier the next tag is given if it is read back without
+        # one. Unlike TagWriter, which knows the parents, every identifier
+        # reading would not give back is written.
+        self._next_identifier = 1
+
+    def represent_tag_object(self, data):
+        # d = []
+        # for name, field in data.__class__._iter_fields(True):
+        #     d.append((name, getattr(data, name)))
+        #     return self.represent_mapping('tag:yaml.org,2002:map', d)
+        d = [
+            ('name', data.name),
+            ('start', data.start),
+            ('end', data.end),
+            ('type', data.type.name),
+            ('role', data.role.name),
+            ('comment', data.comment),
+        ]
+        if data.type == TagTypes.Array:
+            d.extend([
+                ('of', data.of.name),
+                ('count', data.count),
+                ('size', data.size),
+            ])
+        identifier = data.identifier
+        if identifier and identifier != self._next_identifier:
+            d.append(('identifier', identifier))
+        self._next_identifier = (identifier or self._next_identifier) + 1
+        if data.parent:
+            d.append(('parent', data.parent))
+        return self.represent_mapping('tag:yaml.org,2002:map', d)
+
+    def represent_tag_enum(self, data):
+        return self.represent_scalar('tag:yaml.org,2002:str', data.name)
+
+TagRepresenter.add_multi_representer(
+    Tag, TagRepresenter.represent_tag_object)
+
+TagRepresenter.add_multi_representer(
+    IntEnum, TagRepresenter.represent_tag_enum)
+
+
+class TagDumper(
+        yaml.emitter.Emitter,
+        yaml.serializer.Serializer,
+        TagRepresenter,
+        yaml.resolver.Resolver):
+
+    def __init__(
+            self, stream, default_style=None, default_flow_style=None,
+            canonical=None, indent=None, width=None,
+            allow_unicode=None, line_break=None,
+            encoding=None, explicit_start=None, explicit_end=None,
+            version=None, tags=None, sort_keys=True):
+        yaml.emitter.Emitter.__init__(
+            self, stream, canonical=canonical,
+            indent=indent, width=width,
+            allow_unicode=allow_unicode, line_break=line_break)
+        yaml.serializer.Serializer.__init__(
+            self, encoding=encoding,
+            explicit_start=explicit_start, explicit_end=explicit_end,
+            version=version, tags=tags)
+        TagRepresenter.__init__(
+            self, default_style=default_style,
+            default_flow_style=default_flow_style,
+            sort_keys=sort_keys)
+        yaml.resolver.Resolver.__init__(self)
+
+
+# Use libyaml when PyYAML was built with it.
+try:
+    from yaml import CSafeLoader as TagLoader
+    from yaml._yaml import CEmitter as TagEmitter
+except ImportError:
+    from yaml import SafeLoader as TagLoader
+    from yaml.emitter import Emitter as TagEmitter
+
+_INT_TAG = 'tag:yaml.org,2002:int'
+_STR_TAG = 'tag:yaml.org,2002:str'
+_MAP_TAG = 'tag:yaml.org,2002:map'
+_SEQ_TAG = 'tag:yaml.org,2002:seq'
+
+
+class UnexpectedTagEvent(Exception):
+    pass
+
+
+class TagReader(object):
+    '''Reads tags from a YAML stream by walking the parser events, without
+    composing or constructing the whole document. Only the layout that
+    TagWriter produces is understood, a sequence of mappings of scalars;
+    anything else raises UnexpectedTagEvent so the caller can fall back to
+    a full load.'''
+
+    # Integers, which may be written as strings, as TagStore reads them
+    _offset_keys = ('start', 'end', 'identifier', 'parent')
+    _string_keys = (
+        'name', 'type', 'role', 'comment', 'of', 'count', 'size')
+
+    def __init__(self, stream):
+        self._events = yaml.parse(stream, Loader=TagLoader)
+        self._resolver = yaml.resolver.Resolver()
+        self._constructor = yaml.constructor.SafeConstructor()
+
+    def _scalar(self, key, event):
+        value = event.value
+        if event.implicit[0]:
+            tag = self._resolver.resolve(
+                yaml.ScalarNode, value, event.implicit)
+        else:
+            tag = event.tag if event.tag not in (None, '!') else _STR_TAG
+        if key in self._offset_keys:
+            if tag == _INT_TAG:
+                if value.isdigit():
+                    return int(value)
+                return self._constructor.construct_yaml_int(
+                    yaml.ScalarNode(tag, value))
+            if tag == _STR_TAG:
+                return value
+        elif key in self._string_keys and tag == _STR_TAG:
+            return value
+        raise UnexpectedTagEvent(event)
+
+    def __iter__(self):
+        events = iter(self._events)
+        expected = (StreamStartEvent, DocumentStartEvent, SequenceStartEvent)
+        for cls in expected:
+            event = next(events)
+            if not isinstance(event, cls):
+                raise UnexpectedTagEvent(event)
+
+        for event in events:
+            if isinstance(event, SequenceEndEvent):
+                break
+            if not isinstance(event, MappingStartEvent):
+                raise UnexpectedTagEvent(event)
+            fields = {}
+            for key_event in events:
+                if isinstance(key_event, MappingEndEvent):
+                    break
+                value_event = next(events)
+                if not (isinstance(key_event, ScalarEvent) and
+                        isinstance(value_event, ScalarEvent)):
+                    raise UnexpectedTagEvent(key_event)
+                key = key_event.value
+                fields[key] = self._scalar(key, value_event)
+            yield fields
+
+
+class TagWriter(object):
+    '''Writes tags to a YAML stream one at a time, emitting events
+    directly rather than building a representation of the whole list.
+
+    The output is the same as dumping the list of tags with TagDumper: a
+    block sequence of flow mappings. A tag's parent is written only if it
+    has one, and its identifier only if it is in parents, the identifiers
+    that tags name as their parent, or if the identifiers must read back
+    as they are, which they must if there are parents or if exact is true,
+    and reading would not give it back. A tag read without an identifier
+    is given the one after the tag before it, so tags numbered in order,
+    as they are when read from a file without identifiers, are written as
+    they were.'''
+
+    _keys = (
+        'name', 'start', 'end', 'type', 'role', 'comment', 'of', 'count',
+        'size', 'identifier', 'parent')
+
+    def __init__(self, stream, parents=(), exact=False):
+        self._emitter = TagEmitter(stream)
+        self._resolver = yaml.resolver.Resolver()
+        self._key_events = [self._str_event(key) for key in self._keys]
+        self._enum_events = {}
+        self._parents = parents
+        self._exact = exact or bool(parents)
+        self._next_identifier = 1
+
+    def _str_event(self, value):
+        '''Creates a scalar event for a string, quoting it (as the
+        serializer would) where it could be read back as another type.'''
+        resolve = self._resolver.resolve
+        implicit = (
+            resolve(yaml.ScalarNode, value, (True, False)) == _STR_TAG,
+            resolve(yaml.ScalarNode, value, (False, True)) == _STR_TAG)
+        return ScalarEvent(None, _STR_TAG, implicit, value)
+
+    def _enum_event(self, value):
+        # Keyed by name, as members of different IntEnums compare equal.
+        name = value.name
+        try:
+            return self._enum_events[name]
+        except KeyError:
+            event = self._enum_events[name] = self._str_event(name)
+            return event
+
+    def open(self):
+        emit = self._emitter.emit
+        emit(StreamStartEvent())
+        emit(DocumentStartEvent(explicit=False))
+        emit(SequenceStartEvent(None, _SEQ_TAG, True, flow_style=False))
+
+    def write(self, tag):
+        emit = self._emitter.emit
+        keys = self._key_events
+        emit(MappingStartEvent(None, _MAP_TAG, True, flow_style=True))
+        emit(keys[0])
+        emit(self._str_event(tag.name))
+        emit(keys[1])
+        emit(ScalarEvent(None, _INT_TAG, (True, False), str(tag.start)))
+        emit(keys[2])
+        emit(ScalarEvent(None, _INT_TAG, (True, False), str(tag.end)))
+        emit(keys[3])
+        emit(self._enum_event(tag.type))
+        emit(keys[4])
+        emit(self._enum_event(tag.role))
+        emit(keys[5])
+        emit(self._str_event(tag.comment))
+        if tag.type == TagTypes.Array:
+            emit(keys[6])
+            emit(self._enum_event(tag.of))
+            emit(keys[7])
+            emit(self._str_event(tag.count))
+            emit(keys[8])
+            emit(self._str_event(tag.size))
+        identifier = tag.identifier
+        if identifier and (
+                identifier in self._parents or
+                self._exact and identifier != self._next_identifier):
+            emit(keys[9])
+            emit(ScalarEvent(None, _INT_TAG, (True, False), str(identifier)))
+        self._next_identifier = (identifier or self._next_identifier) + 1
+        parent = tag.parent
+        if parent:
+            emit(keys[10])
+            emit(ScalarEvent(None, _INT_TAG, (True, False), str(parent)))
+        emit(MappingEndEvent())
+
+    def close(self):
+        emit = self._emitter.emit
+        emit(SequenceEndEvent())
+        emit(DocumentEndEvent(explicit=False))
+        emit(StreamEndEvent())